@@ -1,5 +1,12 @@
 import os
-from flask import Flask
+import time
+
+_import_started = time.perf_counter()
+
+from flask import Flask  # noqa: E402
+
+# Tempo di import di Flask e del package (rapporto di avvio, app/startup.py)
+IMPORT_MS = (time.perf_counter() - _import_started) * 1000
 
 
 def create_app(test_config=None):
@@ -7,11 +14,141 @@ def create_app(test_config=None):
     Application Factory per creare l'istanza Flask.
     Segue le best practices Flask per la configurazione modulare.
     """
+    started = time.perf_counter()
     app = Flask(__name__, instance_relative_config=True)
 
     app.config.from_mapping(
         SECRET_KEY=os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production'),
         DATABASE=os.path.join(app.instance_path, 'skilltracker.db'),
+        # Connessioni in sola lettura per le richieste GET e journal WAL
+        DB_READ_ONLY_GET=True,
+        DB_WAL=True,
+        # Sharding dei dati utente (0 = disattivato, tutto in DATABASE)
+        DB_SHARDS=0,
+        SHARD_DIR=os.path.join(app.instance_path, 'shards'),
+        # Group commit per la registrazione delle sessioni
+        GROUP_COMMIT_ENABLED=False,
+        GROUP_COMMIT_MAX_BATCH=64,
+        GROUP_COMMIT_MAX_DELAY_MS=5,
+        GROUP_COMMIT_TIMEOUT=10,
+        # Job in background: eseguiti solo dopo N secondi senza richieste,
+        # in un solo processo alla volta (lock su file, None = per processo)
+        SCHEDULER_IDLE_SECONDS=5,
+        SCHEDULER_LOCK_DIR=os.path.join(app.instance_path, 'scheduler'),
+        # Manutenzione periodica del database (intervalli in secondi)
+        DB_MAINTENANCE_ENABLED=False,
+        DB_CHECKPOINT_INTERVAL=300,
+        DB_ANALYZE_INTERVAL=3600,
+        DB_VACUUM_INTERVAL=86400,
+        DB_MAINTENANCE_SLICE_MS=50,
+        DB_ANALYSIS_LIMIT=1000,
+        # Backup online (flask db-backup e job periodico)
+        BACKUP_ENABLED=False,
+        BACKUP_INTERVAL=86400,
+        BACKUP_DIR=os.path.join(app.instance_path, 'backups'),
+        BACKUP_KEEP=7,
+        BACKUP_COMPRESS=True,
+        BACKUP_PAGES_PER_STEP=256,
+        BACKUP_STEP_SLEEP_MS=10,
+        # Archivio delle sessioni vecchie
+        ARCHIVE_ENABLED=False,
+        ARCHIVE_HORIZON_DAYS=365,
+        ARCHIVE_CHUNK_SIZE=1000,
+        ANALYTICS_CACHE_SIZE=256,
+        FORECAST_WINDOW_DAYS=28,
+        FORECAST_MAX_DAYS=3650,
+        FORECAST_CACHE_SIZE=4096,
+        # Classifiche globali (opt-in degli utenti)
+        LEADERBOARDS_ENABLED=False,
+        LEADERBOARD_PAGE_SIZE=50,
+        # Eliminazione differita di skills e utenti: righe dipendenti
+        # rimosse in background a blocchi di PURGE_BATCH_SIZE
+        DEFERRED_DELETE_ENABLED=False,
+        PURGE_BATCH_SIZE=500,
+        PURGE_INTERVAL=60,
+        PURGE_PAUSE_MS=10,
+        # API JSON (/api/v1): dimensione delle pagine, compressione gzip
+        # e numero massimo di sotto-richieste per /api/v1/batch
+        API_PAGE_SIZE=50,
+        API_MAX_PAGE_SIZE=500,
+        API_GZIP_MIN_BYTES=1024,
+        API_GZIP_LEVEL=6,
+        API_BATCH_MAX_REQUESTS=20,
+        # Sincronizzazione incrementale (/api/v1/sync): modifiche per
+        # risposta e compattazione del registro (0 = nessun job periodico)
+        SYNC_PAGE_SIZE=1000,
+        SYNC_MAX_PAGE_SIZE=5000,
+        SYNC_COMPACT_INTERVAL=3600,
+        SYNC_TOMBSTONE_DAYS=30,
+        # Aggiornamenti in tempo reale della dashboard (Server-Sent Events):
+        # il registro delle modifiche viene controllato ogni
+        # EVENTS_POLL_INTERVAL secondi per le scritture degli altri worker
+        EVENTS_ENABLED=False,
+        EVENTS_HEARTBEAT_SECONDS=15,
+        EVENTS_QUEUE_SIZE=100,
+        EVENTS_MAX_STREAMS_PER_USER=5,
+        EVENTS_POLL_INTERVAL=1,
+        # Chiavi di idempotenza delle scritture (header Idempotency-Key
+        # o campo nascosto dei form): durata, secondi dopo i quali una
+        # chiave senza esito salvato non è più "in corso" e pulizia periodica
+        IDEMPOTENCY_TTL=86400,
+        IDEMPOTENCY_PENDING_TIMEOUT=60,
+        IDEMPOTENCY_CLEANUP_INTERVAL=3600,
+        IDEMPOTENCY_CLEANUP_BATCH=1000,
+        # Server di produzione (flask serve / python -m app.serve): processi
+        # worker, thread per worker, connessioni in coda oltre le quali si
+        # risponde 503, stream /events per worker (thread dedicati, fuori
+        # dal pool) e secondi concessi per completare le richieste
+        SERVE_HOST='127.0.0.1',
+        SERVE_PORT=8000,
+        SERVE_WORKERS=os.cpu_count() or 1,
+        SERVE_THREADS=8,
+        SERVE_QUEUE_SIZE=64,
+        SERVE_STREAMS=64,
+        SERVE_BACKLOG=1024,
+        SERVE_GRACEFUL_TIMEOUT=30,
+        SERVE_ACCESS_LOG=False,
+        # Cache su file del bytecode dei template Jinja (None = disattivata)
+        JINJA_BYTECODE_CACHE_DIR=os.path.join(app.instance_path, 'jinja_cache'),
+        # Profiler a campionamento delle richieste (pagina /admin/profiles):
+        # frazione di richieste, header+token per forzarlo, intervallo tra
+        # i campioni e scrittura periodica dei file
+        PROFILING_ENABLED=False,
+        PROFILING_SAMPLE_RATE=0.01,
+        PROFILING_HEADER='X-Profile',
+        PROFILING_TOKEN=None,
+        PROFILING_INTERVAL_MS=5,
+        PROFILING_FLUSH_INTERVAL=60,
+        PROFILING_DIR=os.path.join(app.instance_path, 'profiles'),
+        # Memoria per richiesta con tracemalloc (pagina /admin/memory):
+        # budget oltre il quale la richiesta va nel log e frazione delle
+        # richieste di cui si cercano le righe che allocano di più
+        MEMORY_TRACKING_ENABLED=False,
+        MEMORY_BUDGET_KB=5120,
+        MEMORY_SNAPSHOT_RATE=0.01,
+        MEMORY_TOP_SITES=10,
+        MEMORY_TRACEBACK_FRAMES=1,
+        # Metriche in formato Prometheus (/metrics): cartella dei valori di
+        # ogni processo, intervallo di scrittura e token Bearer facoltativo
+        METRICS_ENABLED=False,
+        METRICS_DIR=os.path.join(app.instance_path, 'metrics'),
+        METRICS_FLUSH_INTERVAL=5,
+        METRICS_TOKEN=None,
+        # Cache dei metodi di lettura dei repository: None (disattivata),
+        # 'memory' (LRU del processo) o 'sqlite' (file condiviso dai worker)
+        REPOSITORY_CACHE_BACKEND=None,
+        REPOSITORY_CACHE_SIZE=4096,
+        REPOSITORY_CACHE_TTL=300,
+        REPOSITORY_CACHE_PATH=os.path.join(app.instance_path, 'repository_cache.db'),
+        # Database bloccato da un'altra scrittura: attesa massima del lock
+        # per tentativo, tentativi ripetuti di BEGIN IMMEDIATE e COMMIT e
+        # backoff esponenziale con jitter tra un tentativo e l'altro
+        DB_BUSY_TIMEOUT_MS=1000,
+        DB_BUSY_RETRIES=5,
+        DB_BUSY_BACKOFF_MS=25,
+        DB_BUSY_BACKOFF_MAX_MS=1000,
+        # Username che possono accedere alle pagine /admin
+        ADMIN_USERNAMES=[],
     )
 
     if test_config is None:
@@ -29,6 +166,60 @@ def create_app(test_config=None):
     from app.db import init_app
     init_app(app)
 
+    from app.group_commit import init_app as init_group_commit
+    init_group_commit(app)
+
+    from app.events import init_app as init_events
+    init_events(app)
+
+    from app.scheduler import init_app as init_scheduler
+    init_scheduler(app)
+
+    from app.metrics import init_app as init_metrics
+    init_metrics(app)
+
+    from app.maintenance import init_app as init_maintenance
+    init_maintenance(app)
+
+    from app.backup import init_app as init_backup
+    init_backup(app)
+
+    from app.archive import init_app as init_archive
+    init_archive(app)
+
+    from app.reconcile import init_app as init_reconcile
+    init_reconcile(app)
+
+    from app.upgrade import init_app as init_upgrade
+    init_upgrade(app)
+
+    from app.purge import init_app as init_purge
+    init_purge(app)
+
+    from app.sync import init_app as init_sync
+    init_sync(app)
+
+    from app.idempotency import init_app as init_idempotency
+    init_idempotency(app)
+
+    from app.profiling import init_app as init_profiling
+    init_profiling(app)
+
+    from app.memory import init_app as init_memory
+    init_memory(app)
+
+    from app.serve import init_app as init_serve
+    init_serve(app)
+
+    from app.analytics import init_app as init_analytics
+    init_analytics(app)
+
+    from app.cache import init_app as init_cache
+    init_cache(app)
+
+    from app.forecast import init_app as init_forecast
+    init_forecast(app)
+
     # Registra i Blueprints
     from app.blueprints.auth import bp as auth_bp
     app.register_blueprint(auth_bp)
@@ -36,4 +227,13 @@ def create_app(test_config=None):
     from app.blueprints.main import bp as main_bp
     app.register_blueprint(main_bp)
 
+    from app.blueprints.admin import bp as admin_bp
+    app.register_blueprint(admin_bp)
+
+    from app.blueprints.api import bp as api_bp
+    app.register_blueprint(api_bp)
+
+    from app.startup import init_app as init_startup
+    init_startup(app, started, IMPORT_MS)
+
     return app
@@ -0,0 +1,331 @@
+"""
+Statistiche di pratica: streak, medie mobili, costanza e distribuzione
+per giorno della settimana, per skill e complessive.
+
+Le sessioni dell'utente vengono lette con una sola query come array NumPy
+(giorno, skill, minuti, XP) e tutte le metriche sono calcolate con
+operazioni vettoriali su una matrice skill x giorno. Il risultato resta in
+cache finché non cambia la versione dei dati dell'utente (tabella
+data_versions, aggiornata dai trigger sulle sessioni) o la data odierna.
+
+NumPy viene importato alla prima statistica calcolata e non all'avvio
+dell'app: l'import costa più di tutto il resto di create_app.
+"""
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from flask import current_app, has_app_context
+
+from app.archive import sessions_source
+from app.db import get_db, user_data_path
+from app.purge import live_sessions
+
+WEEKDAYS = ('Lun', 'Mar', 'Mer', 'Gio', 'Ven', 'Sab', 'Dom')
+
+# Finestra (in giorni) di medie mobili, costanza e serie giornaliera
+WINDOW_DAYS = 30
+
+# Giorni della matrice skill x giorno: la finestra più i 6 giorni che
+# servono alla media mobile a 7 giorni del suo primo giorno (almeno 30
+# per la media a 30 giorni)
+GRID_DAYS = max(30, WINDOW_DAYS + 6)
+
+# Oltre questo numero di coppie (skill, giorno) possibili le streak si
+# calcolano ordinando le coppie invece che con una tabella di presenza
+DENSE_KEYS_LIMIT = 1 << 22
+
+SESSION_DTYPE = [
+    ('day', 'i8'),
+    ('skill_id', 'i8'),
+    ('minutes', 'i8'),
+    ('xp', 'i8')
+]
+
+
+class AnalyticsCache:
+    """
+    Cache LRU dei risultati per (file, utente), valida per una versione
+    dei dati e un giorno.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, stamp):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != stamp:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, stamp, value):
+        with self._lock:
+            self._entries[key] = (stamp, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """
+        Returns:
+            dict: hits, misses ed entries (elementi in cache)
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+
+def get_data_version(db, user_id):
+    """
+    Versione corrente dei dati di sessione dell'utente (0 se mai modificati).
+    """
+    row = db.execute('SELECT version FROM data_versions WHERE user_id = ?', (user_id,)).fetchone()
+    return row['version'] if row else 0
+
+
+def _parse_ints(values):
+    import numpy as np
+    return np.fromstring(values, dtype=np.int64, sep=',')
+
+
+def load_sessions(db, user_id):
+    """
+    Carica le sessioni dell'utente (archivio compreso) in un array strutturato.
+    Il giorno è espresso in giorni dall'epoch Unix.
+
+    Invece di una riga Python per sessione la query restituisce una sola
+    riga con le colonne concatenate (group_concat), convertite poi in
+    array in blocco: le date YYYY-MM-DD, concatenate senza separatore,
+    diventano un buffer di stringhe a lunghezza fissa.
+
+    Se qualche data non è nel formato YYYY-MM-DD le sessioni vengono
+    rilette una per una (_load_checked_sessions).
+    """
+    row = db.execute(f'''
+        SELECT COUNT(*), group_concat(date, ''),
+               group_concat(skill_id), group_concat(duration_minutes), group_concat(xp_gained)
+        FROM {sessions_source(db, include_archived=True)}
+        WHERE user_id = ? AND {live_sessions(db, user_id)}
+    ''', (user_id,)).fetchone()
+
+    import numpy as np
+    count = row[0]
+    sessions = np.zeros(count, dtype=SESSION_DTYPE)
+    if count == 0:
+        return sessions
+
+    dates = row[1].encode('ascii', 'replace')
+    if len(dates) != 10 * count:
+        return _load_checked_sessions(db, user_id)
+    try:
+        sessions['day'] = np.frombuffer(dates, dtype='S10').astype('datetime64[D]').astype(np.int64)
+    except ValueError:
+        return _load_checked_sessions(db, user_id)
+    sessions['skill_id'] = _parse_ints(row[2])
+    sessions['minutes'] = _parse_ints(row[3])
+    sessions['xp'] = _parse_ints(row[4])
+    return sessions
+
+
+def _parse_day(value):
+    """
+    Giorni dall'epoch Unix di una data YYYY-MM-DD, None se non valida.
+    """
+    if value is None or len(value) != 10:
+        return None
+    try:
+        return (date.fromisoformat(value) - date(1970, 1, 1)).days
+    except ValueError:
+        return None
+
+
+def _load_checked_sessions(db, user_id):
+    """
+    Come load_sessions, riga per riga: le sessioni con una data non valida
+    (salvate prima che la data venisse controllata in scrittura) vengono
+    saltate e segnalate nel log invece di far fallire la pagina.
+    """
+    import numpy as np
+    rows = db.execute(f'''
+        SELECT CAST(date AS TEXT), skill_id, duration_minutes, xp_gained
+        FROM {sessions_source(db, include_archived=True)}
+        WHERE user_id = ? AND {live_sessions(db, user_id)}
+    ''', (user_id,)).fetchall()
+    parsed = [(_parse_day(row[0]), row[1], row[2], row[3]) for row in rows]
+    valid = [values for values in parsed if values[0] is not None]
+    if has_app_context():
+        current_app.logger.warning('Statistiche: %d sessioni con data non valida ignorate (utente %s)',
+                                   len(rows) - len(valid), user_id)
+    return np.array(valid, dtype=SESSION_DTYPE)
+
+
+def _streaks(row, day, rows, today_day):
+    """
+    Streak più lunga e streak corrente (che termina oggi o ieri) per ognuna
+    delle `rows` righe, dalle coppie (riga, giorno attivo) distinte e
+    ordinate. Lavora sui soli giorni attivi: il costo non dipende da quanto
+    sono lontane la prima e l'ultima sessione.
+    """
+    import numpy as np
+    longest = np.zeros(rows, dtype=np.int64)
+    current = np.zeros(rows, dtype=np.int64)
+    if len(day) == 0:
+        return longest, current
+
+    # Una sequenza inizia dove cambia la riga o manca il giorno precedente
+    starts = np.ones(len(day), dtype=bool)
+    starts[1:] = (row[1:] != row[:-1]) | (day[1:] - day[:-1] != 1)
+    start_index = np.flatnonzero(starts)
+    lengths = np.diff(np.append(start_index, len(day)))
+    run_rows = row[start_index]
+    run_last_day = day[np.append(start_index[1:], len(day)) - 1]
+
+    np.maximum.at(longest, run_rows, lengths)
+    alive = run_last_day >= today_day - 1
+    current[run_rows[alive]] = lengths[alive]
+    return longest, current
+
+
+def _unique_keys(keys, size):
+    """
+    Chiavi distinte e ordinate in [0, size): con una tabella di presenza
+    se size è piccolo (nessun ordinamento), altrimenti con np.unique.
+    """
+    import numpy as np
+    if size > DENSE_KEYS_LIMIT:
+        return np.unique(keys)
+    present = np.zeros(size, dtype=bool)
+    present[keys] = True
+    return np.flatnonzero(present)
+
+
+def _trailing_mean(daily, window):
+    """
+    Media mobile sugli ultimi `window` giorni per ogni colonna della matrice.
+    """
+    import numpy as np
+    cumulative = np.cumsum(daily, axis=1, dtype=np.float64)
+    shifted = np.zeros_like(cumulative)
+    shifted[:, window:] = cumulative[:, :-window]
+    return (cumulative - shifted) / window
+
+
+def compute_analytics(sessions, today):
+    """
+    Calcola tutte le metriche a partire dall'array delle sessioni.
+
+    Returns:
+        dict: 'overall' (metriche complessive), 'skills' ({skill_id: metriche})
+              e 'daily' (serie degli ultimi WINDOW_DAYS giorni)
+    """
+    import numpy as np
+    today_day = (today - date(1970, 1, 1)).days
+    skill_ids, skill_index = np.unique(sessions['skill_id'], return_inverse=True)
+    skill_index = skill_index.reshape(-1)
+    # Ultima riga: totale di tutte le skills
+    rows = len(skill_ids) + 1
+
+    # Le metriche "attuali" si fermano a oggi anche con sessioni future
+    past = sessions['day'] <= today_day
+    past_days = sessions['day'][past]
+    base = int(past_days.min()) if len(past_days) else 0
+    span = today_day - base + 1
+    keys = np.concatenate((skill_index[past] * span, np.full(len(past_days), (rows - 1) * span)))
+    keys += np.concatenate((past_days, past_days)) - base
+    pairs = _unique_keys(keys, rows * span)
+    longest, current = _streaks(pairs // span, pairs % span + base, rows, today_day)
+
+    # Matrice skill x giorno limitata agli ultimi GRID_DAYS giorni
+    days = GRID_DAYS
+    first_day = today_day - days + 1
+    in_grid = (sessions['day'] >= first_day) & past
+    offset = sessions['day'][in_grid] - first_day
+    index = skill_index[in_grid]
+
+    def grid(weights=None):
+        matrix = np.bincount(index * days + offset,
+                             weights=None if weights is None else weights[in_grid],
+                             minlength=(rows - 1) * days).reshape(rows - 1, days)
+        return np.vstack((matrix, matrix.sum(axis=0)))
+
+    counts = grid()
+    minutes = grid(sessions['minutes'])
+    xp = grid(sessions['xp'])
+    active = counts > 0
+
+    ma7_minutes = _trailing_mean(minutes, 7)[:, -1]
+    ma30_minutes = _trailing_mean(minutes, 30)[:, -1]
+    ma7_xp = _trailing_mean(xp, 7)[:, -1]
+    ma30_xp = _trailing_mean(xp, 30)[:, -1]
+    consistency = active[:, -WINDOW_DAYS:].mean(axis=1) * 100
+
+    # 1970-01-01 era giovedì: (giorno + 3) % 7 dà 0 = lunedì
+    weekday = (sessions['day'] + 3) % 7
+    by_weekday = np.bincount(skill_index * 7 + weekday, weights=sessions['minutes'],
+                             minlength=(rows - 1) * 7).reshape(rows - 1, 7)
+    by_weekday = np.vstack((by_weekday, by_weekday.sum(axis=0)))
+    weekday_totals = by_weekday.sum(axis=1, keepdims=True)
+    weekday_share = np.divide(by_weekday * 100, weekday_totals,
+                              out=np.zeros_like(by_weekday, dtype=np.float64),
+                              where=weekday_totals > 0)
+
+    def metrics(row):
+        return {
+            'current_streak': int(current[row]),
+            'longest_streak': int(longest[row]),
+            'avg_minutes_7d': round(float(ma7_minutes[row]), 1),
+            'avg_minutes_30d': round(float(ma30_minutes[row]), 1),
+            'avg_xp_7d': round(float(ma7_xp[row]), 1),
+            'avg_xp_30d': round(float(ma30_xp[row]), 1),
+            'consistency': round(float(consistency[row])),
+            'active_days_30d': int(active[row, -WINDOW_DAYS:].sum()),
+            'weekdays': [
+                {'label': label, 'minutes': int(by_weekday[row, i]),
+                 'percentage': round(float(weekday_share[row, i]), 1)}
+                for i, label in enumerate(WEEKDAYS)
+            ]
+        }
+
+    window_start = today - timedelta(days=WINDOW_DAYS - 1)
+    daily_ma7 = _trailing_mean(minutes[-1:], 7)[0, -WINDOW_DAYS:]
+    return {
+        'overall': metrics(rows - 1),
+        'skills': {int(skill_id): metrics(row) for row, skill_id in enumerate(skill_ids)},
+        'daily': {
+            'labels': [(window_start + timedelta(days=i)).isoformat() for i in range(WINDOW_DAYS)],
+            'minutes': [int(value) for value in minutes[-1, -WINDOW_DAYS:]],
+            'avg_minutes_7d': [round(float(value), 1) for value in daily_ma7]
+        }
+    }
+
+
+def get_user_analytics(user_id):
+    """
+    Statistiche di pratica dell'utente, ricalcolate solo quando i suoi
+    dati di sessione cambiano (o cambia il giorno).
+    """
+    db = get_db()
+    cache = current_app.extensions['analytics']
+    key = (user_data_path(), user_id)
+    today = date.today()
+    stamp = (get_data_version(db, user_id), today)
+
+    result = cache.get(key, stamp)
+    if result is None:
+        result = compute_analytics(load_sessions(db, user_id), today)
+        cache.put(key, stamp, result)
+    return result
+
+
+def init_app(app):
+    """
+    Crea la cache delle statistiche per l'applicazione.
+    """
+    app.extensions['analytics'] = AnalyticsCache(app.config['ANALYTICS_CACHE_SIZE'])
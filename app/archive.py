@@ -0,0 +1,288 @@
+"""
+Archivio "freddo" delle sessioni vecchie.
+
+Con ARCHIVE_ENABLED ogni file di dati ha accanto un database di archivio
+(`<nome>-archive.db`) collegato con ATTACH come schema `archive`. Le
+sessioni più vecchie di ARCHIVE_HORIZON_DAYS possono essere spostate lì
+a blocchi: le query abituali dell'utente lavorano solo sulle sessioni
+recenti, mentre le viste di dettaglio possono includere l'archivio su
+richiesta (UNION ALL).
+
+I totali restano esatti: skills.total_xp non cambia, e i conteggi delle
+sessioni archiviate sono mantenuti per utente in session_archive_rollups,
+nello stesso file (e nella stessa transazione) delle sessioni rimosse.
+"""
+import os
+from datetime import date, timedelta
+from urllib.parse import quote
+
+import click
+from flask import current_app
+
+from app.db import connect
+from app.maintenance import data_paths
+from app.sync import pause_change_log, resume_change_log
+
+ARCHIVE_SCHEMA = 'archive'
+
+
+def archive_path(path):
+    """
+    File di archivio associato a un file di dati.
+    """
+    stem, ext = os.path.splitext(path)
+    return f'{stem}-archive{ext or ".db"}'
+
+
+def session_columns(db):
+    return [row['name'] for row in db.execute('PRAGMA main.table_info(sessions)')]
+
+
+def ensure_archive(db):
+    """
+    Crea (o aggiorna) la tabella archive.sessions con le stesse colonne
+    di sessions, più archived_at. Le colonne aggiunte a sessions dopo la
+    creazione dell'archivio vengono aggiunte anche qui.
+    Non fa nulla finché il database principale non ha lo schema (init-db).
+    """
+    main_columns = db.execute('PRAGMA main.table_info(sessions)').fetchall()
+    if not main_columns:
+        return
+
+    db.execute(f'''
+        CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.sessions (
+            id INTEGER PRIMARY KEY,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    existing = {row['name'] for row in db.execute(f'PRAGMA {ARCHIVE_SCHEMA}.table_info(sessions)')}
+    for row in main_columns:
+        if row['name'] not in existing:
+            db.execute(f'ALTER TABLE {ARCHIVE_SCHEMA}.sessions ADD COLUMN {row["name"]} {row["type"]}')
+    db.execute(f'CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_archive_sessions_user_date '
+               f'ON sessions(user_id, date)')
+    db.execute(f'CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_archive_sessions_skill '
+               f'ON sessions(skill_id)')
+    db.commit()
+
+
+def reset_archive(db):
+    """
+    Svuota l'archivio di una connessione (usata da init-db insieme allo schema).
+    """
+    db.execute(f'DROP TABLE IF EXISTS {ARCHIVE_SCHEMA}.sessions')
+    ensure_archive(db)
+
+
+def attach_archive(db, path, read_only=False):
+    """
+    Collega l'archivio a una connessione come schema `archive`.
+    Se il file non esiste ancora viene creato con una connessione di scrittura.
+    """
+    target = archive_path(path)
+    if not os.path.exists(target):
+        writer = connect(path)
+        try:
+            writer.execute(f'ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}', (target,))
+            ensure_archive(writer)
+        finally:
+            writer.close()
+
+    if read_only:
+        db.execute(f'ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}', (f'file:{quote(target)}?mode=ro',))
+    else:
+        db.execute(f'ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}', (target,))
+
+
+def sessions_source(db, include_archived):
+    """
+    Sorgente SQL per le sessioni: la sola tabella live oppure l'unione
+    con l'archivio. La colonna `archived` distingue le due provenienze.
+    """
+    if not (include_archived and current_app.config['ARCHIVE_ENABLED']):
+        return '(SELECT *, 0 as archived FROM main.sessions)'
+
+    columns = ', '.join(session_columns(db))
+    return (f'(SELECT {columns}, 0 as archived FROM main.sessions '
+            f'UNION ALL SELECT {columns}, 1 as archived FROM {ARCHIVE_SCHEMA}.sessions)')
+
+
+def _update_rollups(db, id_list, sign):
+    db.execute(f'''
+        INSERT INTO session_archive_rollups (user_id, sessions, minutes, xp)
+        SELECT user_id, {sign} * COUNT(*), {sign} * SUM(duration_minutes), {sign} * SUM(xp_gained)
+        FROM {'main' if sign > 0 else ARCHIVE_SCHEMA}.sessions
+        WHERE id IN ({id_list})
+        GROUP BY user_id
+        ON CONFLICT(user_id) DO UPDATE SET
+            sessions = sessions + excluded.sessions,
+            minutes = minutes + excluded.minutes,
+            xp = xp + excluded.xp
+    ''')
+
+
+def archive_chunk(db, cutoff, chunk_size):
+    """
+    Sposta in archivio al massimo `chunk_size` sessioni con data < cutoff.
+
+    Returns:
+        int: Sessioni archiviate
+    """
+    columns = ', '.join(session_columns(db))
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        ids = [row[0] for row in db.execute(
+            'SELECT id FROM main.sessions WHERE date < ? ORDER BY date LIMIT ?',
+            (cutoff, chunk_size)
+        )]
+        if not ids:
+            db.rollback()
+            return 0
+
+        id_list = ', '.join(str(session_id) for session_id in ids)
+        # Per i client (/api/v1/sync) le sessioni archiviate non cambiano
+        pause_change_log(db)
+        db.execute(f'INSERT OR REPLACE INTO {ARCHIVE_SCHEMA}.sessions ({columns}) '
+                   f'SELECT {columns} FROM main.sessions WHERE id IN ({id_list})')
+        _update_rollups(db, id_list, +1)
+        db.execute(f'DELETE FROM main.sessions WHERE id IN ({id_list})')
+        resume_change_log(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(ids)
+
+
+def unarchive_chunk(db, chunk_size, user_id=None, since=None):
+    """
+    Riporta tra le sessioni live al massimo `chunk_size` sessioni archiviate,
+    eventualmente filtrate per utente e/o data minima.
+
+    Returns:
+        int: Sessioni ripristinate
+    """
+    columns = ', '.join(session_columns(db))
+    conditions, params = [], []
+    if user_id is not None:
+        conditions.append('user_id = ?')
+        params.append(user_id)
+    if since is not None:
+        conditions.append('date >= ?')
+        params.append(since)
+    where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        ids = [row[0] for row in db.execute(
+            f'SELECT id FROM {ARCHIVE_SCHEMA}.sessions {where} ORDER BY date DESC LIMIT ?',
+            (*params, chunk_size)
+        )]
+        if not ids:
+            db.rollback()
+            return 0
+
+        id_list = ', '.join(str(session_id) for session_id in ids)
+        pause_change_log(db)
+        db.execute(f'INSERT OR REPLACE INTO main.sessions ({columns}) '
+                   f'SELECT {columns} FROM {ARCHIVE_SCHEMA}.sessions WHERE id IN ({id_list})')
+        _update_rollups(db, id_list, -1)
+        db.execute(f'DELETE FROM {ARCHIVE_SCHEMA}.sessions WHERE id IN ({id_list})')
+        resume_change_log(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(ids)
+
+
+def delete_archived(db, column, value, limit=-1):
+    """
+    Elimina (al massimo `limit`) sessioni archiviate con `column` = `value`
+    aggiornando i rollup, senza commit.
+
+    Returns:
+        int: Sessioni eliminate
+    """
+    ids = [row[0] for row in db.execute(
+        f'SELECT id FROM {ARCHIVE_SCHEMA}.sessions WHERE {column} = ? LIMIT ?', (value, limit)
+    )]
+    if ids:
+        id_list = ', '.join(str(session_id) for session_id in ids)
+        _update_rollups(db, id_list, -1)
+        db.execute(f'DELETE FROM {ARCHIVE_SCHEMA}.sessions WHERE id IN ({id_list})')
+    return len(ids)
+
+
+def delete_archived_for_skill(db, skill_id):
+    """
+    Elimina le sessioni archiviate di una skill aggiornando i rollup
+    (senza commit: fa parte della transazione di eliminazione della skill).
+    """
+    delete_archived(db, 'skill_id', skill_id)
+
+
+def _open(path):
+    db = connect(path, wal=current_app.config['DB_WAL'])
+    attach_archive(db, path)
+    ensure_archive(db)
+    return db
+
+
+@click.command('sessions-archive')
+@click.option('--days', type=int, help='Orizzonte in giorni (default ARCHIVE_HORIZON_DAYS).')
+@click.option('--chunk', type=int, help='Sessioni per transazione (default ARCHIVE_CHUNK_SIZE).')
+def sessions_archive_command(days, chunk):
+    """
+    Sposta in archivio le sessioni più vecchie dell'orizzonte configurato.
+    Uso: flask sessions-archive [--days N] [--chunk N]
+    """
+    days = days or current_app.config['ARCHIVE_HORIZON_DAYS']
+    chunk = chunk or current_app.config['ARCHIVE_CHUNK_SIZE']
+    cutoff = (date.today() - timedelta(days=days)).isoformat()
+
+    for path in data_paths():
+        db = _open(path)
+        try:
+            total = 0
+            while True:
+                moved = archive_chunk(db, cutoff, chunk)
+                if moved == 0:
+                    break
+                total += moved
+        finally:
+            db.close()
+        click.echo(f'{path}: {total} sessioni precedenti al {cutoff} archiviate.')
+
+
+@click.command('sessions-unarchive')
+@click.option('--user', 'user_id', type=int, help='Solo le sessioni di questo utente.')
+@click.option('--since', help='Solo le sessioni con data >= YYYY-MM-DD.')
+@click.option('--chunk', type=int, help='Sessioni per transazione (default ARCHIVE_CHUNK_SIZE).')
+def sessions_unarchive_command(user_id, since, chunk):
+    """
+    Riporta tra le sessioni live le sessioni archiviate.
+    Uso: flask sessions-unarchive [--user ID] [--since YYYY-MM-DD] [--chunk N]
+    """
+    chunk = chunk or current_app.config['ARCHIVE_CHUNK_SIZE']
+
+    for path in data_paths():
+        db = _open(path)
+        try:
+            total = 0
+            while True:
+                moved = unarchive_chunk(db, chunk, user_id=user_id, since=since)
+                if moved == 0:
+                    break
+                total += moved
+        finally:
+            db.close()
+        click.echo(f'{path}: {total} sessioni ripristinate.')
+
+
+def init_app(app):
+    """
+    Registra i comandi CLI dell'archivio.
+    """
+    app.cli.add_command(sessions_archive_command)
+    app.cli.add_command(sessions_unarchive_command)
@@ -0,0 +1,208 @@
+"""
+Backup online dei database con la backup API di SQLite.
+
+La copia avanza a blocchi di BACKUP_PAGES_PER_STEP pagine con una pausa
+di BACKUP_STEP_SLEEP_MS tra un blocco e l'altro. La connessione sorgente
+tiene aperta una transazione di lettura per tutta la copia: in modalità
+WAL i writer non vengono bloccati e la copia resta uno snapshot coerente
+invece di ripartire a ogni scrittura concorrente.
+"""
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+
+from app.db import connect
+from app.maintenance import archive_paths, database_paths
+
+
+def _backup_files(dest_dir, stem):
+    """
+    File di backup esistenti per un database, dal più recente al più vecchio.
+    """
+    if not os.path.isdir(dest_dir):
+        return []
+    pattern = re.compile(re.escape(stem) + r'-\d{8}-\d{6}\.db(\.gz)?$')
+    names = [name for name in os.listdir(dest_dir) if pattern.match(name)]
+    return sorted((os.path.join(dest_dir, name) for name in names), reverse=True)
+
+
+def rotate_backups(dest_dir, stem, keep):
+    """
+    Elimina i backup più vecchi lasciando solo gli ultimi `keep`.
+
+    Returns:
+        list[str]: File eliminati
+    """
+    removed = _backup_files(dest_dir, stem)[keep:]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def _backup_target(dest_dir, path, stamp):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(dest_dir, f'{stem}-{stamp}.db')
+
+
+def _begin_snapshot(src, path):
+    """
+    Apre la transazione di lettura di `src` sul database e sul suo archivio
+    nello stesso istante. sessions-archive scrive i due file nella stessa
+    transazione, ma in WAL il commit non è atomico tra più file: una
+    connessione con BEGIN IMMEDIATE su entrambi attende i commit in corso
+    ed esclude i writer mentre partono gli snapshot (per pochi istanti).
+    """
+    from app.archive import ARCHIVE_SCHEMA, attach_archive
+    attach_archive(src, path, read_only=True)
+    lock = connect(path)
+    try:
+        attach_archive(lock, path)
+        lock.execute('BEGIN IMMEDIATE')
+        src.execute('BEGIN')
+        src.execute(f'''
+            SELECT (SELECT 1 FROM main.sqlite_master LIMIT 1),
+                   (SELECT 1 FROM {ARCHIVE_SCHEMA}.sqlite_master LIMIT 1)
+        ''').fetchone()
+        lock.rollback()
+    finally:
+        lock.close()
+
+
+def _finish(source, target, size, elapsed, integrity, compress):
+    if integrity != 'ok':
+        os.rename(target, target + '.corrupt')
+        raise RuntimeError(f'Backup di {source} non valido: {integrity}')
+
+    if compress:
+        with open(target, 'rb') as raw, gzip.open(target + '.gz', 'wb') as packed:
+            shutil.copyfileobj(raw, packed)
+        os.remove(target)
+        target += '.gz'
+
+    return {
+        'source': source,
+        'file': target,
+        'bytes': size,
+        'stored_bytes': os.path.getsize(target),
+        'seconds': round(elapsed, 3),
+        'mb_per_sec': round(size / (1024 * 1024) / elapsed, 1) if elapsed else 0.0,
+        'integrity': integrity
+    }
+
+
+def backup_database(path, dest_dir, compress=True, pages_per_step=256, step_sleep_ms=10, archive=None):
+    """
+    Copia un database in `dest_dir` e verifica la copia con integrity_check.
+    Con `archive` (il file di archivio delle sessioni di `path`) copia
+    anche l'archivio, dallo stesso snapshot: sessioni archiviate e
+    session_archive_rollups del backup corrispondono.
+
+    Returns:
+        list[dict]: Per ogni file copiato (database, poi archivio): file
+                    creato, dimensione, durata, throughput in MB/s ed esito
+                    della verifica
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    sources = [('main', path)]
+    if archive is not None:
+        from app.archive import ARCHIVE_SCHEMA
+        sources.append((ARCHIVE_SCHEMA, archive))
+
+    def pause(status, remaining, total):
+        time.sleep(step_sleep_ms / 1000)
+
+    copies = []
+    src = connect(path, read_only=True)
+    try:
+        # Snapshot di lettura stabile per tutta la durata della copia
+        if archive is not None:
+            _begin_snapshot(src, path)
+        else:
+            src.execute('BEGIN')
+            src.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchone()
+        for schema, source in sources:
+            target = _backup_target(dest_dir, source, stamp)
+            started = time.perf_counter()
+            dst = sqlite3.connect(target)
+            try:
+                src.backup(dst, pages=pages_per_step, progress=pause, name=schema)
+                elapsed = time.perf_counter() - started
+                integrity = dst.execute('PRAGMA integrity_check').fetchone()[0]
+            finally:
+                dst.close()
+            copies.append((source, target, os.path.getsize(target), elapsed, integrity))
+        src.rollback()
+    finally:
+        src.close()
+
+    return [_finish(*copy, compress) for copy in copies]
+
+
+def backup_all(dest_dir=None, compress=None, keep=None):
+    """
+    Esegue il backup di tutti i database (principale + shard, ognuno con
+    il suo archivio) e applica la politica di rotazione.
+
+    Returns:
+        list[dict]: Un report per file
+    """
+    config = current_app.config
+    dest_dir = dest_dir or config['BACKUP_DIR']
+    compress = config['BACKUP_COMPRESS'] if compress is None else compress
+    keep = config['BACKUP_KEEP'] if keep is None else keep
+    archives = archive_paths()
+
+    reports = []
+    for path in database_paths():
+        for report in backup_database(path, dest_dir,
+                                      compress=compress,
+                                      pages_per_step=config['BACKUP_PAGES_PER_STEP'],
+                                      step_sleep_ms=config['BACKUP_STEP_SLEEP_MS'],
+                                      archive=archives.get(path)):
+            stem = os.path.splitext(os.path.basename(report['source']))[0]
+            report['removed'] = rotate_backups(dest_dir, stem, keep)
+            reports.append(report)
+    return reports
+
+
+def format_report(report):
+    return (f'{report["file"]}: {report["bytes"] / (1024 * 1024):.1f} MB in {report["seconds"]}s '
+            f'({report["mb_per_sec"]} MB/s), integrity_check={report["integrity"]}, '
+            f'{len(report["removed"])} backup vecchi rimossi')
+
+
+def _scheduled_backup():
+    for report in backup_all():
+        current_app.logger.info('Backup %s', format_report(report))
+
+
+@click.command('db-backup')
+@click.option('--dest', type=click.Path(file_okay=False), help='Cartella di destinazione (default BACKUP_DIR).')
+@click.option('--compress/--no-compress', default=None, help='Comprime i backup con gzip.')
+@click.option('--keep', type=int, help='Numero di backup da conservare per database.')
+def db_backup_command(dest, compress, keep):
+    """
+    Backup online dei database, senza fermare l'applicazione.
+    Uso: flask db-backup [--dest DIR] [--compress/--no-compress] [--keep N]
+    """
+    for report in backup_all(dest, compress, keep):
+        click.echo(format_report(report))
+
+
+def init_app(app):
+    """
+    Registra il comando CLI e, se BACKUP_ENABLED, il backup periodico.
+    """
+    app.cli.add_command(db_backup_command)
+
+    if app.config['BACKUP_ENABLED']:
+        from app.scheduler import get_scheduler
+        get_scheduler(app).add_job('db-backup', app.config['BACKUP_INTERVAL'], _scheduled_backup)
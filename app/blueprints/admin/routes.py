@@ -0,0 +1,133 @@
+import functools
+from flask import render_template, redirect, url_for, flash, g, current_app, request, abort, Response
+
+from app.blueprints.admin import bp
+from app.blueprints.auth.routes import login_required
+from app.cache import get_repository_cache
+from app.memory import get_memory_stats
+from app.profiling import (clear_profiles, flush_profiles, hottest_functions, load_profiles,
+                           merged_pstats, to_folded)
+from app.sharding import get_shard_stats
+from app.startup import get_startup_timings
+
+
+def admin_required(view):
+    """
+    Decoratore che richiede un utente presente in ADMIN_USERNAMES.
+    """
+    @functools.wraps(view)
+    @login_required
+    def wrapped_view(**kwargs):
+        if g.user.username not in current_app.config['ADMIN_USERNAMES']:
+            flash('Accesso riservato agli amministratori.', 'danger')
+            return redirect(url_for('main.dashboard'))
+        return view(**kwargs)
+    return wrapped_view
+
+
+@bp.route('/')
+@admin_required
+def index():
+    """
+    Panoramica amministrativa con gli aggregati su tutti gli shard,
+    gli istogrammi del group commit e le statistiche della cache dei
+    repository (se attivi), più i tempi di avvio del processo.
+    """
+    shard_stats = get_shard_stats()
+    totals = {
+        key: sum(row[key] for row in shard_stats)
+        for key in ('assigned_users', 'skills', 'sessions', 'total_xp', 'total_hours', 'size_bytes')
+    }
+    group_commit = current_app.extensions.get('group_commit')
+    repository_cache = get_repository_cache(current_app)
+    return render_template('admin/index.html',
+                           shard_stats=shard_stats,
+                           totals=totals,
+                           group_commit_stats=group_commit.stats() if group_commit else None,
+                           repository_cache=repository_cache.method_stats() if repository_cache else None,
+                           startup=get_startup_timings(current_app))
+
+
+@bp.route('/profiles')
+@admin_required
+def profiles():
+    """
+    Richieste profilate per endpoint (tutti i processi) e funzioni più
+    calde dell'endpoint selezionato.
+    """
+    flush_profiles(current_app)
+    stacks, requests = load_profiles(current_app.config['PROFILING_DIR'])
+    endpoints = sorted(
+        ({'name': name, 'requests': requests[name], 'samples': sum(counter.values())}
+         for name, counter in stacks.items()),
+        key=lambda row: row['samples'], reverse=True
+    )
+    selected = request.args.get('route')
+    if selected not in stacks:
+        selected = endpoints[0]['name'] if endpoints else None
+    functions = hottest_functions(stacks[selected]) if selected else []
+    return render_template('admin/profiles.html',
+                           enabled=current_app.config['PROFILING_ENABLED'],
+                           interval_ms=current_app.config['PROFILING_INTERVAL_MS'],
+                           endpoints=endpoints,
+                           selected=selected,
+                           samples=sum(stacks[selected].values()) if selected else 0,
+                           functions=functions)
+
+
+@bp.route('/profiles/<any(folded, pstats):fmt>')
+@admin_required
+def profiles_download(fmt):
+    """
+    Profilo di un endpoint (?route=) come stack collassati o file pstats.
+    """
+    directory = current_app.config['PROFILING_DIR']
+    endpoint = request.args.get('route', '')
+    flush_profiles(current_app)
+    if fmt == 'folded':
+        stacks = load_profiles(directory)[0].get(endpoint)
+        data = to_folded(stacks) if stacks else None
+    else:
+        data = merged_pstats(directory, endpoint)
+    if data is None:
+        abort(404)
+    return Response(data, mimetype='text/plain' if fmt == 'folded' else 'application/octet-stream',
+                    headers={'Content-Disposition': f'attachment; filename={endpoint}.{fmt}'})
+
+
+@bp.route('/profiles/clear', methods=['POST'])
+@admin_required
+def profiles_clear():
+    """
+    Elimina i profili salvati.
+    """
+    clear_profiles(current_app)
+    flash('Profili eliminati.', 'success')
+    return redirect(url_for('admin.profiles'))
+
+
+@bp.route('/memory')
+@admin_required
+def memory():
+    """
+    Picchi di memoria per endpoint (processo corrente) e righe di codice
+    che allocano di più.
+    """
+    stats = get_memory_stats(current_app)
+    return render_template('admin/memory.html',
+                           enabled=stats is not None,
+                           budget=current_app.config['MEMORY_BUDGET_KB'] * 1024,
+                           endpoints=stats.summary() if stats else [])
+
+
+@bp.route('/memory/reset', methods=['POST'])
+@admin_required
+def memory_reset():
+    """
+    Azzera le statistiche di memoria del processo.
+    """
+    stats = get_memory_stats(current_app)
+    if stats is not None:
+        stats.reset()
+    flash('Statistiche di memoria azzerate.', 'success')
+    return redirect(url_for('admin.memory'))
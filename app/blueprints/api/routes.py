@@ -0,0 +1,403 @@
+import base64
+import binascii
+import functools
+import gzip
+import json
+import time
+
+from flask import current_app, g, jsonify, request
+from werkzeug.exceptions import BadRequest, HTTPException, NotFound
+from werkzeug.security import check_password_hash
+
+from app.analytics import get_user_analytics
+from app.blueprints.api import bp
+from app.db import get_directory_db, get_user_db
+from app.repositories import (
+    ApiTokenRepository, CategoryRepository, ChangeLogRepository, SessionRepository, SkillRepository,
+    UserRepository
+)
+from app.repositories.change_log_repository import ENTITIES
+
+# Campi esposti per ogni risorsa: `fields=` può solo restringerli
+SKILL_FIELDS = ('id', 'name', 'description', 'current_level', 'target_level',
+                'total_xp', 'category_id', 'created_at')
+SESSION_FIELDS = ('id', 'skill_id', 'date', 'duration_minutes', 'xp_gained', 'notes',
+                  'cumulative_xp', 'level_after', 'created_at', 'archived')
+CATEGORY_FIELDS = ('id', 'name', 'icon')
+
+
+# ============================================================================
+# SUPPORTO
+# ============================================================================
+
+def token_required(view):
+    """
+    Decoratore che autentica la richiesta con `Authorization: Bearer <token>`.
+    Non usa la sessione del browser: il token porta direttamente all'utente
+    con una sola lettura. Le sotto-richieste di un batch riusano l'utente
+    già autenticato dalla richiesta principale (g.api_user).
+    """
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        user = g.get('api_user')
+        if user is None:
+            scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+            if scheme.lower() == 'bearer' and token.strip():
+                user = ApiTokenRepository.get_user(token.strip())
+        if user is None:
+            response = jsonify(error='Token mancante o non valido.')
+            response.status_code = 401
+            response.headers['WWW-Authenticate'] = 'Bearer'
+            return response
+        g.user = g.api_user = user
+        return view(**kwargs)
+    return wrapped_view
+
+
+def encode_cursor(values):
+    """
+    Cursore opaco per la pagina successiva (JSON in base64 URL-safe).
+    """
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decodifica un cursore; errore 400 se non valido.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise BadRequest('Cursore non valido.')
+
+
+def requested_fields(allowed):
+    """
+    Campi richiesti con `fields=a,b,c` (tutti quelli consentiti se assente).
+    L'id è sempre incluso.
+    """
+    raw = request.args.get('fields')
+    if not raw:
+        return allowed
+    fields = tuple(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in allowed]
+    if unknown or not fields:
+        raise BadRequest(f'Campi non validi: {", ".join(unknown) or raw}. '
+                         f'Disponibili: {", ".join(allowed)}.')
+    return tuple(dict.fromkeys(('id', *fields)))
+
+
+def page_size():
+    config = current_app.config
+    limit = request.args.get('limit', config['API_PAGE_SIZE'], type=int)
+    return max(1, min(limit, config['API_MAX_PAGE_SIZE']))
+
+
+def to_json(row, fields):
+    """
+    Riga -> dizionario con i soli campi richiesti (date in formato ISO).
+    """
+    item = {}
+    for name in fields:
+        value = row[name]
+        item[name] = value.isoformat() if hasattr(value, 'isoformat') else value
+    return item
+
+
+def page_response(rows, fields, limit, cursor_of):
+    """
+    Risposta di una pagina: i dati e il cursore della successiva (null se
+    è l'ultima). Le query leggono limit + 1 righe per saperlo senza un
+    giro a vuoto.
+    """
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify(
+        data=[to_json(row, fields) for row in rows],
+        next_cursor=encode_cursor(cursor_of(rows[-1])) if has_more else None
+    )
+
+
+@bp.errorhandler(HTTPException)
+def json_error(e):
+    """
+    Errori dell'API in JSON invece che come pagina HTML.
+    """
+    response = jsonify(error=e.description)
+    response.status_code = e.code
+    return response
+
+
+@bp.after_request
+def compress(response):
+    """
+    Compressione gzip delle risposte sopra API_GZIP_MIN_BYTES, se il
+    client la accetta.
+    """
+    response.vary.add('Accept-Encoding')
+    if (response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.headers.get('Accept-Encoding', '').lower()):
+        return response
+
+    data = response.get_data()
+    if len(data) < current_app.config['API_GZIP_MIN_BYTES']:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=current_app.config['API_GZIP_LEVEL']))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+# ============================================================================
+# TOKEN
+# ============================================================================
+
+@bp.route('/tokens', methods=['POST'])
+def tokens_create():
+    """
+    Crea un token a partire da username e password (JSON).
+    Il token viene restituito una sola volta.
+    """
+    payload = request.get_json(silent=True) or {}
+    user = UserRepository.get_by_username(str(payload.get('username', '')).strip())
+    if user is None or not check_password_hash(user.password_hash, str(payload.get('password', ''))):
+        response = jsonify(error='Credenziali non valide.')
+        response.status_code = 401
+        return response
+
+    token = ApiTokenRepository.create(user.id, payload.get('name'))
+    response = jsonify(token=token, user_id=user.id)
+    response.status_code = 201
+    return response
+
+
+@bp.route('/tokens/current', methods=['DELETE'])
+@token_required
+def tokens_revoke():
+    """
+    Revoca il token usato per la richiesta.
+    """
+    ApiTokenRepository.revoke(request.headers['Authorization'].partition(' ')[2].strip())
+    return '', 204
+
+
+# ============================================================================
+# RISORSE
+# ============================================================================
+
+@bp.route('/skills')
+@token_required
+def skills_list():
+    """
+    Skills dell'utente in ordine di ID.
+    """
+    fields = requested_fields(SKILL_FIELDS)
+    limit = page_size()
+    cursor = request.args.get('cursor')
+    after = decode_cursor(cursor) if cursor else None
+    if after is not None and not isinstance(after, int):
+        raise BadRequest('Cursore non valido.')
+
+    rows = SkillRepository.get_page(g.user.id, fields, limit + 1, after)
+    return page_response(rows, fields, limit, lambda row: row['id'])
+
+
+@bp.route('/skills/<int:skill_id>')
+@token_required
+def skills_detail(skill_id):
+    """
+    Una skill dell'utente.
+    """
+    fields = requested_fields(SKILL_FIELDS)
+    skill = SkillRepository.get_by_id(skill_id)
+    if skill is None or skill.user_id != g.user.id:
+        raise NotFound('Skill non trovata.')
+    return jsonify(data=to_json(vars(skill), fields))
+
+
+@bp.route('/sessions')
+@token_required
+def sessions_list():
+    """
+    Sessioni dell'utente dalla più recente, filtrabili per skill
+    (`skill_id=`), con l'archivio su richiesta (`archived=1`).
+    """
+    include_archived = request.args.get('archived') == '1'
+    allowed = SESSION_FIELDS if include_archived else SESSION_FIELDS[:-1]
+    fields = requested_fields(allowed)
+    limit = page_size()
+    cursor = request.args.get('cursor')
+    after = decode_cursor(cursor) if cursor else None
+    if after is not None and not (isinstance(after, list) and len(after) == 2
+                                  and isinstance(after[0], str) and isinstance(after[1], int)):
+        raise BadRequest('Cursore non valido.')
+
+    rows = SessionRepository.get_page(g.user.id, fields, limit + 1, after,
+                                      skill_id=request.args.get('skill_id', type=int),
+                                      include_archived=include_archived)
+    return page_response(rows, fields, limit, lambda row: [str(row['date']), row['id']])
+
+
+@bp.route('/categories')
+@token_required
+def categories_list():
+    """
+    Categorie dell'utente in ordine di ID.
+    """
+    fields = requested_fields(CATEGORY_FIELDS)
+    limit = page_size()
+    cursor = request.args.get('cursor')
+    after = decode_cursor(cursor) if cursor else None
+    if after is not None and not isinstance(after, int):
+        raise BadRequest('Cursore non valido.')
+
+    rows = CategoryRepository.get_page(g.user.id, fields, limit + 1, after)
+    return page_response(rows, fields, limit, lambda row: row['id'])
+
+
+@bp.route('/stats')
+@token_required
+def stats():
+    """
+    Statistiche aggregate: skills, sessioni e pratica (streak, medie, costanza).
+    """
+    return jsonify(data={
+        'skills': SkillRepository.get_stats_by_user(g.user.id),
+        'sessions': SessionRepository.get_stats_by_user(g.user.id),
+        'practice': get_user_analytics(g.user.id)['overall']
+    })
+
+
+@bp.route('/sync')
+@token_required
+def sync():
+    """
+    Modifiche dopo la sequenza `since` (0 = tutto il registro), in forma
+    compatta: per ogni entità le righe aggiornate come liste di valori
+    nell'ordine di `fields` e gli ID eliminati. `seq` va ripassato come
+    `since` alla chiamata successiva; con `more` ci sono altre modifiche.
+    Con `reset` il registro è stato compattato oltre `since`: il client
+    deve riscaricare i dati dalle liste e ripartire da `seq`.
+    """
+    since = request.args.get('since', 0, type=int)
+    limit = max(1, min(request.args.get('limit', current_app.config['SYNC_PAGE_SIZE'], type=int),
+                       current_app.config['SYNC_MAX_PAGE_SIZE']))
+
+    # Registro e righe letti dalla stessa istantanea
+    db = get_user_db(g.user.id)
+    snapshot = not db.in_transaction
+    if snapshot:
+        db.execute('BEGIN')
+    try:
+        seq, horizon = ChangeLogRepository.get_state(g.user.id)
+        if since < horizon or since > seq:
+            return jsonify(reset=True, seq=seq, more=False, changes={})
+
+        changes, last_seq, more = ChangeLogRepository.get_changes(g.user.id, since, limit)
+        payload = {}
+        for entity, ops in changes.items():
+            if not ops:
+                continue
+            columns = ENTITIES[entity][1]
+            upserted = [entity_id for entity_id, op in ops.items() if op == 'upsert']
+            rows = ChangeLogRepository.get_rows(g.user.id, entity, upserted)
+            found = {row['id'] for row in rows}
+            payload[entity] = {
+                'upsert': [list(to_json(row, columns).values()) for row in rows],
+                'delete': [entity_id for entity_id in ops if entity_id not in found]
+            }
+    finally:
+        if snapshot:
+            db.rollback()
+
+    return jsonify(reset=False, seq=last_seq, more=more, changes=payload,
+                   fields={entity: ENTITIES[entity][1] for entity in payload})
+
+
+# ============================================================================
+# BATCH
+# ============================================================================
+
+def _begin_snapshot(user_id):
+    """
+    Apre una transazione di lettura sulle connessioni della richiesta
+    (database principale e file dei dati dell'utente): tutte le
+    sotto-richieste leggono la stessa istantanea di ciascun file.
+
+    Returns:
+        list: Le connessioni in transazione, da chiudere con _end_snapshot
+    """
+    connections = []
+    for db in (get_directory_db(), get_user_db(user_id)):
+        if db not in connections and not db.in_transaction:
+            db.execute('BEGIN')
+            connections.append(db)
+    return connections
+
+
+def _end_snapshot(connections):
+    for db in connections:
+        db.rollback()
+
+
+def _run_subrequest(item, snapshot):
+    """
+    Esegue una sotto-richiesta GET nello stesso app context (quindi sulle
+    stesse connessioni e con lo stesso utente) della richiesta batch.
+    """
+    started = time.perf_counter()
+    path = item.get('path') if isinstance(item, dict) else None
+    method = str(item.get('method', 'GET')).upper() if isinstance(item, dict) else None
+
+    if not isinstance(path, str) or not path.startswith(bp.url_prefix + '/'):
+        status, body = 400, {'error': f'Il percorso deve iniziare con {bp.url_prefix}/.'}
+    elif method != 'GET':
+        status, body = 405, {'error': 'Nel batch sono ammesse solo richieste GET.'}
+    else:
+        with current_app.test_request_context(path, method='GET', base_url=request.host_url):
+            if snapshot is None:
+                snapshot = _begin_snapshot(g.api_user.id)
+            response = current_app.full_dispatch_request()
+            status = response.status_code
+            body = response.get_json(silent=True) if response.data else None
+
+    result = {'status': status, 'body': body,
+              'duration_ms': round((time.perf_counter() - started) * 1000, 3)}
+    if isinstance(item, dict) and 'id' in item:
+        result['id'] = item['id']
+    return result, snapshot
+
+
+@bp.route('/batch', methods=['POST'])
+@token_required
+def batch():
+    """
+    Esegue più richieste GET dell'API in una sola chiamata HTTP:
+    `{"requests": [{"id": "stats", "path": "/api/v1/stats"}, ...]}`.
+
+    Autenticazione e connessioni vengono condivise e tutte le letture
+    avvengono in una sola transazione; ogni risposta riporta stato, corpo
+    e durata della sotto-richiesta.
+    """
+    payload = request.get_json(silent=True)
+    items = payload.get('requests') if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        raise BadRequest('Serve una lista "requests" non vuota.')
+    if len(items) > current_app.config['API_BATCH_MAX_REQUESTS']:
+        raise BadRequest(f'Al massimo {current_app.config["API_BATCH_MAX_REQUESTS"]} richieste per batch.')
+
+    started = time.perf_counter()
+    responses = []
+    snapshot = None
+    try:
+        for item in items:
+            result, snapshot = _run_subrequest(item, snapshot)
+            responses.append(result)
+    finally:
+        if snapshot:
+            _end_snapshot(snapshot)
+
+    return jsonify(responses=responses,
+                   duration_ms=round((time.perf_counter() - started) * 1000, 3))
@@ -24,7 +24,12 @@ def login_required(view):
 def load_logged_in_user():
     """
     Carica l'utente loggato prima di ogni richiesta.
+    Le richieste all'API si autenticano con il token (blueprint api).
     """
+    if request.blueprint == 'api':
+        g.user = None
+        return
+
     user_id = session.get('user_id')
     if user_id is None:
         g.user = None
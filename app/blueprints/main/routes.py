@@ -1,9 +1,15 @@
 from datetime import date
-from flask import render_template, redirect, url_for, flash, request, g
+from flask import render_template, redirect, url_for, flash, request, g, current_app, abort, Response
 
+from app.analytics import get_user_analytics
 from app.blueprints.main import bp
+from app.events import change_position, get_broker, stream
+from app.forecast import get_forecasts
+from app.idempotency import idempotent
+from app.modelli import normalize_session_date
 from app.blueprints.auth.routes import login_required
-from app.repositories import CategoryRepository, SkillRepository, SessionRepository
+from app.repositories import CategoryRepository, SkillRepository, SessionRepository, LeaderboardRepository
+from app.repositories.leaderboard_repository import BOARDS, week_start
 
 
 # ============================================================================
@@ -21,13 +27,41 @@ def dashboard():
     session_stats = SessionRepository.get_stats_by_user(g.user.id)
     recent_sessions = SessionRepository.get_recent_by_user(g.user.id, days=7)
     categories = CategoryRepository.get_with_skill_count(g.user.id)
+    analytics = get_user_analytics(g.user.id)
 
     return render_template('main/dashboard.html',
                            skills=skills,
                            skill_stats=skill_stats,
                            session_stats=session_stats,
                            recent_sessions=recent_sessions,
-                           categories=categories)
+                           categories=categories,
+                           analytics=analytics)
+
+
+@bp.route('/events')
+@login_required
+def events():
+    """
+    Stream Server-Sent Events con gli aggiornamenti della dashboard
+    dell'utente (EVENTS_ENABLED).
+    """
+    broker = get_broker(current_app)
+    if broker is None:
+        abort(404)
+    user_id = g.user.id
+    subscription = broker.subscribe(user_id, change_position(user_id))
+    if subscription is None:
+        abort(429)
+
+    response = Response(
+        stream(broker, user_id, subscription, current_app.config['EVENTS_HEARTBEAT_SECONDS']),
+        mimetype='text/event-stream'
+    )
+    # Se il client chiude prima del primo messaggio il generatore non parte
+    response.call_on_close(lambda: broker.unsubscribe(user_id, subscription))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 # ============================================================================
@@ -41,11 +75,13 @@ def skills_list():
     Lista di tutte le skills dell'utente.
     """
     skills = SkillRepository.get_all_by_user(g.user.id)
-    return render_template('main/skills/list.html', skills=skills)
+    forecasts = get_forecasts(skills)
+    return render_template('main/skills/list.html', skills=skills, forecasts=forecasts)
 
 
 @bp.route('/skills/new', methods=['GET', 'POST'])
 @login_required
+@idempotent
 def skills_new():
     """
     Creazione di una nuova skill.
@@ -93,14 +129,23 @@ def skills_detail(skill_id):
         flash('Skill non trovata.', 'danger')
         return redirect(url_for('main.skills_list'))
 
-    sessions = SessionRepository.get_by_skill(skill_id)
+    show_archived = request.args.get('archived', type=int) == 1
+    sessions = SessionRepository.get_by_skill(skill_id, include_archived=show_archived)
+    analytics = get_user_analytics(g.user.id)['skills'].get(skill_id)
+    forecast = get_forecasts([skill])[skill.id]
+    level_history = SessionRepository.get_level_history(skill_id)
     return render_template('main/skills/detail.html',
                            skill=skill,
-                           sessions=sessions)
+                           sessions=sessions,
+                           show_archived=show_archived,
+                           analytics=analytics,
+                           forecast=forecast,
+                           level_history=level_history)
 
 
 @bp.route('/skills/<int:skill_id>/edit', methods=['GET', 'POST'])
 @login_required
+@idempotent
 def skills_edit(skill_id):
     """
     Modifica di una skill esistente.
@@ -144,6 +189,7 @@ def skills_edit(skill_id):
 
 @bp.route('/skills/<int:skill_id>/delete', methods=['POST'])
 @login_required
+@idempotent
 def skills_delete(skill_id):
     """
     Eliminazione di una skill.
@@ -168,12 +214,16 @@ def sessions_list():
     """
     Lista di tutte le sessioni dell'utente.
     """
-    sessions = SessionRepository.get_all_by_user(g.user.id)
-    return render_template('main/sessions/list.html', sessions=sessions)
+    show_archived = request.args.get('archived', type=int) == 1
+    sessions = SessionRepository.get_all_by_user(g.user.id, include_archived=show_archived)
+    return render_template('main/sessions/list.html',
+                           sessions=sessions,
+                           show_archived=show_archived)
 
 
 @bp.route('/sessions/new', methods=['GET', 'POST'])
 @login_required
+@idempotent
 def sessions_new():
     """
     Creazione di una nuova sessione.
@@ -193,6 +243,8 @@ def sessions_new():
             error = 'Seleziona una skill.'
         elif not session_date:
             error = 'La data è richiesta.'
+        elif normalize_session_date(session_date) is None:
+            error = 'Data non valida: usa il formato AAAA-MM-GG (dal 1900 a un anno da oggi).'
         elif duration_minutes < 1:
             error = 'La durata deve essere almeno 1 minuto.'
         elif xp_gained < 0:
@@ -204,7 +256,8 @@ def sessions_new():
             error = 'Skill non valida.'
 
         if error is None:
-            SessionRepository.create(
+            # Registra la sessione e aggiorna gli XP della skill
+            result = SessionRepository.record(
                 skill_id=skill_id,
                 user_id=g.user.id,
                 date=session_date,
@@ -212,9 +265,7 @@ def sessions_new():
                 xp_gained=xp_gained,
                 notes=notes or None
             )
-            # Aggiorna gli XP della skill
-            result = SkillRepository.add_xp(skill_id, xp_gained)
-            if result and result['level_up']:
+            if result['level_up']:
                 flash(f'Congratulazioni! {skill.name} è salita al livello {result["new_level"]}!', 'warning')
             flash('Sessione registrata con successo!', 'success')
             return redirect(url_for('main.sessions_list'))
@@ -230,6 +281,7 @@ def sessions_new():
 
 @bp.route('/sessions/<int:session_id>/edit', methods=['GET', 'POST'])
 @login_required
+@idempotent
 def sessions_edit(session_id):
     """
     Modifica di una sessione esistente.
@@ -242,14 +294,19 @@ def sessions_edit(session_id):
     skills = SkillRepository.get_all_by_user(g.user.id)
 
     if request.method == 'POST':
+        skill_id = request.form.get('skill_id', session_obj.skill_id, type=int)
         session_date = request.form.get('date', '')
         duration_minutes = request.form.get('duration_minutes', 0, type=int)
         xp_gained = request.form.get('xp_gained', 0, type=int)
         notes = request.form.get('notes', '').strip()
 
         error = None
-        if not session_date:
+        if skill_id not in {skill.id for skill in skills}:
+            error = 'Seleziona una skill valida.'
+        elif not session_date:
             error = 'La data è richiesta.'
+        elif normalize_session_date(session_date) is None:
+            error = 'Data non valida: usa il formato AAAA-MM-GG (dal 1900 a un anno da oggi).'
         elif duration_minutes < 1:
             error = 'La durata deve essere almeno 1 minuto.'
         elif xp_gained < 0:
@@ -258,6 +315,7 @@ def sessions_edit(session_id):
         if error is None:
             SessionRepository.update(
                 session_id=session_id,
+                skill_id=skill_id,
                 date=session_date,
                 duration_minutes=duration_minutes,
                 xp_gained=xp_gained,
@@ -271,12 +329,13 @@ def sessions_edit(session_id):
     return render_template('main/sessions/form.html',
                            session=session_obj,
                            skills=skills,
-                           skill_id_preselected=None,
+                           skill_id_preselected=session_obj.skill_id,
                            today=date.today().isoformat())
 
 
 @bp.route('/sessions/<int:session_id>/delete', methods=['POST'])
 @login_required
+@idempotent
 def sessions_delete(session_id):
     """
     Eliminazione di una sessione.
@@ -286,9 +345,7 @@ def sessions_delete(session_id):
         flash('Sessione non trovata.', 'danger')
         return redirect(url_for('main.sessions_list'))
 
-    # Sottrai gli XP dalla skill PRIMA di eliminare la sessione
-    SkillRepository.add_xp(session_obj.skill_id, -session_obj.xp_gained)
-
+    # Gli XP vengono tolti dalla skill nella stessa transazione
     SessionRepository.delete(session_id)
     flash('Sessione eliminata.', 'info')
     return redirect(url_for('main.sessions_list'))
@@ -310,6 +367,7 @@ def categories_list():
 
 @bp.route('/categories/new', methods=['GET', 'POST'])
 @login_required
+@idempotent
 def categories_new():
     """
     Creazione di una nuova categoria.
@@ -334,6 +392,7 @@ def categories_new():
 
 @bp.route('/categories/<int:category_id>/edit', methods=['GET', 'POST'])
 @login_required
+@idempotent
 def categories_edit(category_id):
     """
     Modifica di una categoria esistente.
@@ -363,6 +422,7 @@ def categories_edit(category_id):
 
 @bp.route('/categories/<int:category_id>/delete', methods=['POST'])
 @login_required
+@idempotent
 def categories_delete(category_id):
     """
     Eliminazione di una categoria.
@@ -375,3 +435,75 @@ def categories_delete(category_id):
     CategoryRepository.delete(category_id)
     flash(f'Categoria "{category.name}" eliminata.', 'info')
     return redirect(url_for('main.categories_list'))
+
+
+# ============================================================================
+# CLASSIFICHE
+# ============================================================================
+
+@bp.route('/leaderboard')
+@login_required
+def leaderboard():
+    """
+    Classifiche globali: XP totali, per categoria e della settimana.
+    """
+    if not current_app.config['LEADERBOARDS_ENABLED']:
+        flash('Le classifiche non sono attive.', 'info')
+        return redirect(url_for('main.dashboard'))
+
+    board = request.args.get('board', 'total')
+    if board not in BOARDS:
+        board = 'total'
+
+    categories = LeaderboardRepository.get_categories()
+    key = None
+    if board == 'category':
+        key = request.args.get('category') or (categories[0] if categories else None)
+    elif board == 'week':
+        key = week_start(date.today())
+
+    # Paginazione per chiave: ?after=<punteggio>:<user_id>
+    after = None
+    after_arg = request.args.get('after', '')
+    if ':' in after_arg:
+        score, user_id = after_arg.split(':', 1)
+        if score.lstrip('-').isdigit() and user_id.isdigit():
+            after = (int(score), int(user_id))
+
+    page_size = current_app.config['LEADERBOARD_PAGE_SIZE']
+    rows = LeaderboardRepository.get_page(board, key, limit=page_size, after=after)
+    next_after = f'{rows[-1]["score"]}:{rows[-1]["user_id"]}' if len(rows) == page_size else None
+
+    return render_template('main/leaderboard.html',
+                           board=board,
+                           key=key,
+                           categories=categories,
+                           rows=rows,
+                           next_after=next_after,
+                           is_member=LeaderboardRepository.is_member(g.user.id),
+                           my_rank=LeaderboardRepository.get_rank(board, g.user.id, key))
+
+
+@bp.route('/leaderboard/join', methods=['POST'])
+@login_required
+@idempotent
+def leaderboard_join():
+    """
+    Partecipazione alle classifiche (opt-in).
+    """
+    if current_app.config['LEADERBOARDS_ENABLED']:
+        LeaderboardRepository.join(g.user.id)
+        flash('Ora partecipi alle classifiche.', 'success')
+    return redirect(url_for('main.leaderboard'))
+
+
+@bp.route('/leaderboard/leave', methods=['POST'])
+@login_required
+@idempotent
+def leaderboard_leave():
+    """
+    Uscita dalle classifiche: i punteggi dell'utente vengono rimossi.
+    """
+    LeaderboardRepository.leave(g.user.id)
+    flash('Non partecipi più alle classifiche.', 'info')
+    return redirect(url_for('main.leaderboard'))
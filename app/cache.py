@@ -0,0 +1,322 @@
+"""
+Cache read-through dei metodi di lettura dei repository.
+
+I metodi decorati con @cached salvano il risultato con una chiave fatta
+da metodo, argomenti, file dei dati e versione dei dati dell'utente
+(tabella cache_versions, incrementata dai trigger su categorie, skills e
+sessioni). Qualsiasi scrittura sui dati di un utente, da una richiesta,
+da un job o da un comando CLI, cambia la versione: le voci vecchie di
+quell'utente non vengono più lette e scadono o vengono espulse, quelle
+degli altri utenti restano valide.
+
+Backend (REPOSITORY_CACHE_BACKEND):
+- 'memory': LRU in memoria del processo, con REPOSITORY_CACHE_SIZE voci
+  al massimo e durata REPOSITORY_CACHE_TTL. I risultati sono condivisi
+  tra le richieste e non vanno modificati;
+- 'sqlite': file SQLite locale (REPOSITORY_CACHE_PATH) condiviso da
+  tutti i worker, con i risultati serializzati con pickle. Conviene per
+  le letture più pesanti: ogni lettura dalla cache è comunque una query.
+
+La versione dell'utente viene letta una volta per richiesta GET (le
+richieste GET non scrivono) e a ogni chiamata negli altri casi.
+"""
+import functools
+import inspect
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import click
+from flask import current_app, g, has_app_context
+
+from app.db import get_connection, is_read_only_request
+
+# Voci scritte dal processo tra una pulizia e l'altra del backend SQLite
+_EVICT_EVERY = 256
+
+_MISSING = object()
+
+
+class MemoryBackend:
+    """
+    LRU in memoria con durata massima delle voci, thread-safe.
+    """
+
+    def __init__(self, max_entries=4096, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    """
+    Cache in un file SQLite condiviso tra i processi: una connessione per
+    thread, voci serializzate con pickle. Le voci oltre `max_entries`
+    (prima quelle che scadono prima) vengono eliminate ogni _EVICT_EVERY
+    scritture del processo.
+
+    Gli errori del file (database occupato oltre il timeout, file non
+    scrivibile) valgono come voce mancante: la cache non blocca mai una
+    richiesta.
+    """
+
+    def __init__(self, path, max_entries=4096, ttl=300, timeout=0.1):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.timeout = timeout
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _db(self):
+        # Connessione diretta e non app.db.connect: autocommit e timeout
+        # brevi, nessuna chiave esterna o metrica delle query applicative
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            db.execute('PRAGMA journal_mode = WAL')
+            # Il contenuto si può sempre ricostruire
+            db.execute('PRAGMA synchronous = OFF')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    expires_at REAL NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            db.execute('CREATE INDEX IF NOT EXISTS idx_cache_entries_expires ON cache_entries (expires_at)')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def get(self, key):
+        try:
+            row = self._db().execute(
+                'SELECT value FROM cache_entries WHERE key = ? AND expires_at >= ?',
+                (repr(key), time.time())
+            ).fetchone()
+        except sqlite3.Error:
+            return _MISSING
+        if row is None:
+            return _MISSING
+        try:
+            return pickle.loads(row[0])
+        except Exception:
+            # Voce scritta da una versione precedente del codice
+            return _MISSING
+
+    def set(self, key, value):
+        try:
+            self._db().execute(
+                'INSERT OR REPLACE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)',
+                (repr(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), time.time() + self.ttl)
+            )
+        except sqlite3.Error:
+            return
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % _EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Elimina le voci scadute e quelle oltre `max_entries`.
+        """
+        try:
+            db = self._db()
+            db.execute('DELETE FROM cache_entries WHERE expires_at < ?', (time.time(),))
+            excess = db.execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0] - self.max_entries
+            if excess > 0:
+                db.execute('''
+                    DELETE FROM cache_entries WHERE key IN (
+                        SELECT key FROM cache_entries ORDER BY expires_at LIMIT ?
+                    )
+                ''', (excess,))
+        except sqlite3.Error:
+            pass
+
+    def __len__(self):
+        try:
+            return self._db().execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def clear(self):
+        self._db().execute('DELETE FROM cache_entries')
+
+
+class RepositoryCache:
+    """
+    Backend più statistiche di successi e mancati successi per metodo
+    (del processo).
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, method, hit):
+        with self._lock:
+            (self.hits if hit else self.misses)[method] += 1
+
+    def stats(self):
+        """
+        Returns:
+            dict: hits, misses ed entries (voci nel backend)
+        """
+        with self._lock:
+            hits, misses = sum(self.hits.values()), sum(self.misses.values())
+        return {'hits': hits, 'misses': misses, 'entries': len(self.backend)}
+
+    def method_stats(self):
+        """
+        Returns:
+            list[dict]: method, hits, misses, hit_ratio (percentuale), per letture
+        """
+        with self._lock:
+            methods = set(self.hits) | set(self.misses)
+            rows = [{'method': method, 'hits': self.hits[method], 'misses': self.misses[method]}
+                    for method in methods]
+        for row in rows:
+            row['hit_ratio'] = round(row['hits'] * 100 / (row['hits'] + row['misses']), 1)
+        return sorted(rows, key=lambda row: row['hits'] + row['misses'], reverse=True)
+
+    def clear(self):
+        self.backend.clear()
+
+
+def get_repository_cache(app):
+    return app.extensions.get('repository_cache')
+
+
+def _user_data_path(user_id):
+    if not current_app.config['DB_SHARDS']:
+        return current_app.config['DATABASE']
+    from app.sharding import get_user_shard, shard_path
+    return shard_path(get_user_shard(user_id))
+
+
+def get_cache_version(path, user_id):
+    """
+    Versione dei dati dell'utente nel file `path` (0 se mai modificati).
+    Nelle richieste GET viene letta una sola volta per richiesta.
+    """
+    memo = g.setdefault('cache_versions', {}) if is_read_only_request() else None
+    if memo is not None and (path, user_id) in memo:
+        return memo[(path, user_id)]
+    row = get_connection(path).execute(
+        'SELECT version FROM cache_versions WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    version = row[0] if row else 0
+    if memo is not None:
+        memo[(path, user_id)] = version
+    return version
+
+
+def cached(user_arg='user_id'):
+    """
+    Decoratore per i metodi di lettura dei repository che ricevono l'ID
+    dell'utente proprietario dei dati nell'argomento `user_arg`
+    (da mettere sotto @staticmethod). Senza REPOSITORY_CACHE_BACKEND, o
+    fuori da un app context, il metodo viene sempre eseguito.
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+        method = fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            cache = get_repository_cache(current_app) if has_app_context() else None
+            if cache is None:
+                return fn(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            user_id = bound.arguments[user_arg]
+            path = _user_data_path(user_id)
+            key = (method, path, get_cache_version(path, user_id), tuple(bound.arguments.items()))
+
+            value = cache.backend.get(key)
+            cache.record(method, value is not _MISSING)
+            if value is _MISSING:
+                value = fn(*args, **kwargs)
+                cache.backend.set(key, value)
+            return value
+
+        return wrapper
+    return decorator
+
+
+@click.command('repository-cache-clear')
+def repository_cache_clear_command():
+    """
+    Svuota la cache condivisa dei repository (backend 'sqlite'), per
+    esempio dopo un aggiornamento del codice.
+    Uso: flask repository-cache-clear
+    """
+    cache = get_repository_cache(current_app)
+    if cache is None:
+        click.echo('REPOSITORY_CACHE_BACKEND non impostato.')
+        return
+    cache.clear()
+    click.echo('Cache dei repository svuotata.')
+
+
+def create_backend(config):
+    """
+    Backend indicato da REPOSITORY_CACHE_BACKEND ('memory', 'sqlite' o None).
+    """
+    name = config['REPOSITORY_CACHE_BACKEND']
+    if not name:
+        return None
+    if name == 'memory':
+        return MemoryBackend(config['REPOSITORY_CACHE_SIZE'], config['REPOSITORY_CACHE_TTL'])
+    if name == 'sqlite':
+        return SQLiteBackend(config['REPOSITORY_CACHE_PATH'], config['REPOSITORY_CACHE_SIZE'],
+                             config['REPOSITORY_CACHE_TTL'])
+    raise ValueError(f'REPOSITORY_CACHE_BACKEND non valido: {name!r}')
+
+
+def init_app(app):
+    """
+    Crea la cache dei repository con il backend configurato e registra il
+    comando CLI.
+    """
+    app.cli.add_command(repository_cache_clear_command)
+    backend = create_backend(app.config)
+    if backend is not None:
+        app.extensions['repository_cache'] = RepositoryCache(backend)
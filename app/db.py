@@ -1,42 +1,344 @@
+import functools
+import random
 import sqlite3
+import time
+from urllib.parse import quote
+
 import click
-from flask import current_app, g
+from flask import current_app, g, has_app_context, has_request_context, request
+from werkzeug.exceptions import ServiceUnavailable
+
+# Metodi HTTP che non modificano dati: usano connessioni in sola lettura
+SAFE_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+# Istruzioni prima delle quali il modulo sqlite3 apre da solo una transazione
+_WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def is_busy_error(error):
+    """
+    True se l'errore è un SQLITE_BUSY/SQLITE_LOCKED (database bloccato da
+    un'altra connessione oltre il busy timeout).
+    """
+    return isinstance(error, DatabaseBusy) or (
+        isinstance(error, sqlite3.OperationalError) and 'locked' in str(error))
+
+
+class DatabaseBusy(sqlite3.OperationalError, ServiceUnavailable):
+    """
+    Database ancora bloccato dopo tutti i tentativi di RetryPolicy.
+    È un sqlite3.OperationalError per chi gestisce gli errori di SQLite e
+    un'eccezione HTTP 503 con Retry-After per Flask: la richiesta risponde
+    503 (JSON nell'API) invece di 500.
+    """
+
+    description = 'Il database è occupato, riprova tra qualche secondo.'
+
+    def __init__(self, retry_after=1):
+        ServiceUnavailable.__init__(self, retry_after=retry_after)
+
+
+class RetryPolicy:
+    """
+    Tentativi sui punti di una transazione di scrittura che si possono
+    ripetere senza effetti (BEGIN IMMEDIATE e COMMIT) quando il database
+    resta bloccato oltre il busy timeout: fino a `retries` ripetizioni,
+    con attesa casuale tra 0 e min(`backoff_max`, `backoff` * 2^tentativo)
+    secondi (backoff esponenziale con jitter completo, così i processi in
+    attesa non riprovano tutti nello stesso istante).
+    """
+
+    def __init__(self, retries=5, backoff=0.025, backoff_max=1.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+
+class Connection(sqlite3.Connection):
+    """
+    Connessione SQLite dell'applicazione (aperta da connect).
+
+    Le transazioni di scrittura prendono subito il lock di scrittura: prima
+    di un INSERT/UPDATE/DELETE/REPLACE fuori da una transazione viene
+    eseguito BEGIN IMMEDIATE al posto del BEGIN (DEFERRED) implicito del
+    modulo sqlite3. Una transazione DEFERRED che ha già letto non può
+    attendere il lock: se un'altra connessione ha scritto nel frattempo
+    fallisce subito con SQLITE_BUSY, senza busy timeout.
+
+    Con `retry_policy` impostata BEGIN IMMEDIATE (implicito o esplicito) e
+    COMMIT vengono ripetuti secondo la policy; esauriti i tentativi viene
+    sollevato DatabaseBusy.
+
+    `before_commit(db)`, se impostata, viene eseguita dentro la transazione
+    subito prima del COMMIT (solo se la transazione è aperta); se solleva
+    un'eccezione la transazione viene annullata. `after_begin(db)` viene
+    eseguita subito dopo ogni BEGIN IMMEDIATE/EXCLUSIVE, con il lock di
+    scrittura già preso; se solleva un'eccezione la transazione viene
+    annullata prima di qualsiasi scrittura.
+    """
+
+    retry_policy = None
+    before_commit = None
+    after_begin = None
+
+    def _busy_retry(self):
+        """
+        Chiamato prima di ogni ripetizione (le metriche la contano).
+        """
+
+    def _retry(self, method, *args):
+        policy = self.retry_policy
+        attempt = 0
+        while True:
+            try:
+                return method(*args)
+            except sqlite3.OperationalError as e:
+                if policy is None or not is_busy_error(e):
+                    raise
+                if attempt >= policy.retries:
+                    raise DatabaseBusy() from e
+            self._busy_retry()
+            time.sleep(policy.delay(attempt))
+            attempt += 1
+
+    def _begin_write(self, sql):
+        """
+        Apre la transazione di scrittura se `sql` la aprirebbe implicitamente.
+
+        Returns:
+            bool: True se `sql` è un BEGIN IMMEDIATE/EXCLUSIVE esplicito,
+                  da eseguire con i tentativi della policy
+        """
+        if self.in_transaction or self.isolation_level is None:
+            return False
+        keyword = sql.lstrip()[:9].upper()
+        if keyword.startswith(_WRITE_STATEMENTS):
+            self._retry(super().execute, 'BEGIN IMMEDIATE')
+            self._after_begin()
+            return False
+        return keyword.startswith('BEGIN') and ('IMMEDIATE' in sql.upper() or 'EXCLUSIVE' in sql.upper())
+
+    def _after_begin(self):
+        if self.after_begin is not None:
+            try:
+                self.after_begin(self)
+            except Exception:
+                self.rollback()
+                raise
+
+    def execute(self, sql, *args):
+        if self._begin_write(sql):
+            cursor = self._retry(super().execute, sql, *args)
+            self._after_begin()
+            return cursor
+        return super().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        self._begin_write(sql)
+        return super().executemany(sql, *args)
+
+    def commit(self):
+        if self.in_transaction and self.before_commit is not None:
+            try:
+                self.before_commit(self)
+            except Exception:
+                self.rollback()
+                raise
+        self._retry(super().commit)
+
+
+def connect(path, read_only=False, wal=False):
+    """
+    Apre una nuova connessione SQLite con le impostazioni dell'applicazione.
+    Usata sia dalle richieste sia dai comandi CLI e dai job in background.
+
+    Le connessioni in sola lettura usano un URI `mode=ro` e `query_only`,
+    quindi qualsiasi scrittura fallisce invece di prendere il lock.
+    Le chiavi esterne sono sempre applicate (ON DELETE CASCADE / SET NULL
+    dello schema), dato che SQLite le ignora se non richieste esplicitamente.
+    Con le metriche attive (METRICS_ENABLED) la connessione conta query,
+    tempo speso ed errori SQLITE_BUSY.
+
+    Ogni attesa del lock dura al massimo DB_BUSY_TIMEOUT_MS; le
+    connessioni di scrittura aprono le transazioni con BEGIN IMMEDIATE e
+    le ripetono con DB_BUSY_RETRIES tentativi (vedi Connection).
+    """
+    metrics = current_app.extensions.get('metrics') if has_app_context() else None
+    factory = Connection
+    if metrics is not None:
+        from app.metrics import InstrumentedConnection as factory
+    config = current_app.config if has_app_context() else {}
+    timeout = config.get('DB_BUSY_TIMEOUT_MS', 5000) / 1000
+
+    if read_only:
+        db = sqlite3.connect(
+            f'file:{quote(path)}?mode=ro',
+            uri=True,
+            timeout=timeout,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            factory=factory
+        )
+        if metrics is not None:
+            metrics.connection_opened(db, read_only)
+        db.execute('PRAGMA query_only = ON')
+    else:
+        db = sqlite3.connect(
+            path,
+            timeout=timeout,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            factory=factory
+        )
+        if metrics is not None:
+            metrics.connection_opened(db, read_only)
+        db.retry_policy = RetryPolicy(
+            retries=config.get('DB_BUSY_RETRIES', 0),
+            backoff=config.get('DB_BUSY_BACKOFF_MS', 25) / 1000,
+            backoff_max=config.get('DB_BUSY_BACKOFF_MAX_MS', 1000) / 1000
+        )
+        # Ha effetto solo su un file nuovo: va impostato prima del journal WAL.
+        # Su un file esistente prenderebbe comunque il lock di scrittura
+        if db.execute('PRAGMA page_count').fetchone()[0] == 0:
+            db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        if wal:
+            db.execute('PRAGMA journal_mode = WAL')
+    db.execute('PRAGMA foreign_keys = ON')
+    db.row_factory = sqlite3.Row
+    return db
+
+
+def is_read_only_request():
+    """
+    True se la richiesta corrente usa un metodo sicuro (GET, HEAD, OPTIONS)
+    e la separazione lettura/scrittura è attiva.
+    """
+    return (current_app.config['DB_READ_ONLY_GET']
+            and has_request_context()
+            and request.method in SAFE_METHODS)
+
+
+def get_connection(path, write=False):
+    """
+    Restituisce la connessione della richiesta corrente al file `path`.
+
+    Viene aperta al massimo una connessione per file e per modalità:
+    le letture nelle richieste GET usano la connessione in sola lettura,
+    tutto il resto (POST, CLI, job) usa la connessione di scrittura.
+    """
+    read_only = not write and is_read_only_request()
+    connections = g.setdefault('db_connections', {})
+
+    key = (path, read_only)
+    if key not in connections:
+        db = connect(path,
+                     read_only=read_only,
+                     wal=current_app.config['DB_WAL'])
+        if current_app.config['ARCHIVE_ENABLED']:
+            from app.archive import attach_archive
+            attach_archive(db, path, read_only)
+        if not read_only and current_app.config['DB_SHARDS'] and path != current_app.config['DATABASE']:
+            from app.sharding import check_shard_users
+            db.after_begin = functools.partial(check_shard_users, path)
+        connections[key] = db
+    return connections[key]
+
+
+def take_before_commit(path):
+    """
+    Toglie e restituisce la funzione before_commit della connessione di
+    scrittura a `path` della richiesta corrente (None se non impostata),
+    per eseguirla in una transazione su un'altra connessione (group commit).
+    """
+    db = g.get('db_connections', {}).get((path, False))
+    if db is None or db.before_commit is None:
+        return None
+    hook, db.before_commit = db.before_commit, None
+    return hook
+
+
+def get_directory_db(write=False):
+    """
+    Ottiene la connessione al database principale (DATABASE).
+
+    Senza sharding contiene tutti i dati; con lo sharding attivo contiene
+    solo gli utenti e l'assegnazione utente -> shard.
+    """
+    return get_connection(current_app.config['DATABASE'], write)
+
+
+def user_data_path():
+    """
+    File che contiene i dati dell'utente loggato: lo shard assegnato
+    se lo sharding è attivo, altrimenti il database principale.
+    """
+    user = g.get('user')
+    if not current_app.config['DB_SHARDS'] or user is None:
+        return current_app.config['DATABASE']
+
+    from app.sharding import get_user_shard, shard_path
+    return shard_path(get_user_shard(user.id))
+
+
+def get_user_db(user_id, write=False):
+    """
+    Connessione al file che contiene i dati di un utente qualsiasi
+    (non necessariamente quello loggato).
+    """
+    if not current_app.config['DB_SHARDS']:
+        return get_directory_db(write)
+
+    from app.sharding import get_shard_db, get_user_shard
+    return get_shard_db(get_user_shard(user_id), write)
 
 
 def get_db():
     """
     Ottiene la connessione al database per la richiesta corrente.
     Se non esiste, ne crea una nuova.
+
+    Con lo sharding attivo (DB_SHARDS > 0) restituisce la connessione allo
+    shard dell'utente loggato (g.user). Nelle richieste GET la connessione
+    è in sola lettura: i metodi di scrittura dei repository devono usare
+    get_write_db().
     """
-    if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+    return get_connection(user_data_path())
 
-    return g.db
+
+def get_write_db():
+    """
+    Ottiene la connessione di scrittura ai dati dell'utente corrente.
+    """
+    return get_connection(user_data_path(), write=True)
 
 
 def close_db(e=None):
     """
     Chiude la connessione al database se esiste.
     """
-    db = g.pop('db', None)
-
-    if db is not None:
+    for db in g.pop('db_connections', {}).values():
         db.close()
 
 
 def init_db():
     """
     Inizializza il database eseguendo lo schema SQL.
+    Con lo sharding attivo inizializza anche tutti i file shard.
     """
-    db = get_db()
+    db = get_directory_db(write=True)
 
     with current_app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode('utf8'))
 
+    if current_app.config['ARCHIVE_ENABLED']:
+        from app.archive import reset_archive
+        reset_archive(db)
+
+    if current_app.config['DB_SHARDS']:
+        from app.sharding import init_shards
+        init_shards(reset=True)
+
 
 @click.command('init-db')
 def init_db_command():
@@ -54,3 +356,6 @@ def init_app(app):
     """
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+
+    from app.sharding import init_app as init_sharding
+    init_sharding(app)
@@ -0,0 +1,307 @@
+"""
+Aggiornamenti in tempo reale della dashboard con Server-Sent Events.
+
+Con EVENTS_ENABLED ogni pagina dashboard apre uno stream /events e riceve
+piccoli eventi quando i dati del suo utente cambiano: la sessione appena
+registrata, i nuovi XP e livello della skill, i totali aggiornati, anche
+per le scritture gestite da un altro processo worker. La pagina si
+aggiorna sul posto senza rieseguire tutte le query della dashboard.
+
+Ogni processo ha un broker in memoria e un thread che, per gli utenti con
+almeno uno stream aperto, confronta change_log_state.seq (registro delle
+modifiche, app/sync.py) con l'ultima posizione pubblicata e costruisce
+gli eventi dalle righe nuove di change_log. Il thread controlla ogni
+EVENTS_POLL_INTERVAL secondi e viene svegliato subito dalle scritture del
+proprio processo (notify_changes, chiamata dai repository dopo il commit).
+"""
+import json
+import os
+import queue
+import threading
+import time
+from datetime import date, timedelta
+
+from flask import current_app, g
+
+from app.db import get_user_db
+
+# Giorni delle sessioni recenti mostrate dalla dashboard
+RECENT_SESSION_DAYS = 7
+
+
+def format_event(event, data):
+    """
+    Messaggio SSE (`event:` + `data:` JSON su una riga).
+    """
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"), default=str)}\n\n'
+
+
+class _Subscription:
+    __slots__ = ('queue', 'overflowed')
+
+    def __init__(self, size):
+        self.queue = queue.Queue(maxsize=size)
+        self.overflowed = False
+
+
+class EventBroker:
+    """
+    Pub/sub in memoria: ogni stream aperto è una coda per utente.
+
+    Il messaggio viene serializzato una sola volta e condiviso da tutte le
+    code dell'utente. Uno stream che non consuma (coda piena) viene chiuso
+    con un evento `reload` invece di far crescere la memoria.
+    """
+
+    def __init__(self, app, queue_size=100, max_streams_per_user=5, poll_interval=1.0):
+        self.app = app
+        self.queue_size = queue_size
+        self.max_streams_per_user = max_streams_per_user
+        self.poll_interval = poll_interval
+        self._subscribers = {}
+        # user_id -> (shard, seq) dell'ultima modifica pubblicata
+        self._positions = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def subscribe(self, user_id, position):
+        """
+        `position` = change_position(user_id) all'apertura dello stream.
+
+        Returns:
+            _Subscription o None se l'utente ha già troppi stream aperti
+        """
+        with self._lock:
+            subscriptions = self._subscribers.setdefault(user_id, set())
+            if len(subscriptions) >= self.max_streams_per_user:
+                return None
+            subscription = _Subscription(self.queue_size)
+            subscriptions.add(subscription)
+            self._positions.setdefault(user_id, position)
+        self._ensure_started()
+        return subscription
+
+    def unsubscribe(self, user_id, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[user_id]
+                    self._positions.pop(user_id, None)
+
+    def has_subscribers(self, user_id):
+        return user_id in self._subscribers
+
+    def publish(self, user_id, event, data):
+        """
+        Invia un evento a tutti gli stream aperti dell'utente.
+
+        Returns:
+            int: Stream raggiunti
+        """
+        with self._lock:
+            subscriptions = list(self._subscribers.get(user_id, ()))
+        if not subscriptions:
+            return 0
+
+        message = format_event(event, data)
+        delivered = 0
+        for subscription in subscriptions:
+            try:
+                subscription.queue.put_nowait(message)
+                delivered += 1
+            except queue.Full:
+                subscription.overflowed = True
+                self.unsubscribe(user_id, subscription)
+        return delivered
+
+    def notify(self):
+        """
+        Sveglia subito il thread che legge il registro delle modifiche.
+        """
+        self._wake.set()
+
+    def stats(self):
+        with self._lock:
+            return {'users': len(self._subscribers),
+                    'streams': sum(len(s) for s in self._subscribers.values())}
+
+    def _ensure_started(self):
+        """
+        Avvia il thread di lettura del registro (di nuovo dopo un fork o se
+        è terminato).
+        """
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='events-poller', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            with self._lock:
+                user_ids = list(self._subscribers)
+            if not user_ids:
+                continue
+            try:
+                with self.app.app_context():
+                    for user_id in user_ids:
+                        self.poll(user_id)
+            except Exception:
+                self.app.logger.exception('Eventi: lettura del registro delle modifiche fallita')
+
+    def poll(self, user_id):
+        """
+        Pubblica gli eventi per le modifiche dell'utente successive
+        all'ultima posizione pubblicata (dentro un app context).
+        """
+        position = change_position(user_id)
+        with self._lock:
+            last = self._positions.get(user_id)
+            if last is None or last == position:
+                return
+            self._positions[user_id] = position
+
+        (shard, seq), (last_shard, last_seq) = position, last
+        if shard != last_shard or seq < last_seq or seq - last_seq > self.queue_size:
+            # Utente spostato, registro azzerato o troppe modifiche
+            self.publish(user_id, 'reload', {})
+            return
+
+        entries = get_user_db(user_id).execute('''
+            SELECT entity, entity_id, op FROM change_log
+            WHERE user_id = ? AND seq > ? AND seq <= ?
+            ORDER BY seq
+        ''', (user_id, last_seq, seq)).fetchall()
+        if entries:
+            publish_entries(self, user_id, entries)
+
+
+def stream(broker, user_id, subscription, heartbeat):
+    """
+    Generatore della risposta text/event-stream. Non usa il contesto della
+    richiesta: la connessione al database è già chiusa mentre lo stream
+    resta aperto, e lo scheduler non conta lo stream come richiesta in corso.
+    """
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            if subscription.overflowed and subscription.queue.empty():
+                # Eventi persi: la pagina si ricarica per intero
+                yield format_event('reload', {})
+                return
+            try:
+                message = subscription.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                # Commento SSE: tiene viva la connessione attraverso i proxy
+                yield f': {int(time.time())}\n\n'
+                continue
+            yield message
+    finally:
+        broker.unsubscribe(user_id, subscription)
+
+
+def get_broker(app):
+    return app.extensions.get('events')
+
+
+def change_position(user_id):
+    """
+    Posizione attuale del registro delle modifiche dell'utente.
+
+    Returns:
+        tuple: (shard dell'utente o None senza sharding, ultima seq)
+    """
+    shard = None
+    if current_app.config['DB_SHARDS']:
+        from app.sharding import get_user_shard
+        shard = get_user_shard(user_id)
+    row = get_user_db(user_id).execute(
+        'SELECT seq FROM change_log_state WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    return shard, row[0] if row else 0
+
+
+def publish_entries(broker, user_id, entries):
+    """
+    Eventi per un gruppo di righe del registro delle modifiche: sessioni
+    recenti (quelle elencate dalla dashboard) ed eliminate, skills
+    aggiornate ed eliminate, poi i totali.
+    """
+    from app.modelli import User
+    from app.repositories import SessionRepository, SkillRepository
+    sessions, skills = {}, {}
+    for entity, entity_id, op in entries:
+        if entity == 'session':
+            sessions[entity_id] = op
+        elif entity == 'skill':
+            skills[entity_id] = op
+
+    # Le letture dei repository usano il file dei dati di g.user
+    g.user = User(user_id, '', '', '', None)
+    try:
+        recent = (date.today() - timedelta(days=RECENT_SESSION_DAYS)).isoformat()
+        deleted_sessions = []
+        for session_id, op in sessions.items():
+            session = SessionRepository.get_by_id(session_id) if op == 'upsert' else None
+            if session is None:
+                deleted_sessions.append(session_id)
+            elif str(session.date) >= recent:
+                broker.publish(user_id, 'session', {
+                    'id': session.id, 'skill_id': session.skill_id, 'skill_name': session.skill_name,
+                    'date': session.date, 'duration_formatted': session.duration_formatted,
+                    'xp_gained': session.xp_gained
+                })
+        for session_id in deleted_sessions:
+            broker.publish(user_id, 'session_deleted', {'id': session_id})
+
+        for skill_id, op in skills.items():
+            skill = SkillRepository.get_by_id(skill_id) if op == 'upsert' else None
+            if skill is None:
+                broker.publish(user_id, 'skill_deleted', {'id': skill_id})
+            else:
+                broker.publish(user_id, 'skill', {
+                    'id': skill.id, 'name': skill.name, 'total_xp': skill.total_xp,
+                    'current_level': skill.current_level, 'target_level': skill.target_level,
+                    'progress_percentage': round(skill.progress_percentage),
+                    'xp_needed_for_next_level': skill.xp_needed_for_next_level
+                })
+
+        skill_stats = SkillRepository.get_stats_by_user(user_id)
+        session_stats = SessionRepository.get_stats_by_user(user_id)
+        broker.publish(user_id, 'stats', {
+            'total_skills': skill_stats['total_skills'], 'total_xp': skill_stats['total_xp'],
+            'avg_level': skill_stats['avg_level'], 'total_hours': session_stats['total_hours']
+        })
+    finally:
+        g.pop('user', None)
+
+
+def notify_changes():
+    """
+    Da chiamare dopo il commit di una scrittura sui dati di un utente: gli
+    stream di questo processo ricevono gli eventi subito, quelli degli
+    altri worker al controllo successivo (EVENTS_POLL_INTERVAL).
+    """
+    broker = get_broker(current_app)
+    if broker is not None:
+        broker.notify()
+
+
+def init_app(app):
+    """
+    Crea il broker degli eventi se EVENTS_ENABLED è attivo.
+    """
+    if app.config['EVENTS_ENABLED']:
+        app.extensions['events'] = EventBroker(
+            app,
+            queue_size=app.config['EVENTS_QUEUE_SIZE'],
+            max_streams_per_user=app.config['EVENTS_MAX_STREAMS_PER_USER'],
+            poll_interval=app.config['EVENTS_POLL_INTERVAL']
+        )
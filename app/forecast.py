@@ -0,0 +1,139 @@
+"""
+Previsione della data di completamento degli obiettivi delle skills.
+
+Per ogni skill si stima il ritmo recente (XP al giorno) con una regressione
+ai minimi quadrati sugli XP cumulati degli ultimi FORECAST_WINDOW_DAYS
+giorni, e si proietta la data in cui gli XP totali raggiungeranno quelli
+richiesti da target_level secondo la curva dei livelli.
+
+Tutte le skills di un utente vengono stimate con una sola query e un solo
+calcolo vettoriale. Ogni previsione resta in cache finché non cambia la
+versione della skill (tabella skill_versions, aggiornata dai trigger su
+skills e sessions) o la data odierna. Come in app/analytics.py, NumPy
+viene importato al primo calcolo.
+"""
+import math
+from datetime import date, timedelta
+
+from flask import current_app
+
+from app.analytics import AnalyticsCache
+from app.db import get_db, user_data_path
+
+
+def get_skill_versions(db, skill_ids):
+    """
+    Versione corrente di ogni skill (0 se mai modificata).
+    """
+    placeholders = ', '.join('?' * len(skill_ids))
+    rows = db.execute(
+        f'SELECT skill_id, version FROM skill_versions WHERE skill_id IN ({placeholders})',
+        tuple(skill_ids)
+    ).fetchall()
+    versions = dict.fromkeys(skill_ids, 0)
+    versions.update((row['skill_id'], row['version']) for row in rows)
+    return versions
+
+
+def load_recent_xp(db, user_id, skill_ids, today, window):
+    """
+    Matrice skill x giorno degli XP guadagnati negli ultimi `window` giorni
+    (l'ultima colonna è oggi), nell'ordine di `skill_ids`.
+    """
+    placeholders = ', '.join('?' * len(skill_ids))
+    start = today - timedelta(days=window - 1)
+    rows = db.execute(f'''
+        SELECT skill_id, CAST(julianday(date) - julianday(?) AS INTEGER) as day, SUM(xp_gained) as xp
+        FROM sessions
+        WHERE user_id = ? AND date >= ? AND date <= ? AND skill_id IN ({placeholders})
+        GROUP BY skill_id, date
+    ''', (start.isoformat(), user_id, start.isoformat(), today.isoformat(), *skill_ids)).fetchall()
+
+    import numpy as np
+    daily = np.zeros((len(skill_ids), window))
+    if rows:
+        position = {skill_id: i for i, skill_id in enumerate(skill_ids)}
+        data = np.array([(position[row['skill_id']], row['day'], row['xp']) for row in rows])
+        np.add.at(daily, (data[:, 0].astype(int), data[:, 1].astype(int)), data[:, 2])
+    return daily
+
+
+def fit_rates(daily):
+    """
+    Pendenza (XP/giorno) della retta ai minimi quadrati sugli XP cumulati,
+    calcolata per tutte le righe insieme.
+    """
+    import numpy as np
+    cumulative = np.cumsum(daily, axis=1)
+    t = np.arange(daily.shape[1], dtype=np.float64)
+    t -= t.mean()
+    centered = cumulative - cumulative.mean(axis=1, keepdims=True)
+    return centered @ t / (t @ t)
+
+
+def project(skill, rate, today, max_days):
+    """
+    Previsione per una skill dato il ritmo stimato.
+
+    Returns:
+        dict: status ('complete', 'on_track', 'slow', 'no_data'), rate,
+              remaining_xp, days_left e date (ISO) quando disponibili
+    """
+    remaining = skill.xp_to_target
+    forecast = {'status': 'no_data', 'rate': round(float(max(rate, 0)), 1),
+                'remaining_xp': remaining, 'days_left': None, 'date': None}
+    if skill.is_complete() or remaining == 0:
+        forecast['status'] = 'complete'
+    elif rate > 0:
+        days_left = math.ceil(remaining / rate)
+        if days_left > max_days:
+            forecast['status'] = 'slow'
+        else:
+            forecast.update(status='on_track', days_left=days_left,
+                            date=(today + timedelta(days=days_left)).isoformat())
+    return forecast
+
+
+def get_forecasts(skills):
+    """
+    Previsioni per una lista di skills dello stesso utente.
+    Vengono ricalcolate, in un unico batch, solo le skills modificate
+    dall'ultima richiesta.
+
+    Returns:
+        dict: {skill_id: previsione}
+    """
+    if not skills:
+        return {}
+
+    config = current_app.config
+    db = get_db()
+    cache = current_app.extensions['forecast']
+    path = user_data_path()
+    today = date.today()
+    versions = get_skill_versions(db, [skill.id for skill in skills])
+
+    forecasts, missing = {}, []
+    for skill in skills:
+        cached = cache.get((path, skill.id), (versions[skill.id], today))
+        if cached is None:
+            missing.append(skill)
+        else:
+            forecasts[skill.id] = cached
+
+    if missing:
+        daily = load_recent_xp(db, missing[0].user_id, [skill.id for skill in missing],
+                               today, config['FORECAST_WINDOW_DAYS'])
+        rates = fit_rates(daily)
+        for skill, rate in zip(missing, rates):
+            forecast = project(skill, rate, today, config['FORECAST_MAX_DAYS'])
+            cache.put((path, skill.id), (versions[skill.id], today), forecast)
+            forecasts[skill.id] = forecast
+    return forecasts
+
+
+def init_app(app):
+    """
+    Crea la cache delle previsioni per l'applicazione.
+    """
+    app.extensions['forecast'] = AnalyticsCache(app.config['FORECAST_CACHE_SIZE'])
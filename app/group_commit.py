@@ -0,0 +1,249 @@
+"""
+Pipeline di scrittura "group commit" per la registrazione delle sessioni.
+
+Con GROUP_COMMIT_ENABLED le scritture accodate (inserimento sessione +
+incremento XP) vengono eseguite da un unico thread per processo, che le
+raggruppa in una sola transazione per batch. Un batch si chiude quando
+raggiunge GROUP_COMMIT_MAX_BATCH operazioni oppure dopo
+GROUP_COMMIT_MAX_DELAY_MS millisecondi dalla prima; ogni richiesta resta
+in attesa finché il commit del suo batch non è avvenuto.
+"""
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import Future
+
+from werkzeug.exceptions import ServiceUnavailable
+
+from app.db import connect
+
+
+class GroupCommitTimeout(ServiceUnavailable):
+    """
+    Il batch di una scrittura non è arrivato al commit entro
+    GROUP_COMMIT_TIMEOUT: la richiesta risponde 503 con Retry-After, ma il
+    job resta in coda e può ancora essere eseguito. `future` si risolve
+    quando il batch termina; `path` è il file del job.
+    """
+
+    description = 'La scrittura è ancora in corso, ricarica la pagina tra qualche secondo.'
+
+    def __init__(self, path, future, retry_after=1):
+        ServiceUnavailable.__init__(self, retry_after=retry_after)
+        self.path = path
+        self.future = future
+
+
+class Histogram:
+    """
+    Istogramma cumulativo a bucket fissi (stile Prometheus), thread-safe.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Conteggi cumulativi per bucket ('+Inf' incluso), somma e numero
+        """
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.total, self.count
+
+        cumulative = {}
+        running = 0
+        for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+            running += bucket_count
+            cumulative[bound] = running
+        return {'buckets': cumulative, 'sum': total, 'count': count}
+
+
+class _Job:
+    __slots__ = ('path', 'fn', 'future', 'submitted_at')
+
+    def __init__(self, path, fn):
+        self.path = path
+        self.fn = fn
+        self.future = Future()
+        self.submitted_at = time.perf_counter()
+
+
+class GroupCommitWriter:
+    """
+    Thread writer unico che esegue i job accodati in transazioni di gruppo.
+
+    Ogni job è una funzione `fn(db)` eseguita sulla connessione del file
+    indicato; gira dentro un SAVEPOINT, quindi l'errore di un job annulla
+    solo le sue modifiche e viene restituito alla sola richiesta che l'ha
+    accodato.
+    """
+
+    def __init__(self, app, max_batch=64, max_delay_ms=5, wal=True):
+        self.app = app
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.wal = wal
+        self.batch_sizes = Histogram((1, 2, 4, 8, 16, 32, 64, 128, 256))
+        self.latency_ms = Histogram((0.5, 1, 2, 5, 10, 25, 50, 100, 250, 1000))
+        self.commit_ms = Histogram((0.5, 1, 2, 5, 10, 25, 50, 100, 250, 1000))
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Il thread viene avviato al primo uso nel processo corrente, così
+        # funziona anche dopo un fork dei worker, e riavviato se è terminato
+        # (i job già in coda restano e vengono eseguiti dal nuovo thread).
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run,
+                                                name='group-commit-writer',
+                                                daemon=True)
+                self._thread.start()
+
+    def submit(self, path, fn):
+        """
+        Accoda un job di scrittura sul database `path`.
+
+        Returns:
+            Future: Risolto con il valore di `fn(db)` dopo il commit del batch
+        """
+        self._ensure_started()
+        job = _Job(path, fn)
+        self._queue.put(job)
+        return job.future
+
+    def stats(self):
+        """
+        Istogrammi di dimensione dei batch e latenze (attesa + commit).
+        """
+        return {
+            'max_batch': self.max_batch,
+            'max_delay_ms': self.max_delay * 1000,
+            'queue_depth': self._queue.qsize(),
+            'batch_size': self.batch_sizes.snapshot(),
+            'latency_ms': self.latency_ms.snapshot(),
+            'commit_ms': self.commit_ms.snapshot()
+        }
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        connections = {}
+        while True:
+            batch = self._collect_batch()
+            self.batch_sizes.observe(len(batch))
+
+            by_path = {}
+            for job in batch:
+                by_path.setdefault(job.path, []).append(job)
+
+            # I job possono usare la configurazione (es. l'archivio delle sessioni)
+            try:
+                with self.app.app_context():
+                    for path, jobs in by_path.items():
+                        try:
+                            if path not in connections:
+                                connections[path] = self._connect(path)
+                            self._commit_jobs(connections[path], jobs)
+                        except Exception as e:
+                            # Connessione in uno stato sconosciuto: riaperta al prossimo batch
+                            db = connections.pop(path, None)
+                            if db is not None:
+                                db.close()
+                            self._fail(jobs, e)
+            except Exception as e:
+                self._fail(batch, e)
+
+    def _fail(self, jobs, error):
+        """
+        Restituisce `error` alle richieste dei job non ancora risolti, senza
+        fermare il thread.
+        """
+        self.app.logger.error('Group commit: batch di %d job fallito', len(jobs), exc_info=error)
+        for job in jobs:
+            if not job.future.done():
+                job.future.set_exception(error)
+
+    def _connect(self, path):
+        db = connect(path, wal=self.wal)
+        if self.app.config['ARCHIVE_ENABLED']:
+            from app.archive import attach_archive
+            attach_archive(db, path)
+        return db
+
+    def _commit_jobs(self, db, jobs):
+        results = []
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            for job in jobs:
+                db.execute('SAVEPOINT job')
+                try:
+                    results.append((job, job.fn(db), None))
+                    db.execute('RELEASE job')
+                except Exception as e:
+                    db.execute('ROLLBACK TO job')
+                    db.execute('RELEASE job')
+                    results.append((job, None, e))
+
+            commit_started = time.perf_counter()
+            db.commit()
+            self.commit_ms.observe((time.perf_counter() - commit_started) * 1000)
+        except Exception as e:
+            if db.in_transaction:
+                db.rollback()
+            for job in jobs:
+                job.future.set_exception(e)
+            return
+
+        done_at = time.perf_counter()
+        for job, result, error in results:
+            self.latency_ms.observe((done_at - job.submitted_at) * 1000)
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+
+
+def init_app(app):
+    """
+    Crea il writer di gruppo se GROUP_COMMIT_ENABLED è attivo.
+    """
+    if app.config['GROUP_COMMIT_ENABLED']:
+        app.extensions['group_commit'] = GroupCommitWriter(
+            app,
+            max_batch=app.config['GROUP_COMMIT_MAX_BATCH'],
+            max_delay_ms=app.config['GROUP_COMMIT_MAX_DELAY_MS'],
+            wal=app.config['DB_WAL']
+        )
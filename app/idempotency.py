@@ -0,0 +1,162 @@
+"""
+Chiavi di idempotenza per le richieste di scrittura.
+
+Un client che ripete una richiesta (connessione mobile instabile, doppio
+invio del form, tasto "indietro") invia la stessa chiave, nell'header
+`Idempotency-Key` o nel campo nascosto `idempotency_key` dei form: la
+ripetizione riceve l'esito della prima esecuzione senza rieseguire le
+scritture, quindi nessuna sessione doppia e nessun XP applicato due volte.
+
+La chiave viene registrata nel file dei dati dell'utente, nella stessa
+transazione delle scritture della richiesta (Connection.before_commit o
+il job del group commit): se la transazione non arriva al commit la
+chiave non esiste e la ripetizione viene eseguita; se è arrivata al
+commit la ripetizione non riesegue mai le scritture, anche se il
+processo è morto prima di salvare l'esito. Le richieste che non scrivono
+nulla non registrano la chiave.
+
+Le chiavi sono per utente e scadono dopo IDEMPOTENCY_TTL secondi; un job
+periodico elimina quelle scadute a blocchi.
+"""
+import functools
+import secrets
+import time
+import zlib
+
+from flask import Response, current_app, flash, g, make_response, redirect, request, url_for
+
+from app.db import SAFE_METHODS, get_connection, get_write_db
+from app.group_commit import GroupCommitTimeout
+from app.maintenance import data_paths
+from app.repositories.idempotency_repository import IdempotencyConflict, IdempotencyRepository
+
+# Lunghezza massima accettata per una chiave (UUID, token casuali, ...)
+MAX_KEY_LENGTH = 64
+
+
+def new_key():
+    """
+    Chiave casuale per i campi nascosti dei form (globale Jinja).
+    """
+    return secrets.token_urlsafe(16)
+
+
+def _replay(row, request_line):
+    """
+    Risposta per una chiave già registrata: l'esito salvato, 409 se la
+    prima richiesta sta ancora completando la risposta oppure, se l'esito
+    non è mai stato salvato (processo terminato dopo il commit), un
+    rinvio alla dashboard senza rieseguire le scritture.
+    """
+    if row['request'] != request_line:
+        return make_response('Idempotency-Key già usata per un\'altra richiesta.', 422)
+
+    if row['status'] is None:
+        pending_timeout = current_app.config['IDEMPOTENCY_PENDING_TIMEOUT']
+        if row['created_at'] >= time.time() - pending_timeout:
+            response = make_response('Richiesta con la stessa chiave ancora in corso.', 409)
+            response.headers['Retry-After'] = '1'
+            return response
+        flash('Richiesta già eseguita: il nuovo invio è stato ignorato.', 'info')
+        response = redirect(url_for('main.dashboard'))
+    else:
+        body = zlib.decompress(row['body']) if row['body'] else b''
+        response = Response(body, status=row['status'], content_type=row['content_type'])
+        if row['location']:
+            response.headers['Location'] = row['location']
+            flash('Richiesta già eseguita: il nuovo invio è stato ignorato.', 'info')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """
+    Decoratore per le route di scrittura, da applicare dopo
+    login_required: le richieste non sicure con una chiave vengono
+    eseguite una sola volta per utente e chiave.
+    """
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+        user = g.get('user')
+        if request.method in SAFE_METHODS or not key or user is None:
+            return view(**kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return make_response('Idempotency-Key troppo lunga.', 400)
+
+        ttl = current_app.config['IDEMPOTENCY_TTL']
+        request_line = f'{request.method} {request.path}'
+        row = IdempotencyRepository.get(user.id, key, ttl)
+        if row is not None:
+            return _replay(row, request_line)
+
+        claimed = False
+
+        def claim(db):
+            nonlocal claimed
+            db.before_commit = None
+            IdempotencyRepository.claim(db, user.id, key, request_line, ttl)
+            claimed = True
+
+        db = get_write_db()
+        db.before_commit = claim
+        try:
+            response = make_response(view(**kwargs))
+        except IdempotencyConflict:
+            # Un'altra richiesta con la stessa chiave ha scritto per prima
+            return _replay(IdempotencyRepository.get(user.id, key, ttl), request_line)
+        except GroupCommitTimeout as timeout:
+            # Il batch può ancora arrivare al commit con la chiave: l'esito
+            # (rinvio alla dashboard) viene salvato dal writer dopo il batch
+            writer = current_app.extensions['group_commit']
+            path, location = timeout.path, url_for('main.dashboard')
+
+            def save_outcome(future):
+                if future.exception() is None and claimed:
+                    writer.submit(path, functools.partial(
+                        IdempotencyRepository.save_outcome, user_id=user.id, key=key,
+                        status=302, location=location))
+
+            timeout.future.add_done_callback(save_outcome)
+            raise
+        finally:
+            db.before_commit = None
+
+        # Senza scritture la chiave non è registrata; dopo un 5xx resta
+        # senza esito (le scritture già fatte non vengono ripetute)
+        if claimed and response.status_code < 500 and not response.is_streamed:
+            body = None if response.status_code in (301, 302, 303, 307, 308) else response.get_data()
+            IdempotencyRepository.complete(user.id, key, response.status_code,
+                                           location=response.headers.get('Location'),
+                                           content_type=response.content_type, body=body)
+        return response
+    return wrapped_view
+
+
+def _scheduled_cleanup():
+    ttl = current_app.config['IDEMPOTENCY_TTL']
+    batch = current_app.config['IDEMPOTENCY_CLEANUP_BATCH']
+    total = 0
+    for path in data_paths():
+        db = get_connection(path, write=True)
+        while True:
+            deleted = IdempotencyRepository.delete_expired(db, ttl, batch)
+            total += deleted
+            if deleted < batch:
+                break
+    if total:
+        current_app.logger.info('Chiavi di idempotenza scadute eliminate: %d', total)
+
+
+def init_app(app):
+    """
+    Rende disponibile `idempotency_key()` ai template e, se
+    IDEMPOTENCY_CLEANUP_INTERVAL > 0, registra il job che elimina le
+    chiavi scadute.
+    """
+    app.jinja_env.globals['idempotency_key'] = new_key
+
+    if app.config['IDEMPOTENCY_CLEANUP_INTERVAL']:
+        from app.scheduler import get_scheduler
+        get_scheduler(app).add_job('idempotency-cleanup', app.config['IDEMPOTENCY_CLEANUP_INTERVAL'],
+                                   _scheduled_cleanup)
@@ -0,0 +1,225 @@
+"""
+Manutenzione dei file SQLite: ANALYZE, PRAGMA optimize, checkpoint WAL
+e vacuum incrementale.
+
+Ogni operazione che prende il lock di scrittura lo tiene al massimo per
+circa DB_MAINTENANCE_SLICE_MS millisecondi: il vacuum avanza a piccoli
+passi adattando il numero di pagine, ANALYZE è limitato da
+`analysis_limit` e il checkpoint rinuncia se i writer sono occupati.
+"""
+import os
+import time
+
+import click
+from flask import current_app
+
+from app.db import connect
+
+TASKS = ('analyze', 'checkpoint', 'vacuum')
+
+
+def database_paths():
+    """
+    Tutti i file di database dell'applicazione (principale + shard).
+    """
+    paths = [current_app.config['DATABASE']]
+    if current_app.config['DB_SHARDS']:
+        from app.sharding import shard_path
+        paths += [shard_path(index) for index in range(current_app.config['DB_SHARDS'])]
+    return paths
+
+
+def data_paths():
+    """
+    File che contengono i dati degli utenti (categorie, skills, sessioni):
+    gli shard se lo sharding è attivo, altrimenti il database principale.
+    """
+    paths = database_paths()
+    return paths[1:] if current_app.config['DB_SHARDS'] else paths
+
+
+def archive_paths():
+    """
+    File di archivio delle sessioni (app.archive) dei file di dati, con
+    ARCHIVE_ENABLED e solo quelli già creati.
+
+    Returns:
+        dict: {file di dati: file di archivio}
+    """
+    if not current_app.config['ARCHIVE_ENABLED']:
+        return {}
+    from app.archive import archive_path
+    paths = {path: archive_path(path) for path in data_paths()}
+    return {path: archive for path, archive in paths.items() if os.path.exists(archive)}
+
+
+def maintained_paths():
+    """
+    File su cui eseguire la manutenzione: database, shard e archivi.
+    """
+    return database_paths() + list(archive_paths().values())
+
+
+def database_report(db, path):
+    """
+    Dimensioni del file: pagine totali, pagine libere e dimensione del WAL.
+    """
+    wal_path = path + '-wal'
+    return {
+        'page_size': db.execute('PRAGMA page_size').fetchone()[0],
+        'page_count': db.execute('PRAGMA page_count').fetchone()[0],
+        'freelist_count': db.execute('PRAGMA freelist_count').fetchone()[0],
+        'wal_bytes': os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+    }
+
+
+def analyze(db, analysis_limit):
+    """
+    Aggiorna le statistiche del query planner con un campionamento limitato.
+    """
+    db.execute(f'PRAGMA analysis_limit = {int(analysis_limit)}')
+    db.execute('ANALYZE')
+    db.execute('PRAGMA optimize')
+    db.commit()
+
+
+def checkpoint(db):
+    """
+    Checkpoint del WAL con troncamento del file.
+    Se i writer occupano il database oltre il busy_timeout il checkpoint
+    viene rimandato al giro successivo.
+
+    Returns:
+        dict: busy (1 se non completato), pagine nel WAL e pagine copiate
+    """
+    busy, log_pages, checkpointed = db.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+    return {'busy': busy, 'log_pages': log_pages, 'checkpointed': checkpointed}
+
+
+def incremental_vacuum(db, slice_ms, pause_ms=None, keep_going=None):
+    """
+    Restituisce al filesystem le pagine libere a piccoli passi.
+
+    Ogni passo è una transazione separata; il numero di pagine per passo
+    si adatta in modo che ognuno duri al massimo `slice_ms`, e tra un
+    passo e l'altro si attende `pause_ms` per lasciare spazio ai writer.
+    Se `keep_going()` restituisce False il vacuum si interrompe (ad esempio
+    quando riprendono le richieste) e continuerà al giro successivo.
+
+    Returns:
+        int: Pagine liberate (0 se auto_vacuum non è INCREMENTAL)
+    """
+    if db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        return 0
+
+    pause = (slice_ms if pause_ms is None else pause_ms) / 1000
+    pages_per_step = 64
+    freed = 0
+    while True:
+        free_pages = db.execute('PRAGMA freelist_count').fetchone()[0]
+        if free_pages == 0 or (keep_going is not None and not keep_going()):
+            return freed
+
+        step = min(pages_per_step, free_pages)
+        started = time.perf_counter()
+        # executescript esegue il pragma fino in fondo: con execute()
+        # verrebbe liberata una sola pagina per chiamata
+        db.executescript(f'BEGIN IMMEDIATE; PRAGMA incremental_vacuum({step}); COMMIT;')
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        freed += step
+
+        if elapsed_ms > slice_ms:
+            pages_per_step = max(1, pages_per_step // 2)
+        elif elapsed_ms < slice_ms / 2:
+            pages_per_step *= 2
+        time.sleep(pause)
+
+
+def maintain_database(path, tasks=TASKS, full_vacuum=False, keep_going=None):
+    """
+    Esegue le operazioni richieste su un file di database.
+
+    Returns:
+        dict: Report con le dimensioni prima/dopo e l'esito di ogni operazione
+    """
+    config = current_app.config
+    slice_ms = config['DB_MAINTENANCE_SLICE_MS']
+
+    db = connect(path, wal=config['DB_WAL'])
+    try:
+        db.execute(f'PRAGMA busy_timeout = {int(slice_ms)}')
+        report = {'path': path, 'before': database_report(db, path)}
+        started = time.perf_counter()
+
+        if 'analyze' in tasks:
+            analyze(db, config['DB_ANALYSIS_LIMIT'])
+            report['analyze'] = True
+        if 'vacuum' in tasks:
+            if full_vacuum:
+                # VACUUM completo: blocca il database per tutta la durata,
+                # ma converte anche il file ad auto_vacuum incrementale
+                db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                db.execute('VACUUM')
+                report['vacuum'] = 'full'
+            else:
+                report['vacuum'] = incremental_vacuum(db, slice_ms, keep_going=keep_going)
+        if 'checkpoint' in tasks:
+            report['checkpoint'] = checkpoint(db)
+
+        report['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        report['after'] = database_report(db, path)
+    finally:
+        db.close()
+    return report
+
+
+def format_report(report):
+    before, after = report['before'], report['after']
+    lines = [
+        f'{report["path"]} ({report["elapsed_ms"]} ms)',
+        f'  pagine:       {before["page_count"]} -> {after["page_count"]}',
+        f'  pagine libere: {before["freelist_count"]} -> {after["freelist_count"]}',
+        f'  WAL:          {before["wal_bytes"]} -> {after["wal_bytes"]} byte'
+    ]
+    if report.get('checkpoint', {}).get('busy'):
+        lines.append('  checkpoint rimandato: database occupato')
+    return '\n'.join(lines)
+
+
+def _scheduled(tasks):
+    def job():
+        from app.scheduler import get_scheduler
+        is_idle = get_scheduler(current_app).is_idle
+        for path in maintained_paths():
+            report = maintain_database(path, tasks, keep_going=is_idle)
+            current_app.logger.info('Manutenzione %s\n%s', '+'.join(tasks), format_report(report))
+    return job
+
+
+@click.command('db-maintain')
+@click.option('--task', 'tasks', multiple=True, type=click.Choice(TASKS),
+              help='Operazione da eseguire (ripetibile). Default: tutte.')
+@click.option('--full', is_flag=True,
+              help='VACUUM completo (blocca il database) invece di quello incrementale.')
+def db_maintain_command(tasks, full):
+    """
+    Esegue la manutenzione del database (adatto a cron).
+    Uso: flask db-maintain [--task analyze|checkpoint|vacuum] [--full]
+    """
+    for path in maintained_paths():
+        report = maintain_database(path, tasks or TASKS, full_vacuum=full)
+        click.echo(format_report(report))
+
+
+def init_app(app):
+    """
+    Registra il comando CLI e, se DB_MAINTENANCE_ENABLED, i job periodici.
+    """
+    app.cli.add_command(db_maintain_command)
+
+    if app.config['DB_MAINTENANCE_ENABLED']:
+        from app.scheduler import get_scheduler
+        scheduler = get_scheduler(app)
+        scheduler.add_job('db-checkpoint', app.config['DB_CHECKPOINT_INTERVAL'], _scheduled(('checkpoint',)))
+        scheduler.add_job('db-analyze', app.config['DB_ANALYZE_INTERVAL'], _scheduled(('analyze',)))
+        scheduler.add_job('db-vacuum', app.config['DB_VACUUM_INTERVAL'], _scheduled(('vacuum',)))
@@ -0,0 +1,174 @@
+"""
+Memoria allocata per richiesta, misurata con tracemalloc.
+
+Con MEMORY_TRACKING_ENABLED all'inizio di ogni richiesta le tracce di
+tracemalloc vengono azzerate, quindi il picco letto alla fine è la memoria
+Python allocata dalla richiesta. Le statistiche vengono aggregate per
+endpoint: richieste, picco medio e massimo, richieste oltre
+MEMORY_BUDGET_KB. Le richieste oltre il budget finiscono nel log.
+
+Per una frazione MEMORY_SNAPSHOT_RATE delle richieste si prende anche uno
+snapshot dopo il render del template (quando le righe caricate dalla view
+e l'HTML sono ancora in memoria) o, senza template, alla fine della
+richiesta. Contiene solo i blocchi allocati dalla richiesta, quindi costa
+poco; le righe di codice che allocano di più vengono sommate per endpoint.
+
+tracemalloc rallenta tutte le allocazioni: è una modalità da attivare per
+trovare i punti da correggere, non da tenere sempre accesa. Le tracce
+sono del processo: con più richieste contemporanee nello stesso processo
+le misure si sovrappongono (per numeri esatti, un thread per worker).
+Le statistiche sono per processo.
+"""
+import random
+import threading
+import tracemalloc
+from collections import Counter
+
+from flask import current_app, has_request_context, request, template_rendered
+
+from app.profiling import short_path
+
+# Chiave dell'environ WSGI con lo stato della misura della richiesta
+_ENVIRON_KEY = 'skilltracker.memory'
+
+# Richiesta misurata in corso sul thread (le sotto-richieste di
+# /api/v1/batch sono comprese in quella esterna)
+_local = threading.local()
+
+
+class _Measure:
+    __slots__ = ('snapshot', 'sites')
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.sites = None
+
+
+class MemoryStats:
+    """
+    Statistiche di memoria per endpoint, thread-safe.
+    """
+
+    def __init__(self, budget, top_sites=10):
+        self.budget = budget
+        self.top_sites = top_sites
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, peak, sites=None):
+        """
+        Registra il picco (byte) di una richiesta e, se misurate, le righe
+        di codice con più memoria allocata ({etichetta: byte}).
+        """
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = {
+                    'requests': 0, 'total_peak': 0, 'max_peak': 0,
+                    'over_budget': 0, 'snapshots': 0, 'sites': Counter()
+                }
+            stats['requests'] += 1
+            stats['total_peak'] += peak
+            stats['max_peak'] = max(stats['max_peak'], peak)
+            if peak > self.budget:
+                stats['over_budget'] += 1
+            if sites is not None:
+                stats['snapshots'] += 1
+                stats['sites'].update(sites)
+
+    def summary(self):
+        """
+        Returns:
+            list[dict]: Un elemento per endpoint (picchi in byte, siti come
+                        media per richiesta misurata), per picco massimo
+        """
+        with self._lock:
+            rows = [{
+                'endpoint': endpoint,
+                'requests': stats['requests'],
+                'avg_peak': stats['total_peak'] // stats['requests'],
+                'max_peak': stats['max_peak'],
+                'over_budget': stats['over_budget'],
+                'snapshots': stats['snapshots'],
+                'sites': [(label, size // stats['snapshots'])
+                          for label, size in stats['sites'].most_common(self.top_sites)],
+            } for endpoint, stats in self._endpoints.items()]
+        return sorted(rows, key=lambda row: row['max_peak'], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+def top_sites(limit):
+    """
+    Righe di codice con più memoria ancora allocata tra i blocchi tracciati
+    (quelli allocati dopo l'ultimo azzeramento delle tracce).
+
+    Returns:
+        dict: {"file:riga": byte}
+    """
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ))
+    sites = {}
+    for statistic in snapshot.statistics('lineno')[:limit]:
+        frame = statistic.traceback[0]
+        sites[f'{short_path(frame.filename)}:{frame.lineno}'] = statistic.size
+    return sites
+
+
+def get_memory_stats(app):
+    return app.extensions.get('memory')
+
+
+def init_app(app):
+    """
+    Se MEMORY_TRACKING_ENABLED è attivo avvia tracemalloc e registra gli
+    hook che misurano ogni richiesta.
+    """
+    if not app.config['MEMORY_TRACKING_ENABLED']:
+        return
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(app.config['MEMORY_TRACEBACK_FRAMES'])
+    stats = MemoryStats(budget=app.config['MEMORY_BUDGET_KB'] * 1024,
+                        top_sites=app.config['MEMORY_TOP_SITES'])
+    app.extensions['memory'] = stats
+    snapshot_rate = app.config['MEMORY_SNAPSHOT_RATE']
+
+    @app.before_request
+    def start_memory_measure():
+        if request.endpoint in (None, 'static') or getattr(_local, 'active', False):
+            return
+        _local.active = True
+        tracemalloc.clear_traces()
+        request.environ[_ENVIRON_KEY] = _Measure(random.random() < snapshot_rate)
+
+    def snapshot_after_render(sender, template, context, **extra):
+        measure = request.environ.get(_ENVIRON_KEY) if has_request_context() else None
+        if measure is not None and measure.snapshot and measure.sites is None:
+            measure.sites = top_sites(stats.top_sites)
+
+    template_rendered.connect(snapshot_after_render, app)
+
+    @app.teardown_request
+    def finish_memory_measure(exc=None):
+        measure = request.environ.pop(_ENVIRON_KEY, None)
+        if measure is None:
+            return
+        _local.active = False
+        peak = tracemalloc.get_traced_memory()[1]
+        if measure.snapshot and measure.sites is None:
+            measure.sites = top_sites(stats.top_sites)
+        stats.record(request.endpoint, peak, measure.sites)
+
+        if peak > stats.budget:
+            sites = ''
+            if measure.sites:
+                sites = '; righe: ' + ', '.join(f'{label} {size // 1024} KiB'
+                                                for label, size in measure.sites.items())
+            current_app.logger.warning('Memoria oltre il budget: %s %s ha allocato %d KiB (budget %d KiB)%s',
+                                       request.method, request.full_path.rstrip('?'), peak // 1024,
+                                       stats.budget // 1024, sites)
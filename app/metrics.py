@@ -0,0 +1,400 @@
+"""
+Metriche in formato Prometheus (endpoint /metrics).
+
+Con METRICS_ENABLED ogni processo conta in memoria:
+- richieste per endpoint, metodo e stato e istogramma delle durate per
+  endpoint, richieste in corso;
+- query SQLite eseguite e tempo speso (connessioni aperte con
+  app.db.connect), connessioni aperte, errori SQLITE_BUSY e tentativi
+  ripetuti per database bloccato;
+- successi e mancati successi delle cache (statistiche, previsioni,
+  repository);
+- con `flask serve`, thread del worker e connessioni in coda.
+
+I valori di ogni processo vengono scritti in METRICS_DIR
+(`<pid>.json`, scrittura atomica) al massimo ogni METRICS_FLUSH_INTERVAL
+secondi, alla fine di una richiesta o dal job in background se il
+processo è inattivo. /metrics somma i file di tutti i processi: i
+contatori dei worker terminati restano nel totale, i gauge contano solo
+i processi vivi. Il master di `flask serve` svuota la cartella all'avvio.
+"""
+import json
+import os
+import secrets
+import threading
+import time
+from collections import Counter
+
+from flask import Response, abort, current_app, request
+
+from app.db import Connection, is_busy_error
+from app.group_commit import Histogram
+
+# Bucket (secondi) dell'istogramma delle durate delle richieste
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Cache in app.extensions di cui esportare successi e mancati successi
+_CACHES = ('analytics', 'forecast', 'repository_cache')
+
+# Famiglie esportate: nome, tipo, descrizione
+FAMILIES = (
+    ('skilltracker_http_requests_total', 'counter', 'Richieste HTTP per endpoint, metodo e stato.'),
+    ('skilltracker_http_request_duration_seconds', 'histogram', 'Durata delle richieste HTTP per endpoint.'),
+    ('skilltracker_http_requests_in_progress', 'gauge', 'Richieste in corso (thread occupati).'),
+    ('skilltracker_db_queries_total', 'counter', 'Query SQLite eseguite, per modalità della connessione.'),
+    ('skilltracker_db_query_seconds_total', 'counter', 'Tempo speso nelle query SQLite.'),
+    ('skilltracker_db_busy_errors_total', 'counter', 'Query fallite con SQLITE_BUSY (database bloccato).'),
+    ('skilltracker_db_busy_retries_total', 'counter', 'BEGIN IMMEDIATE o COMMIT ripetuti per database bloccato.'),
+    ('skilltracker_db_connections_opened_total', 'counter', 'Connessioni SQLite aperte.'),
+    ('skilltracker_db_connections_open', 'gauge', 'Connessioni SQLite aperte in questo momento.'),
+    ('skilltracker_cache_hits_total', 'counter', 'Letture dalle cache andate a buon fine.'),
+    ('skilltracker_cache_misses_total', 'counter', 'Letture dalle cache senza risultato.'),
+    ('skilltracker_cache_entries', 'gauge', 'Elementi nelle cache.'),
+    ('skilltracker_worker_threads', 'gauge', 'Thread che servono le richieste (flask serve).'),
+    ('skilltracker_worker_queue_depth', 'gauge', 'Connessioni accettate in attesa di un thread (flask serve).'),
+    ('skilltracker_worker_streams', 'gauge', 'Stream /events aperti su thread dedicati (flask serve).'),
+    ('skilltracker_processes', 'gauge', 'Processi vivi che hanno scritto metriche.'),
+)
+_HISTOGRAMS = frozenset(name for name, kind, _ in FAMILIES if kind == 'histogram')
+
+# Chiavi dell'environ WSGI con inizio e stato della richiesta misurata
+_ENVIRON_KEY = 'skilltracker.metrics'
+_STATUS_KEY = 'skilltracker.metrics_status'
+
+# Richiesta misurata in corso sul thread (le sotto-richieste di
+# /api/v1/batch sono comprese in quella esterna)
+_local = threading.local()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def sample_name(name, **labels):
+    """
+    Nome di un campione nel formato di esposizione: `nome{etichetta="valore"}`.
+    """
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _format_bound(bound):
+    return bound if isinstance(bound, str) else f'{bound:g}'
+
+
+class InstrumentedConnection(Connection):
+    """
+    Connessione SQLite che conta query, tempo speso, errori SQLITE_BUSY e
+    tentativi ripetuti nel registro `metrics` (assegnato da app.db.connect).
+    """
+
+    metrics = None
+    mode = 'rw'
+
+    def _timed(self, method, *args):
+        metrics = self.metrics
+        if metrics is None:
+            return method(*args)
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        except Exception as e:
+            if is_busy_error(e):
+                metrics.count_busy()
+            raise
+        finally:
+            metrics.observe_query(self.mode, time.perf_counter() - started)
+
+    def _busy_retry(self):
+        if self.metrics is not None:
+            self.metrics.count_busy_retry()
+
+    def execute(self, *args):
+        return self._timed(super().execute, *args)
+
+    def executemany(self, *args):
+        return self._timed(super().executemany, *args)
+
+    def executescript(self, *args):
+        return self._timed(super().executescript, *args)
+
+    def close(self):
+        metrics, self.metrics = self.metrics, None
+        super().close()
+        if metrics is not None:
+            metrics.connection_closed()
+
+
+class MetricsRegistry:
+    """
+    Contatori e istogrammi del processo, thread-safe.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.directory = app.config['METRICS_DIR']
+        self.flush_interval = app.config['METRICS_FLUSH_INTERVAL']
+        self.requests = Counter()   # (endpoint, metodo, stato) -> richieste
+        self.latency = {}           # endpoint -> Histogram
+        self.queries = Counter()    # modalità -> query
+        self.query_seconds = 0.0
+        self.busy_errors = 0
+        self.busy_retries = 0
+        self.connections_opened = 0
+        self.connections_open = 0
+        self.in_progress = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    # ------------------------------------------------------------------
+    # Registrazione
+    # ------------------------------------------------------------------
+
+    def request_started(self):
+        with self._lock:
+            self.in_progress += 1
+
+    def request_finished(self, endpoint, method, status, seconds):
+        with self._lock:
+            self.in_progress -= 1
+            self.requests[(endpoint, method, status)] += 1
+            histogram = self.latency.get(endpoint)
+            if histogram is None:
+                histogram = self.latency[endpoint] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(seconds)
+
+    def observe_query(self, mode, seconds):
+        with self._lock:
+            self.queries[mode] += 1
+            self.query_seconds += seconds
+
+    def count_busy(self):
+        with self._lock:
+            self.busy_errors += 1
+
+    def count_busy_retry(self):
+        with self._lock:
+            self.busy_retries += 1
+
+    def connection_opened(self, db, read_only):
+        """
+        Collega una InstrumentedConnection appena aperta al registro.
+        """
+        db.metrics = self
+        db.mode = 'ro' if read_only else 'rw'
+        with self._lock:
+            self.connections_opened += 1
+            self.connections_open += 1
+
+    def connection_closed(self):
+        with self._lock:
+            self.connections_open -= 1
+
+    # ------------------------------------------------------------------
+    # Raccolta e scrittura
+    # ------------------------------------------------------------------
+
+    def collect(self):
+        """
+        Valori correnti del processo.
+
+        Returns:
+            dict: counters e gauges, ognuno {campione: valore}
+        """
+        counters, gauges = {}, {}
+        with self._lock:
+            requests = sorted(self.requests.items())
+            latency = sorted(self.latency.items())
+            for mode, count in sorted(self.queries.items()):
+                counters[sample_name('skilltracker_db_queries_total', mode=mode)] = count
+            counters['skilltracker_db_query_seconds_total'] = self.query_seconds
+            counters['skilltracker_db_busy_errors_total'] = self.busy_errors
+            counters['skilltracker_db_busy_retries_total'] = self.busy_retries
+            counters['skilltracker_db_connections_opened_total'] = self.connections_opened
+            gauges['skilltracker_db_connections_open'] = self.connections_open
+            gauges['skilltracker_http_requests_in_progress'] = self.in_progress
+
+        for (endpoint, method, status), count in requests:
+            counters[sample_name('skilltracker_http_requests_total',
+                                 endpoint=endpoint, method=method, status=status)] = count
+        for endpoint, histogram in latency:
+            snapshot = histogram.snapshot()
+            for bound, count in snapshot['buckets'].items():
+                counters[sample_name('skilltracker_http_request_duration_seconds_bucket',
+                                     endpoint=endpoint, le=_format_bound(bound))] = count
+            counters[sample_name('skilltracker_http_request_duration_seconds_sum', endpoint=endpoint)] = snapshot['sum']
+            counters[sample_name('skilltracker_http_request_duration_seconds_count', endpoint=endpoint)] = snapshot['count']
+
+        for name in _CACHES:
+            cache = self.app.extensions.get(name)
+            if cache is not None:
+                stats = cache.stats()
+                counters[sample_name('skilltracker_cache_hits_total', cache=name)] = stats['hits']
+                counters[sample_name('skilltracker_cache_misses_total', cache=name)] = stats['misses']
+                gauges[sample_name('skilltracker_cache_entries', cache=name)] = stats['entries']
+
+        server = self.app.extensions.get('serve')
+        if server is not None:
+            stats = server.stats()
+            gauges['skilltracker_worker_threads'] = stats['threads']
+            gauges['skilltracker_worker_queue_depth'] = stats['queued']
+            gauges['skilltracker_worker_streams'] = stats['streams']
+        return {'counters': counters, 'gauges': gauges}
+
+    def flush(self):
+        """
+        Scrive i valori del processo in METRICS_DIR/<pid>.json.
+        """
+        with self._flush_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f'{os.getpid()}.json')
+            temporary = f'{path}.tmp'
+            with open(temporary, 'w', encoding='utf-8') as f:
+                json.dump(self.collect(), f)
+            os.replace(temporary, path)
+            self._last_flush = time.monotonic()
+
+    def maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+
+def _is_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def load_metrics(directory):
+    """
+    Somma i file di tutti i processi: contatori di tutti, gauge dei soli
+    processi vivi.
+
+    Returns:
+        dict: {campione: valore}, nell'ordine in cui compaiono
+    """
+    samples = {}
+    processes = 0
+    names = os.listdir(directory) if os.path.isdir(directory) else []
+    for name in sorted(names):
+        pid, _, extension = name.partition('.')
+        if extension != 'json' or not pid.isdigit():
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                values = json.load(f)
+        except (FileNotFoundError, ValueError):
+            continue
+        groups = [values['counters']]
+        if _is_alive(int(pid)):
+            processes += 1
+            groups.append(values['gauges'])
+        for group in groups:
+            for sample, value in group.items():
+                samples[sample] = samples.get(sample, 0) + value
+    samples['skilltracker_processes'] = processes
+    return samples
+
+
+def render_metrics(samples):
+    """
+    Testo nel formato di esposizione di Prometheus (version 0.0.4).
+    """
+    families = {}
+    for sample, value in samples.items():
+        name = sample.split('{', 1)[0]
+        for suffix in ('_bucket', '_sum', '_count'):
+            if name.endswith(suffix) and name[:-len(suffix)] in _HISTOGRAMS:
+                name = name[:-len(suffix)]
+                break
+        families.setdefault(name, []).append(f'{sample} {value}')
+
+    lines = []
+    for name, kind, description in FAMILIES:
+        if name in families:
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(families[name])
+    return '\n'.join(lines) + '\n'
+
+
+def clear_metrics(directory):
+    """
+    Elimina i file dei processi (all'avvio del master di flask serve).
+    """
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.endswith(('.json', '.tmp')):
+                os.remove(os.path.join(directory, name))
+
+
+def get_metrics(app):
+    return app.extensions.get('metrics')
+
+
+def metrics_view():
+    """
+    Metriche di tutti i processi in formato Prometheus. Con METRICS_TOKEN
+    serve l'header `Authorization: Bearer <token>`.
+    """
+    token = current_app.config['METRICS_TOKEN']
+    if token and not secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(401)
+    registry = get_metrics(current_app)
+    registry.flush()
+    return Response(render_metrics(load_metrics(registry.directory)),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _scheduled_flush():
+    get_metrics(current_app).flush()
+
+
+def init_app(app):
+    """
+    Se METRICS_ENABLED è attivo crea il registro del processo, gli hook
+    che misurano le richieste, l'endpoint /metrics e il job che scrive
+    i valori quando il processo è inattivo.
+    """
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    registry = MetricsRegistry(app)
+    app.extensions['metrics'] = registry
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+    @app.before_request
+    def start_request_metrics():
+        if getattr(_local, 'active', False):
+            return
+        _local.active = True
+        request.environ[_ENVIRON_KEY] = time.perf_counter()
+        registry.request_started()
+
+    @app.after_request
+    def record_status(response):
+        request.environ[_STATUS_KEY] = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc=None):
+        started = request.environ.pop(_ENVIRON_KEY, None)
+        if started is None:
+            return
+        _local.active = False
+        status = request.environ.get(_STATUS_KEY, 500)
+        registry.request_finished(request.endpoint or 'unmatched', request.method, status,
+                                  time.perf_counter() - started)
+        registry.maybe_flush()
+
+    from app.scheduler import get_scheduler
+    get_scheduler(app).add_job('metrics-flush', app.config['METRICS_FLUSH_INTERVAL'], _scheduled_flush,
+                               per_process=True)
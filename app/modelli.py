@@ -1,4 +1,73 @@
-from datetime import datetime, date
+import math
+from datetime import datetime, date, timedelta
+from functools import cached_property
+
+
+def xp_to_reach_level(level):
+    """
+    Calcola gli XP totali necessari per raggiungere un livello.
+
+    Formula chiusa della somma 100 + 200 + ... + (level - 1) * 100.
+
+    Esempio:
+        level = 4
+        -> ritorna 600 (100 + 200 + 300)
+    """
+    return 50 * level * (level - 1)
+
+
+def level_for_xp(total_xp):
+    """
+    Calcola il livello corrispondente a un totale di XP (minimo 1).
+
+    Inversa di xp_to_reach_level: il più grande L con
+    50 * L * (L - 1) <= total_xp, cioè L = (5 + sqrt(25 + 2 * xp)) / 10.
+
+    Esempio:
+        total_xp = 650
+        -> ritorna 4 (600 <= 650 < 1000)
+    """
+    if total_xp <= 0:
+        return 1
+    level = (5 + math.isqrt(25 + 2 * total_xp)) // 10
+    # Correzione dell'arrotondamento della radice intera
+    while xp_to_reach_level(level + 1) <= total_xp:
+        level += 1
+    while level > 1 and xp_to_reach_level(level) > total_xp:
+        level -= 1
+    return max(1, level)
+
+
+# Date ammesse per una sessione: dal 1900 a un anno da oggi
+MIN_SESSION_DATE = date(1900, 1, 1)
+MAX_SESSION_DAYS_AHEAD = 366
+
+
+def normalize_session_date(value):
+    """
+    Normalizza la data di una sessione nel formato YYYY-MM-DD salvato nel
+    database (accetta anche mese e giorno senza zero iniziale).
+
+    Esempio:
+        value = '2026-1-5'
+        -> ritorna '2026-01-05'
+
+    Returns:
+        str o None: None se la data non è valida o è fuori dall'intervallo ammesso
+    """
+    if isinstance(value, date):
+        parsed = value
+    else:
+        try:
+            parsed = datetime.strptime(str(value).strip(), '%Y-%m-%d').date()
+        except ValueError:
+            return None
+    if isinstance(parsed, datetime):
+        parsed = parsed.date()
+    if not MIN_SESSION_DATE <= parsed <= date.today() + timedelta(days=MAX_SESSION_DAYS_AHEAD):
+        return None
+    return parsed.isoformat()
+
 
 class User:
     """
@@ -78,6 +147,52 @@ class Skill:
             return False
         return self.id == other.id
     
+    # ========================================================================
+    # CAMPI DERIVATI (calcolati una sola volta per istanza)
+    # ========================================================================
+    #
+    # I template accedono a questi valori più volte per ogni skill; con
+    # cached_property il calcolo avviene al primo accesso e il risultato
+    # resta nel __dict__ dell'oggetto. Gli oggetti vivono per una sola
+    # richiesta, quindi non serve invalidarli.
+
+    @cached_property
+    def progress_percentage(self):
+        """
+        Percentuale di progresso verso l'obiettivo finale (tra 0 e 100).
+        """
+        if self.target_level == 0:
+            return 0
+        return min(100, (self.current_level / self.target_level) * 100)
+
+    @cached_property
+    def xp_for_next_level(self):
+        """
+        XP totali richiesti dal livello attuale per passare al successivo.
+        """
+        return self.current_level * 100
+
+    @cached_property
+    def current_level_xp(self):
+        """
+        XP accumulati nel livello attuale.
+        """
+        return self.total_xp - xp_to_reach_level(self.current_level)
+
+    @cached_property
+    def xp_needed_for_next_level(self):
+        """
+        XP mancanti per raggiungere il prossimo livello.
+        """
+        return max(0, self.xp_for_next_level - self.current_level_xp)
+
+    @cached_property
+    def xp_to_target(self):
+        """
+        XP mancanti per raggiungere il livello obiettivo.
+        """
+        return max(0, xp_to_reach_level(self.target_level) - self.total_xp)
+
     # ========================================================================
     # METODI DI BUSINESS LOGIC
     # ========================================================================
@@ -94,9 +209,7 @@ class Skill:
             skill.target_level = 10
             -> ritorna 70.0
         """
-        if self.target_level == 0:
-            return 0
-        return min(100, (self.current_level / self.target_level) * 100)
+        return self.progress_percentage
     
     def get_xp_for_next_level(self):
         """
@@ -111,7 +224,7 @@ class Skill:
             skill.current_level = 3
             -> ritorna 300 (servono 300 XP per passare da livello 3 a 4)
         """
-        return self.current_level * 100
+        return self.xp_for_next_level
     
     def get_current_level_xp(self):
         """
@@ -134,11 +247,7 @@ class Skill:
             
             XP nel livello attuale: 450 - 300 = 150 XP
         """
-        # Calcola la somma degli XP usati per i livelli precedenti
-        xp_used_for_previous_levels = sum(i * 100 for i in range(1, self.current_level))
-        
-        # XP rimanenti nel livello attuale
-        return self.total_xp - xp_used_for_previous_levels
+        return self.current_level_xp
     
     def get_xp_needed_for_next_level(self):
         """
@@ -152,9 +261,7 @@ class Skill:
             current_level_xp = 150
             -> ritorna 150 (mancano 150 XP)
         """
-        xp_for_next = self.get_xp_for_next_level()
-        current_xp = self.get_current_level_xp()
-        return max(0, xp_for_next - current_xp)
+        return self.xp_needed_for_next_level
     
     def is_complete(self):
         """
@@ -178,7 +285,8 @@ class Session:
     """
     
     def __init__(self, id, skill_id, date, duration_minutes, xp_gained, 
-                 notes, user_id, created_at, skill_name=None):
+                 notes, user_id, created_at, skill_name=None, archived=False,
+                 cumulative_xp=None, level_after=None):
         self.id = id
         self.skill_id = skill_id
         self.date = date
@@ -188,6 +296,9 @@ class Session:
         self.user_id = user_id
         self.created_at = created_at
         self.skill_name = skill_name  # Campo aggiunto dai JOIN
+        self.archived = archived  # True se proviene dall'archivio
+        self.cumulative_xp = cumulative_xp  # XP della skill dopo questa sessione
+        self.level_after = level_after  # Livello della skill dopo questa sessione
     
     def __repr__(self):
         return (f"Session(id={self.id}, skill_id={self.skill_id}, "
@@ -218,12 +329,10 @@ class Session:
         """
         return self.duration_minutes / 60
     
-    def format_duration(self):
+    @cached_property
+    def duration_formatted(self):
         """
-        Formatta la durata in modo leggibile.
-        
-        Returns:
-            str: Durata formattata (es: "1h 30m", "45m")
+        Durata formattata in modo leggibile, calcolata una sola volta.
         """
         hours = self.duration_minutes // 60
         minutes = self.duration_minutes % 60
@@ -235,6 +344,15 @@ class Session:
         else:
             return f"{minutes}m"
     
+    def format_duration(self):
+        """
+        Formatta la durata in modo leggibile.
+        
+        Returns:
+            str: Durata formattata (es: "1h 30m", "45m")
+        """
+        return self.duration_formatted
+    
     def has_notes(self):
         """
         Verifica se la sessione ha delle note.
@@ -315,7 +433,10 @@ def create_session_from_row(row):
         notes=row['notes'],
         user_id=row['user_id'],
         created_at=row['created_at'],
-        skill_name=row['skill_name'] if 'skill_name' in keys else None
+        skill_name=row['skill_name'] if 'skill_name' in keys else None,
+        archived=bool(row['archived']) if 'archived' in keys else False,
+        cumulative_xp=row['cumulative_xp'] if 'cumulative_xp' in keys else None,
+        level_after=row['level_after'] if 'level_after' in keys else None
     )
 
 
@@ -0,0 +1,378 @@
+"""
+Profiler a campionamento delle richieste, aggregato per endpoint.
+
+Con PROFILING_ENABLED una frazione PROFILING_SAMPLE_RATE delle richieste
+(più quelle con l'header PROFILING_HEADER uguale a PROFILING_TOKEN) viene
+profilata: un thread del processo legge ogni PROFILING_INTERVAL_MS lo
+stack Python dei thread che stanno servendo quelle richieste e conta gli
+stack per endpoint. Il costo per la richiesta profilata è solo la lettura
+periodica dello stack, quelle non profilate pagano un numero casuale.
+
+I conteggi vengono scritti in PROFILING_DIR, un file per endpoint e per
+processo:
+- `<endpoint>.<pid>.folded`: stack collassati (una riga `a;b;c N`), da
+  usare con flamegraph.pl o speedscope;
+- `<endpoint>.<pid>.pstats`: gli stessi campioni in formato pstats
+  (tempo proprio e cumulato stimati dai campioni), leggibile con
+  `pstats.Stats` o snakeviz.
+La pagina /admin/profiles mostra le funzioni più calde per endpoint.
+"""
+import json
+import marshal
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+
+import click
+from flask import current_app, request
+
+# Chiave dell'environ WSGI: la richiesta (non le sotto-richieste di
+# /api/v1/batch, che girano sullo stesso thread) è profilata
+_ENVIRON_KEY = 'skilltracker.profiled'
+
+_APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def short_path(filename):
+    """
+    Percorso breve di un file sorgente: relativo al progetto, altrimenti
+    le ultime due parti (package/modulo.py).
+    """
+    if filename.startswith(_APP_ROOT + os.sep):
+        return os.path.relpath(filename, _APP_ROOT)
+    parts = filename.replace('\\', '/').split('/')
+    return '/'.join(parts[-2:])
+
+
+def frame_label(key):
+    """
+    Etichetta di una funzione negli stack collassati: `nome (file:riga)`.
+    """
+    filename, line, name = key
+    return f'{name} ({short_path(filename)}:{line})'
+
+
+class StackSampler:
+    """
+    Thread che campiona lo stack dei thread registrati (richieste profilate)
+    e conta gli stack, dalla radice alla funzione in esecuzione, per
+    endpoint. Parte al primo uso in ogni processo (anche dopo il fork).
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = {}    # endpoint -> Counter({(frame_key, ...): campioni})
+        self.requests = Counter()
+        self._active = {}   # thread id -> endpoint
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+                self._thread.start()
+
+    def start(self, endpoint):
+        """
+        Inizia a campionare il thread corrente per `endpoint`.
+        """
+        self._ensure_started()
+        with self._lock:
+            self._active[threading.get_ident()] = endpoint
+            self.requests[endpoint] += 1
+        self._wake.set()
+
+    def is_sampling(self):
+        """
+        True se il thread corrente è già campionato (richiesta annidata).
+        """
+        return threading.get_ident() in self._active
+
+    def stop(self):
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+
+    def sample(self):
+        """
+        Un campione di tutti i thread registrati.
+        """
+        with self._lock:
+            active = list(self._active.items())
+        if not active:
+            return
+        frames = sys._current_frames()
+        for thread_id, endpoint in active:
+            frame = frames.get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            if stack:
+                with self._lock:
+                    self.stacks.setdefault(endpoint, Counter())[tuple(reversed(stack))] += 1
+
+    def _run(self):
+        while True:
+            if not self._active:
+                self._wake.wait()
+                self._wake.clear()
+            time.sleep(self.interval)
+            self.sample()
+
+    def take(self):
+        """
+        Conteggi raccolti dall'ultima chiamata, poi azzerati.
+
+        Returns:
+            tuple: ({endpoint: Counter degli stack}, Counter delle richieste)
+        """
+        with self._lock:
+            stacks, requests = self.stacks, self.requests
+            self.stacks, self.requests = {}, Counter()
+        return stacks, requests
+
+
+def to_folded(stacks):
+    """
+    Stack collassati (formato di flamegraph.pl) da {(etichetta, ...): campioni},
+    ordinati per campioni.
+    """
+    lines = [f'{";".join(stack)} {count}' for stack, count in stacks.most_common()]
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def to_pstats(stacks, interval):
+    """
+    Dizionario nel formato di pstats (quello salvato da cProfile) stimato
+    dai campioni: tempo proprio = campioni in cima allo stack, tempo
+    cumulato = campioni in cui la funzione compare, chiamate = campioni.
+    """
+    stats = {}
+
+    def entry(key):
+        if key not in stats:
+            stats[key] = [0, 0, 0.0, 0.0, {}]
+        return stats[key]
+
+    for stack, count in stacks.items():
+        seconds = count * interval
+        entry(stack[-1])[2] += seconds
+        seen = set()
+        last = len(stack) - 1
+        for depth, key in enumerate(stack):
+            if key in seen:
+                continue
+            seen.add(key)
+            row = entry(key)
+            row[0] += count
+            row[1] += count
+            row[3] += seconds
+            if depth:
+                caller = stack[depth - 1]
+                calls, primitive, own, cumulative = row[4].get(caller, (0, 0, 0.0, 0.0))
+                row[4][caller] = (calls + count, primitive + count,
+                                  own + (seconds if depth == last else 0.0), cumulative + seconds)
+    return {key: (row[0], row[1], row[2], row[3], row[4]) for key, row in stats.items()}
+
+
+def merge_pstats(stats, other):
+    """
+    Somma due dizionari in formato pstats (in `stats`).
+    """
+    for key, (calls, primitive, own, cumulative, callers) in other.items():
+        if key not in stats:
+            stats[key] = (calls, primitive, own, cumulative, dict(callers))
+            continue
+        old_calls, old_primitive, old_own, old_cumulative, old_callers = stats[key]
+        merged = dict(old_callers)
+        for caller, values in callers.items():
+            merged[caller] = tuple(a + b for a, b in zip(merged.get(caller, (0, 0, 0.0, 0.0)), values))
+        stats[key] = (old_calls + calls, old_primitive + primitive, old_own + own,
+                      old_cumulative + cumulative, merged)
+    return stats
+
+
+def parse_folded(text):
+    """
+    Returns:
+        Counter: {(etichetta, ...): campioni}
+    """
+    stacks = Counter()
+    for line in text.splitlines():
+        stack, _, count = line.rpartition(' ')
+        if stack and count.isdigit():
+            stacks[tuple(stack.split(';'))] += int(count)
+    return stacks
+
+
+def hottest_functions(stacks, limit=25):
+    """
+    Funzioni con più campioni: propri (in esecuzione) e cumulati (nello stack).
+
+    Returns:
+        list[dict]: label, self, total, ordinate per campioni propri
+    """
+    own, total = Counter(), Counter()
+    for stack, count in stacks.items():
+        own[stack[-1]] += count
+        for label in set(stack):
+            total[label] += count
+    return [{'label': label, 'self': own[label], 'total': total[label]}
+            for label, _ in own.most_common(limit)]
+
+
+def get_sampler(app):
+    return app.extensions.get('profiling')
+
+
+def _read(path, load, default):
+    try:
+        with open(path, 'rb') as f:
+            return load(f)
+    except FileNotFoundError:
+        return default
+
+
+def flush_profiles(app):
+    """
+    Aggiunge ai file di questo processo in PROFILING_DIR i campioni raccolti
+    dall'ultima scrittura, che vengono poi azzerati in memoria.
+
+    Returns:
+        int: Endpoint aggiornati
+    """
+    sampler = get_sampler(app)
+    if sampler is None:
+        return 0
+    stacks, requests = sampler.take()
+    if not requests:
+        return 0
+    directory = app.config['PROFILING_DIR']
+    os.makedirs(directory, exist_ok=True)
+    pid = os.getpid()
+
+    for endpoint, counter in stacks.items():
+        base = os.path.join(directory, f'{endpoint}.{pid}')
+        folded = _read(base + '.folded', lambda f: parse_folded(f.read().decode('utf-8')), Counter())
+        folded.update({tuple(frame_label(key) for key in stack): count for stack, count in counter.items()})
+        with open(base + '.folded', 'w', encoding='utf-8') as f:
+            f.write(to_folded(folded))
+
+        stats = _read(base + '.pstats', marshal.load, {})
+        with open(base + '.pstats', 'wb') as f:
+            marshal.dump(merge_pstats(stats, to_pstats(counter, sampler.interval)), f)
+
+    path = os.path.join(directory, f'requests.{pid}.json')
+    total = Counter(_read(path, json.load, {}))
+    total.update(requests)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(total, f)
+    return len(stacks)
+
+
+def load_profiles(directory):
+    """
+    Somma i file di tutti i processi.
+
+    Returns:
+        tuple: ({endpoint: Counter di stack etichettati}, Counter delle richieste profilate)
+    """
+    stacks, requests = {}, Counter()
+    if not os.path.isdir(directory):
+        return stacks, requests
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.endswith('.folded'):
+            endpoint = name[:-len('.folded')].rsplit('.', 1)[0]
+            with open(path, encoding='utf-8') as f:
+                stacks.setdefault(endpoint, Counter()).update(parse_folded(f.read()))
+        elif name.startswith('requests.') and name.endswith('.json'):
+            with open(path, encoding='utf-8') as f:
+                requests.update(json.load(f))
+    return stacks, requests
+
+
+def merged_pstats(directory, endpoint):
+    """
+    File pstats di tutti i processi per l'endpoint, uniti (bytes marshal).
+    """
+    if not os.path.isdir(directory):
+        return None
+    stats = {}
+    for name in os.listdir(directory):
+        if name.endswith('.pstats') and name[:-len('.pstats')].rsplit('.', 1)[0] == endpoint:
+            merge_pstats(stats, _read(os.path.join(directory, name), marshal.load, {}))
+    return marshal.dumps(stats) if stats else None
+
+
+def clear_profiles(app):
+    """
+    Elimina i file e i campioni non ancora scritti di questo processo.
+    """
+    sampler = get_sampler(app)
+    if sampler is not None:
+        sampler.take()
+    directory = app.config['PROFILING_DIR']
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.endswith(('.folded', '.pstats', '.json')):
+                os.remove(os.path.join(directory, name))
+
+
+def _scheduled_flush():
+    flush_profiles(current_app)
+
+
+@click.command('profiles-clear')
+def profiles_clear_command():
+    """
+    Elimina i profili salvati in PROFILING_DIR.
+    Uso: flask profiles-clear
+    """
+    clear_profiles(current_app)
+    click.echo('Profili eliminati.')
+
+
+def init_app(app):
+    """
+    Registra il comando CLI e, se PROFILING_ENABLED è attivo, gli hook che
+    scelgono le richieste da profilare e il job che scrive i file.
+    """
+    app.cli.add_command(profiles_clear_command)
+    if not app.config['PROFILING_ENABLED']:
+        return
+
+    sampler = StackSampler(interval=app.config['PROFILING_INTERVAL_MS'] / 1000)
+    app.extensions['profiling'] = sampler
+    rate = app.config['PROFILING_SAMPLE_RATE']
+    header = app.config['PROFILING_HEADER']
+    token = app.config['PROFILING_TOKEN']
+
+    @app.before_request
+    def start_profiling():
+        if request.endpoint in (None, 'static') or sampler.is_sampling():
+            return
+        requested = token and secrets.compare_digest(request.headers.get(header, ''), token)
+        if requested or random.random() < rate:
+            request.environ[_ENVIRON_KEY] = True
+            sampler.start(request.endpoint)
+
+    @app.teardown_request
+    def stop_profiling(exc=None):
+        if request.environ.pop(_ENVIRON_KEY, False):
+            sampler.stop()
+
+    from app.scheduler import get_scheduler
+    get_scheduler(app).add_job('profiling-flush', app.config['PROFILING_FLUSH_INTERVAL'], _scheduled_flush,
+                               per_process=True)
@@ -0,0 +1,193 @@
+"""
+Eliminazione differita di skills e utenti.
+
+Con DEFERRED_DELETE_ENABLED l'eliminazione di una skill o di un utente
+imposta solo `deleted_at`: l'entità sparisce subito da tutte le query dei
+repository, mentre le righe dipendenti (sessioni, anche archiviate,
+skills, categorie) vengono rimosse in background a blocchi di
+PURGE_BATCH_SIZE righe, una transazione breve per blocco. Così
+un'eliminazione con migliaia di sessioni non tiene mai il lock di
+scrittura per secondi. La riga dell'entità viene eliminata per ultima,
+quando le cascate delle chiavi esterne non hanno più nulla da fare.
+"""
+import time
+
+import click
+from flask import current_app
+
+from app.archive import delete_archived
+from app.db import get_connection, get_directory_db, get_user_db
+from app.maintenance import data_paths
+from app.sync import CHANGE_LOG_TABLES
+
+
+def live_sessions(db, user_id):
+    """
+    Condizione SQL che esclude le sessioni delle skills dell'utente in
+    attesa di eliminazione. Le skills segnate di un utente sono poche
+    (lette dall'indice per utente), quindi i loro ID vengono inseriti come
+    costanti; senza skills segnate la condizione è sempre vera e non costa
+    nulla alla query. Le eliminazioni degli altri utenti dello stesso file
+    non cambiano né il costo né il testo delle query.
+    """
+    ids = [str(row[0]) for row in db.execute(
+        'SELECT id FROM skills WHERE user_id = ? AND deleted_at IS NOT NULL', (user_id,)
+    )]
+    return f'skill_id NOT IN ({", ".join(ids)})' if ids else '1'
+
+
+def _delete_sessions_chunk(db, column, value, batch):
+    """
+    Elimina al massimo `batch` sessioni con `column` = `value`,
+    prima quelle archiviate e poi quelle live.
+    """
+    if current_app.config['ARCHIVE_ENABLED']:
+        deleted = delete_archived(db, column, value, batch)
+        if deleted:
+            return deleted
+    return db.execute(
+        f'DELETE FROM sessions WHERE id IN (SELECT id FROM sessions WHERE {column} = ? LIMIT ?)',
+        (value, batch)
+    ).rowcount
+
+
+def purge_skill_step(db, skill_id, batch):
+    """
+    Un passo di eliminazione di una skill in una transazione.
+
+    Returns:
+        tuple: (righe eliminate, True se la skill è stata rimossa del tutto)
+    """
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        deleted = _delete_sessions_chunk(db, 'skill_id', skill_id, batch)
+        done = deleted == 0
+        if done:
+            deleted = db.execute('DELETE FROM skills WHERE id = ?', (skill_id,)).rowcount
+            db.execute('DELETE FROM skill_versions WHERE skill_id = ?', (skill_id,))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return deleted, done
+
+
+def purge_user_step(user_id, batch):
+    """
+    Un passo di eliminazione di un utente: prima sessioni e skills nel
+    file dei suoi dati, poi categorie e tabelle per utente, infine la
+    riga nel database principale.
+
+    Returns:
+        tuple: (righe eliminate, True se l'utente è stato rimosso del tutto)
+    """
+    directory = get_directory_db(write=True)
+    db = get_user_db(user_id, write=True)
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        deleted = _delete_sessions_chunk(db, 'user_id', user_id, batch)
+        if not deleted:
+            deleted = db.execute(
+                'DELETE FROM skills WHERE id IN (SELECT id FROM skills WHERE user_id = ? LIMIT ?)',
+                (user_id, batch)
+            ).rowcount
+        done = deleted == 0
+        if done:
+            for table in ('categories', 'session_archive_rollups', 'data_versions', 'cache_versions',
+                          *CHANGE_LOG_TABLES):
+                deleted += db.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,)).rowcount
+            if db is not directory:
+                # Copia della riga utente nello shard
+                db.execute('DELETE FROM users WHERE id = ?', (user_id,))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    if done:
+        # Elimina anche assegnazione allo shard e classifiche (ON DELETE CASCADE)
+        directory.execute('DELETE FROM users WHERE id = ?', (user_id,))
+        directory.commit()
+    return deleted, done
+
+
+def _drain(step, batch, keep_going):
+    """
+    Ripete `step(batch)` fino al completamento, con una pausa tra i passi
+    per lasciare spazio ai writer.
+
+    Returns:
+        tuple: (righe eliminate, True se completato)
+    """
+    pause = current_app.config['PURGE_PAUSE_MS'] / 1000
+    total = 0
+    while keep_going is None or keep_going():
+        deleted, done = step(batch)
+        total += deleted
+        if done:
+            return total, True
+        time.sleep(pause)
+    return total, False
+
+
+def purge_pending(batch=None, keep_going=None):
+    """
+    Rimuove le skills e gli utenti segnati come eliminati.
+    Se `keep_going()` restituisce False il lavoro si interrompe e riprende
+    al giro successivo.
+
+    Returns:
+        dict: skills e users completamente rimossi, righe eliminate
+    """
+    batch = batch or current_app.config['PURGE_BATCH_SIZE']
+    report = {'skills': 0, 'users': 0, 'rows': 0}
+
+    for path in data_paths():
+        db = get_connection(path, write=True)
+        skill_ids = [row[0] for row in db.execute('SELECT id FROM skills WHERE deleted_at IS NOT NULL')]
+        for skill_id in skill_ids:
+            rows, done = _drain(lambda size: purge_skill_step(db, skill_id, size), batch, keep_going)
+            report['rows'] += rows
+            report['skills'] += done
+            if not done:
+                return report
+
+    directory = get_directory_db(write=True)
+    user_ids = [row[0] for row in directory.execute('SELECT id FROM users WHERE deleted_at IS NOT NULL')]
+    for user_id in user_ids:
+        rows, done = _drain(lambda size: purge_user_step(user_id, size), batch, keep_going)
+        report['rows'] += rows
+        report['users'] += done
+        if not done:
+            return report
+    return report
+
+
+def _scheduled_purge():
+    from app.scheduler import get_scheduler
+    report = purge_pending(keep_going=get_scheduler(current_app).is_idle)
+    if report['rows']:
+        current_app.logger.info('Eliminazione differita: %(skills)d skills, %(users)d utenti, %(rows)d righe', report)
+
+
+@click.command('purge-deleted')
+@click.option('--batch', type=int, help='Righe per transazione (default PURGE_BATCH_SIZE).')
+def purge_deleted_command(batch):
+    """
+    Completa subito le eliminazioni differite (adatto a cron).
+    Uso: flask purge-deleted [--batch N]
+    """
+    report = purge_pending(batch)
+    click.echo(f'{report["skills"]} skills e {report["users"]} utenti eliminati '
+               f'({report["rows"]} righe).')
+
+
+def init_app(app):
+    """
+    Registra il comando CLI e, se DEFERRED_DELETE_ENABLED, il job periodico.
+    """
+    app.cli.add_command(purge_deleted_command)
+
+    if app.config['DEFERRED_DELETE_ENABLED']:
+        from app.scheduler import get_scheduler
+        get_scheduler(app).add_job('purge-deleted', app.config['PURGE_INTERVAL'], _scheduled_purge)
@@ -0,0 +1,170 @@
+"""
+Riconciliazione degli XP delle skills con le sessioni registrate.
+
+total_xp e current_level di ogni skill sono mantenuti incrementalmente a
+ogni scrittura; `flask reconcile-xp` verifica che coincidano con la somma
+degli XP delle sessioni (archivio compreso) e corregge tutte le skills
+non allineate con un solo UPDATE per file, insieme ai totali progressivi
+dello storico dei livelli (cumulative_xp, level_after).
+"""
+import click
+from flask import current_app
+
+from app.archive import ARCHIVE_SCHEMA, attach_archive, ensure_archive, sessions_source
+from app.db import connect
+from app.maintenance import data_paths
+from app.modelli import level_for_xp
+
+# Esempi di skills non allineate mostrati per ogni file
+REPORT_LIMIT = 20
+
+
+def _expected_xp(db):
+    """
+    Sottoquery con gli XP attesi di ogni skill (somma delle sessioni).
+    """
+    return f'''
+        SELECT sk.id as skill_id, sk.user_id, sk.name, sk.total_xp, sk.current_level,
+               COALESCE(x.xp, 0) as expected_xp
+        FROM skills sk
+        LEFT JOIN (
+            SELECT skill_id, SUM(xp_gained) as xp
+            FROM {sessions_source(db, include_archived=True)}
+            GROUP BY skill_id
+        ) x ON x.skill_id = sk.id
+    '''
+
+
+def _expected_history(db):
+    """
+    Sottoquery con gli XP cumulati attesi di ogni sessione, in ordine
+    di (date, id) all'interno della skill.
+    """
+    return f'''
+        SELECT id, archived,
+               SUM(xp_gained) OVER (PARTITION BY skill_id ORDER BY date, id) as expected_xp
+        FROM {sessions_source(db, include_archived=True)}
+    '''
+
+
+def _fix_history(db, schema, archived):
+    """
+    Corregge cumulative_xp e level_after delle sessioni di una tabella.
+
+    Returns:
+        int: Sessioni corrette
+    """
+    cursor = db.execute(f'''
+        UPDATE {schema}.sessions
+        SET cumulative_xp = h.expected_xp, level_after = level_for_xp(h.expected_xp)
+        FROM ({_expected_history(db)}) h
+        WHERE sessions.id = h.id AND h.archived = ?
+          AND (sessions.cumulative_xp IS NOT h.expected_xp
+               OR sessions.level_after IS NOT level_for_xp(h.expected_xp))
+    ''', (archived,))
+    return cursor.rowcount
+
+
+def reconcile_database(db, fix=True):
+    """
+    Confronta gli XP delle skills con le sessioni su una connessione e,
+    se `fix`, corregge tutte le differenze nella stessa transazione.
+
+    Returns:
+        dict: skills (righe non allineate), users (ID utenti coinvolti)
+              e sessions (sessioni con storico corretto)
+    """
+    db.create_function('level_for_xp', 1, level_for_xp, deterministic=True)
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        expected = _expected_xp(db)
+        mismatches = db.execute(f'''
+            SELECT * FROM ({expected})
+            WHERE total_xp != expected_xp OR current_level != level_for_xp(expected_xp)
+            ORDER BY skill_id
+        ''').fetchall()
+
+        sessions = 0
+        if fix:
+            if mismatches:
+                db.execute(f'''
+                    UPDATE skills
+                    SET total_xp = e.expected_xp, current_level = level_for_xp(e.expected_xp)
+                    FROM ({expected}) e
+                    WHERE skills.id = e.skill_id
+                      AND (skills.total_xp != e.expected_xp
+                           OR skills.current_level != level_for_xp(e.expected_xp))
+                ''')
+            sessions = _fix_history(db, 'main', 0)
+            if current_app.config['ARCHIVE_ENABLED']:
+                sessions += _fix_history(db, ARCHIVE_SCHEMA, 1)
+            db.commit()
+        else:
+            db.rollback()
+    except Exception:
+        db.rollback()
+        raise
+
+    return {
+        'skills': mismatches,
+        'users': sorted({row['user_id'] for row in mismatches}),
+        'sessions': sessions
+    }
+
+
+def reconcile_path(path, fix=True):
+    """
+    Riconcilia un file di dati (archivio compreso) con una connessione
+    dedicata e aggiorna le classifiche degli utenti corretti.
+
+    Returns:
+        dict: Come reconcile_database
+    """
+    from app.repositories import LeaderboardRepository
+
+    db = connect(path, wal=current_app.config['DB_WAL'])
+    try:
+        if current_app.config['ARCHIVE_ENABLED']:
+            attach_archive(db, path)
+            ensure_archive(db)
+        result = reconcile_database(db, fix=fix)
+    finally:
+        db.close()
+
+    if fix:
+        for user_id in result['users']:
+            LeaderboardRepository.refresh_user(user_id)
+    return result
+
+
+def format_mismatch(row):
+    return (f'  skill {row["skill_id"]} ({row["name"]}): '
+            f'{row["total_xp"]} -> {row["expected_xp"]} XP, '
+            f'livello {row["current_level"]} -> {level_for_xp(row["expected_xp"])}')
+
+
+@click.command('reconcile-xp')
+@click.option('--dry-run', is_flag=True, help='Mostra le differenze senza correggerle.')
+def reconcile_xp_command(dry_run):
+    """
+    Ricalcola gli XP delle skills dalla somma delle sessioni.
+    Uso: flask reconcile-xp [--dry-run]
+    """
+    for path in data_paths():
+        result = reconcile_path(path, fix=not dry_run)
+        mismatches = result['skills']
+        action = 'da correggere' if dry_run else 'corrette'
+        click.echo(f'{path}: {len(mismatches)} skills non allineate {action}.')
+        for row in mismatches[:REPORT_LIMIT]:
+            click.echo(format_mismatch(row))
+        if len(mismatches) > REPORT_LIMIT:
+            click.echo(f'  ... e altre {len(mismatches) - REPORT_LIMIT}')
+        if not dry_run:
+            click.echo(f'  storico dei livelli: {result["sessions"]} sessioni corrette.')
+
+
+def init_app(app):
+    """
+    Registra il comando CLI di riconciliazione.
+    """
+    app.cli.add_command(reconcile_xp_command)
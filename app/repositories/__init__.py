@@ -2,5 +2,10 @@ from app.repositories.user_repository import UserRepository
 from app.repositories.category_repository import CategoryRepository
 from app.repositories.skill_repository import SkillRepository
 from app.repositories.session_repository import SessionRepository
+from app.repositories.leaderboard_repository import LeaderboardRepository
+from app.repositories.api_token_repository import ApiTokenRepository
+from app.repositories.change_log_repository import ChangeLogRepository
+from app.repositories.idempotency_repository import IdempotencyRepository
 
-__all__ = ['UserRepository', 'CategoryRepository', 'SkillRepository', 'SessionRepository']
+__all__ = ['UserRepository', 'CategoryRepository', 'SkillRepository', 'SessionRepository',
+           'LeaderboardRepository', 'ApiTokenRepository', 'ChangeLogRepository', 'IdempotencyRepository']
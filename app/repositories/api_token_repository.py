@@ -0,0 +1,80 @@
+import hashlib
+import secrets
+
+from app.db import get_directory_db
+from app.modelli import create_user_from_row
+
+
+def hash_token(token):
+    """
+    Impronta SHA-256 del token: nel database non viene mai salvato in chiaro.
+    """
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class ApiTokenRepository:
+    """
+    Repository per i token di accesso all'API JSON (database principale).
+    """
+
+    @staticmethod
+    def create(user_id, name=None):
+        """
+        Crea un nuovo token per l'utente.
+
+        Returns:
+            str: Il token in chiaro (mostrato una sola volta)
+        """
+        token = secrets.token_urlsafe(32)
+        db = get_directory_db(write=True)
+        db.execute(
+            'INSERT INTO api_tokens (token_hash, user_id, name) VALUES (?, ?, ?)',
+            (hash_token(token), user_id, name)
+        )
+        db.commit()
+        return token
+
+    @staticmethod
+    def get_user(token):
+        """
+        Utente proprietario del token (una sola lettura sull'indice primario).
+
+        Returns:
+            User o None se il token non esiste o l'utente è stato eliminato
+        """
+        db = get_directory_db()
+        row = db.execute('''
+            SELECT u.* FROM api_tokens t
+            JOIN users u ON u.id = t.user_id
+            WHERE t.token_hash = ? AND u.deleted_at IS NULL
+        ''', (hash_token(token),)).fetchone()
+
+        if row is None:
+            return None
+        return create_user_from_row(row)
+
+    @staticmethod
+    def revoke(token):
+        """
+        Revoca un token.
+
+        Returns:
+            bool: True se il token esisteva
+        """
+        db = get_directory_db(write=True)
+        cursor = db.execute('DELETE FROM api_tokens WHERE token_hash = ?', (hash_token(token),))
+        db.commit()
+        return cursor.rowcount > 0
+
+    @staticmethod
+    def revoke_all(user_id):
+        """
+        Revoca tutti i token di un utente.
+
+        Returns:
+            int: Numero di token revocati
+        """
+        db = get_directory_db(write=True)
+        cursor = db.execute('DELETE FROM api_tokens WHERE user_id = ?', (user_id,))
+        db.commit()
+        return cursor.rowcount
@@ -1,5 +1,7 @@
-from app.db import get_db
+from app.cache import cached
+from app.db import get_db, get_write_db
 from app.modelli import Category, create_category_from_row
+from app.repositories.leaderboard_repository import LeaderboardRepository
 
 
 class CategoryRepository:
@@ -15,7 +17,7 @@ class CategoryRepository:
         Returns:
             int: ID della nuova categoria
         """
-        db = get_db()
+        db = get_write_db()
         cursor = db.execute(
             'INSERT INTO categories (name, icon, user_id) VALUES (?, ?, ?)',
             (name, icon, user_id)
@@ -42,6 +44,7 @@ class CategoryRepository:
         return create_category_from_row(row)
 
     @staticmethod
+    @cached()
     def get_all_by_user(user_id):
         """
         Recupera tutte le categorie di un utente.
@@ -57,6 +60,24 @@ class CategoryRepository:
 
         return [create_category_from_row(row) for row in rows]
 
+    @staticmethod
+    def get_page(user_id, columns, limit, after=None):
+        """
+        Una pagina delle categorie dell'utente in ordine di ID, leggendo
+        solo le colonne richieste (`after` = ultimo ID della pagina precedente).
+
+        Returns:
+            list[sqlite3.Row]
+        """
+        db = get_db()
+        select = ', '.join(dict.fromkeys(('id', *columns)))
+        return db.execute(f'''
+            SELECT {select} FROM categories
+            WHERE user_id = ? AND id > ?
+            ORDER BY id
+            LIMIT ?
+        ''', (user_id, after or 0, limit)).fetchall()
+
     @staticmethod
     def update(category_id, name=None, icon=None):
         """
@@ -65,7 +86,7 @@ class CategoryRepository:
         Returns:
             bool: True se aggiornata con successo
         """
-        db = get_db()
+        db = get_write_db()
         category = CategoryRepository.get_by_id(category_id)
         if category is None:
             return False
@@ -78,22 +99,25 @@ class CategoryRepository:
             (new_name, new_icon, category_id)
         )
         db.commit()
+        LeaderboardRepository.refresh_current_user()
         return True
 
     @staticmethod
     def delete(category_id):
         """
-        Elimina una categoria.
+        Elimina una categoria (le sue skills restano, senza categoria).
 
         Returns:
             bool: True se eliminata con successo
         """
-        db = get_db()
+        db = get_write_db()
         db.execute('DELETE FROM categories WHERE id = ?', (category_id,))
         db.commit()
+        LeaderboardRepository.refresh_current_user()
         return True
 
     @staticmethod
+    @cached()
     def get_with_skill_count(user_id):
         """
         Recupera le categorie con il conteggio delle skills.
@@ -105,7 +129,7 @@ class CategoryRepository:
         rows = db.execute('''
             SELECT c.*, COUNT(s.id) as skill_count
             FROM categories c
-            LEFT JOIN skills s ON c.id = s.category_id
+            LEFT JOIN skills s ON c.id = s.category_id AND s.deleted_at IS NULL
             WHERE c.user_id = ?
             GROUP BY c.id
             ORDER BY c.name
@@ -0,0 +1,81 @@
+from app.archive import sessions_source
+from app.db import get_db
+from app.purge import live_sessions
+
+# Entità del registro -> (sorgente delle righe, colonne inviate ai client)
+ENTITIES = {
+    'category': ('categories', ('id', 'name', 'icon')),
+    'skill': ('skills', ('id', 'name', 'description', 'current_level', 'target_level',
+                         'total_xp', 'category_id', 'created_at')),
+    'session': ('sessions', ('id', 'skill_id', 'date', 'duration_minutes', 'xp_gained', 'notes',
+                             'cumulative_xp', 'level_after', 'created_at'))
+}
+
+
+class ChangeLogRepository:
+    """
+    Repository per il registro delle modifiche (sincronizzazione dei client),
+    nel file dei dati dell'utente.
+    """
+
+    @staticmethod
+    def get_state(user_id):
+        """
+        Returns:
+            tuple: (ultima sequenza assegnata, orizzonte della compattazione)
+        """
+        row = get_db().execute(
+            'SELECT seq, horizon FROM change_log_state WHERE user_id = ?',
+            (user_id,)
+        ).fetchone()
+        return (row['seq'], row['horizon']) if row else (0, 0)
+
+    @staticmethod
+    def get_changes(user_id, since, limit):
+        """
+        Modifiche successive a `since`, al massimo `limit` righe del registro,
+        ridotte all'ultima operazione di ogni entità.
+
+        Returns:
+            tuple: ({entity: {entity_id: op}}, ultima seq letta, True se ce ne sono altre)
+        """
+        rows = get_db().execute('''
+            SELECT seq, entity, entity_id, op FROM change_log
+            WHERE user_id = ? AND seq > ?
+            ORDER BY seq
+            LIMIT ?
+        ''', (user_id, since, limit + 1)).fetchall()
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+        changes = {entity: {} for entity in ENTITIES}
+        for row in rows:
+            changes[row['entity']][row['entity_id']] = row['op']
+        return changes, (rows[-1]['seq'] if rows else since), more
+
+    @staticmethod
+    def get_rows(user_id, entity, ids):
+        """
+        Stato attuale delle entità indicate (sessioni archiviate comprese).
+        Le entità non più visibili (eliminate o in attesa di eliminazione)
+        non vengono restituite.
+
+        Returns:
+            list[sqlite3.Row]: Righe con le colonne di ENTITIES[entity]
+        """
+        if not ids:
+            return []
+        table, columns = ENTITIES[entity]
+        db = get_db()
+        source, visible = table, '1'
+        if entity == 'skill':
+            visible = 'deleted_at IS NULL'
+        elif entity == 'session':
+            source, visible = sessions_source(db, include_archived=True), live_sessions(db, user_id)
+
+        # Il + esclude l'indice per utente: le righe si leggono per chiave primaria
+        id_list = ', '.join(str(int(entity_id)) for entity_id in ids)
+        return db.execute(f'''
+            SELECT {', '.join(columns)} FROM {source}
+            WHERE +user_id = ? AND id IN ({id_list}) AND {visible}
+        ''', (user_id,)).fetchall()
@@ -0,0 +1,92 @@
+import time
+import zlib
+
+from app.db import get_write_db
+
+
+class IdempotencyConflict(Exception):
+    """
+    La chiave è già stata registrata da un'altra richiesta: la transazione
+    che tentava di registrarla è stata annullata.
+    """
+
+
+class IdempotencyRepository:
+    """
+    Repository per le chiavi di idempotenza delle richieste di scrittura,
+    nel file dei dati dell'utente. Una riga per (utente, chiave), inserita
+    nella stessa transazione delle scritture della richiesta: status NULL
+    finché l'esito non viene salvato, poi l'esito da restituire alle
+    ripetizioni della stessa richiesta.
+    """
+
+    @staticmethod
+    def get(user_id, key, ttl):
+        """
+        Riga della chiave, se registrata e non scaduta.
+
+        Returns:
+            sqlite3.Row o None
+        """
+        db = get_write_db()
+        return db.execute(
+            'SELECT * FROM idempotency_keys WHERE user_id = ? AND key = ? AND created_at >= ?',
+            (user_id, key, int(time.time()) - ttl)
+        ).fetchone()
+
+    @staticmethod
+    def claim(db, user_id, key, request_line, ttl):
+        """
+        Registra la chiave sulla connessione data, dentro la transazione
+        delle scritture della richiesta, senza commit. Una riga scaduta
+        con la stessa chiave viene sostituita.
+
+        Raises:
+            IdempotencyConflict: se la chiave è già registrata e non scaduta
+        """
+        now = int(time.time())
+        cursor = db.execute('''
+            INSERT INTO idempotency_keys (user_id, key, request, created_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id, key) DO UPDATE SET
+                request = excluded.request, status = NULL, location = NULL,
+                content_type = NULL, body = NULL, created_at = excluded.created_at
+            WHERE idempotency_keys.created_at < ?
+        ''', (user_id, key, request_line, now, now - ttl))
+        if not cursor.rowcount:
+            raise IdempotencyConflict(key)
+
+    @staticmethod
+    def complete(user_id, key, status, location=None, content_type=None, body=None):
+        """
+        Salva l'esito della richiesta (corpo compresso).
+        """
+        db = get_write_db()
+        IdempotencyRepository.save_outcome(db, user_id, key, status, location, content_type, body)
+        db.commit()
+
+    @staticmethod
+    def save_outcome(db, user_id, key, status, location=None, content_type=None, body=None):
+        """
+        Come complete, sulla connessione data e senza commit.
+        """
+        db.execute('''
+            UPDATE idempotency_keys
+            SET status = ?, location = ?, content_type = ?, body = ?
+            WHERE user_id = ? AND key = ?
+        ''', (status, location, content_type, zlib.compress(body) if body else None, user_id, key))
+
+    @staticmethod
+    def delete_expired(db, ttl, limit):
+        """
+        Elimina al massimo `limit` chiavi scadute dal file della connessione data.
+
+        Returns:
+            int: Chiavi eliminate
+        """
+        cursor = db.execute('''
+            DELETE FROM idempotency_keys WHERE (user_id, key) IN (
+                SELECT user_id, key FROM idempotency_keys WHERE created_at < ? LIMIT ?
+            )
+        ''', (int(time.time()) - ttl, limit))
+        db.commit()
+        return cursor.rowcount
@@ -0,0 +1,316 @@
+from datetime import date, timedelta
+
+from flask import current_app, g
+
+from app.db import get_directory_db, get_user_db
+from app.purge import live_sessions
+
+# Classifica -> (tabella, colonna del punteggio, colonna di partizione)
+BOARDS = {
+    'total': ('leaderboard_totals', 'total_xp', None),
+    'category': ('leaderboard_categories', 'total_xp', 'category'),
+    'week': ('leaderboard_weekly', 'xp', 'week')
+}
+
+BOARD_TABLES = ('leaderboard_weekly', 'leaderboard_categories', 'leaderboard_totals')
+
+
+def week_start(day):
+    """
+    Lunedì della settimana di `day` (date o stringa YYYY-MM-DD), in formato ISO.
+    """
+    if isinstance(day, str):
+        day = date.fromisoformat(day[:10])
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+
+def score_bucket(score):
+    """
+    Fascia di un punteggio, come nei trigger di leaderboard_buckets
+    (app/schema.sql): numero di cifre * 100 + prime due cifre, 0 se <= 0.
+
+    Esempio:
+        score = 12345
+        -> ritorna 512
+    """
+    if score <= 0:
+        return 0
+    digits = str(score)
+    return len(digits) * 100 + int((digits + '0')[:2])
+
+
+def _bucket_end(score):
+    """
+    Punteggio più basso della fascia successiva a quella di `score`.
+    """
+    if score <= 0:
+        return 1
+    digits = str(score)
+    if len(digits) == 1:
+        return score + 1
+    lead = int(digits[:2])
+    if lead == 99:
+        return 10 ** len(digits)
+    return (lead + 1) * 10 ** (len(digits) - 2)
+
+
+class LeaderboardRepository:
+    """
+    Repository per le classifiche globali (XP totali, per categoria e
+    settimanali), sempre nel database principale.
+
+    Le tabelle contengono solo i partecipanti e vengono aggiornate a ogni
+    scrittura: la pagina di una classifica è una lettura sull'indice
+    (punteggio DESC, user_id). La posizione di un utente si calcola dai
+    contatori per fascia di punteggio (leaderboard_buckets, mantenuti dai
+    trigger): somma delle fasce superiori più un COUNT limitato alla sua
+    fascia, senza contare tutti i partecipanti che lo precedono.
+    """
+
+    @staticmethod
+    def is_member(user_id):
+        """
+        Verifica se l'utente partecipa alle classifiche.
+        """
+        db = get_directory_db()
+        row = db.execute(
+            'SELECT 1 FROM leaderboard_members WHERE user_id = ?',
+            (user_id,)
+        ).fetchone()
+        return row is not None
+
+    @staticmethod
+    def join(user_id):
+        """
+        Iscrive l'utente alle classifiche e calcola i suoi punteggi.
+        """
+        db = get_directory_db(write=True)
+        db.execute(
+            'INSERT INTO leaderboard_members (user_id) VALUES (?) ON CONFLICT(user_id) DO NOTHING',
+            (user_id,)
+        )
+        db.commit()
+        LeaderboardRepository.refresh_user(user_id)
+
+    @staticmethod
+    def leave(user_id):
+        """
+        Rimuove l'utente (e i suoi punteggi) dalle classifiche.
+        """
+        db = get_directory_db(write=True)
+        for table in BOARD_TABLES:
+            db.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
+        db.execute('DELETE FROM leaderboard_members WHERE user_id = ?', (user_id,))
+        db.commit()
+
+    @staticmethod
+    def rebuild_buckets(db):
+        """
+        Ricalcola leaderboard_buckets e leaderboard_sizes dai punteggi sulla
+        connessione data, senza commit (tabelle create da flask db-upgrade
+        su classifiche già popolate).
+        """
+        db.create_function('score_bucket', 1, score_bucket, deterministic=True)
+        scores = ' UNION ALL '.join(
+            f"SELECT '{board}' as board, {partition or repr('')} as partition, {column} as score FROM {table}"
+            for board, (table, column, partition) in BOARDS.items()
+        )
+        db.execute('DELETE FROM leaderboard_buckets')
+        db.execute('DELETE FROM leaderboard_sizes')
+        db.execute(f'''
+            INSERT INTO leaderboard_buckets (board, partition, bucket, participants)
+            SELECT board, partition, score_bucket(score), COUNT(*)
+            FROM ({scores})
+            GROUP BY board, partition, score_bucket(score)
+        ''')
+        db.execute('''
+            INSERT INTO leaderboard_sizes (board, partition, participants)
+            SELECT board, partition, SUM(participants) FROM leaderboard_buckets
+            GROUP BY board, partition
+        ''')
+
+    @staticmethod
+    def refresh_user(user_id):
+        """
+        Ricalcola i punteggi di un partecipante dai suoi dati.
+        Costa quanto le skills dell'utente, indipendentemente dal numero
+        di partecipanti. Usato dopo modifiche strutturali (skill eliminate
+        o spostate di categoria, sessioni modificate, ...).
+        """
+        if not current_app.config['LEADERBOARDS_ENABLED'] or not LeaderboardRepository.is_member(user_id):
+            return
+
+        data = get_user_db(user_id, write=True)
+        total_xp = data.execute(
+            'SELECT COALESCE(SUM(total_xp), 0) FROM skills WHERE user_id = ? AND deleted_at IS NULL',
+            (user_id,)
+        ).fetchone()[0]
+        categories = data.execute('''
+            SELECT c.name, SUM(s.total_xp)
+            FROM skills s
+            JOIN categories c ON s.category_id = c.id
+            WHERE s.user_id = ? AND s.deleted_at IS NULL
+            GROUP BY c.name
+        ''', (user_id,)).fetchall()
+        week = week_start(date.today())
+        week_xp = data.execute(f'''
+            SELECT COALESCE(SUM(xp_gained), 0) FROM sessions
+            WHERE user_id = ? AND date >= ? AND date < ? AND {live_sessions(data, user_id)}
+        ''', (user_id, week, (date.fromisoformat(week) + timedelta(days=7)).isoformat())).fetchone()[0]
+
+        db = get_directory_db(write=True)
+        for table in BOARD_TABLES:
+            db.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
+        db.execute('INSERT INTO leaderboard_totals (user_id, total_xp) VALUES (?, ?)', (user_id, total_xp))
+        db.executemany(
+            'INSERT INTO leaderboard_categories (category, user_id, total_xp) VALUES (?, ?, ?)',
+            [(name, user_id, xp) for name, xp in categories]
+        )
+        db.execute('INSERT INTO leaderboard_weekly (week, user_id, xp) VALUES (?, ?, ?)', (week, user_id, week_xp))
+        db.commit()
+
+    @staticmethod
+    def refresh_current_user():
+        """
+        Ricalcola i punteggi dell'utente loggato (se presente).
+        """
+        user = g.get('user')
+        if user is not None:
+            LeaderboardRepository.refresh_user(user.id)
+
+    @staticmethod
+    def apply_session(user_id, skill_id, session_date, xp_amount):
+        """
+        Applica gli XP di una nuova sessione come incremento sui punteggi
+        (totale, categoria della skill e settimana della sessione).
+        """
+        if not current_app.config['LEADERBOARDS_ENABLED'] or not LeaderboardRepository.is_member(user_id):
+            return
+
+        category = get_user_db(user_id, write=True).execute('''
+            SELECT c.name FROM skills s
+            JOIN categories c ON s.category_id = c.id
+            WHERE s.id = ?
+        ''', (skill_id,)).fetchone()
+
+        db = get_directory_db(write=True)
+        db.execute('''
+            INSERT INTO leaderboard_totals (user_id, total_xp) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET total_xp = total_xp + excluded.total_xp
+        ''', (user_id, xp_amount))
+        if category is not None:
+            db.execute('''
+                INSERT INTO leaderboard_categories (category, user_id, total_xp) VALUES (?, ?, ?)
+                ON CONFLICT(category, user_id) DO UPDATE SET total_xp = total_xp + excluded.total_xp
+            ''', (category[0], user_id, xp_amount))
+        db.execute('''
+            INSERT INTO leaderboard_weekly (week, user_id, xp) VALUES (?, ?, ?)
+            ON CONFLICT(week, user_id) DO UPDATE SET xp = xp + excluded.xp
+        ''', (week_start(session_date), user_id, xp_amount))
+        db.commit()
+
+    @staticmethod
+    def _where(board, key, alias=''):
+        table, score, partition = BOARDS[board]
+        if partition is None:
+            return table, score, '1 = 1', ()
+        return table, score, f'{alias}{partition} = ?', (key,)
+
+    @staticmethod
+    def get_page(board, key=None, limit=50, after=None):
+        """
+        Una pagina della classifica in ordine di punteggio.
+        `after` = (punteggio, user_id) dell'ultima riga della pagina
+        precedente (paginazione per chiave, senza OFFSET).
+
+        Returns:
+            list[dict]: rank, user_id, username, score
+        """
+        table, score, where, params = LeaderboardRepository._where(board, key, alias='l.')
+        db = get_directory_db()
+
+        cursor_sql = ''
+        if after is not None:
+            cursor_sql = f'AND (l.{score} < ? OR (l.{score} = ? AND l.user_id > ?))'
+            params = (*params, after[0], after[0], after[1])
+        rows = db.execute(f'''
+            SELECT l.user_id, u.username, l.{score} as score
+            FROM {table} l
+            JOIN users u ON u.id = l.user_id
+            WHERE {where} {cursor_sql}
+            ORDER BY l.{score} DESC, l.user_id
+            LIMIT ?
+        ''', (*params, limit)).fetchall()
+        if not rows:
+            return []
+
+        # Rank "a pari merito": 1 + numero di punteggi strettamente maggiori
+        first = rows[0]
+        _, _, where, base_params = LeaderboardRepository._where(board, key)
+        first_rank = 1 + LeaderboardRepository._count_above(db, board, key, first['score'])
+        first_position = first_rank + db.execute(
+            f'SELECT COUNT(*) FROM {table} WHERE {where} AND {score} = ? AND user_id < ?',
+            (*base_params, first['score'], first['user_id'])
+        ).fetchone()[0]
+
+        page = []
+        for i, row in enumerate(rows):
+            if row['score'] == first['score']:
+                rank = first_rank
+            elif row['score'] == rows[i - 1]['score']:
+                rank = page[-1]['rank']
+            else:
+                rank = first_position + i
+            page.append({'rank': rank, 'user_id': row['user_id'],
+                         'username': row['username'], 'score': row['score']})
+        return page
+
+    @staticmethod
+    def get_rank(board, user_id, key=None):
+        """
+        Posizione di un utente in classifica.
+
+        Returns:
+            dict: rank, score e partecipanti, oppure None se non in classifica
+        """
+        table, score, where, params = LeaderboardRepository._where(board, key)
+        db = get_directory_db()
+        row = db.execute(
+            f'SELECT {score} FROM {table} WHERE {where} AND user_id = ?',
+            (*params, user_id)
+        ).fetchone()
+        if row is None:
+            return None
+
+        total = db.execute(
+            'SELECT participants FROM leaderboard_sizes WHERE board = ? AND partition = ?',
+            (board, key or '')
+        ).fetchone()
+        return {'rank': LeaderboardRepository._count_above(db, board, key, row[0]) + 1,
+                'score': row[0], 'participants': total[0] if total else 0}
+
+    @staticmethod
+    def _count_above(db, board, key, value):
+        """
+        Numero di partecipanti con punteggio strettamente maggiore di
+        `value`: i contatori delle fasce superiori più i punteggi maggiori
+        nella stessa fascia (intervallo sull'indice della classifica).
+        """
+        table, score, where, params = LeaderboardRepository._where(board, key)
+        above = db.execute('''
+            SELECT COALESCE(SUM(participants), 0) FROM leaderboard_buckets
+            WHERE board = ? AND partition = ? AND bucket > ?
+        ''', (board, key or '', score_bucket(value))).fetchone()[0]
+        return above + db.execute(
+            f'SELECT COUNT(*) FROM {table} WHERE {where} AND {score} > ? AND {score} < ?',
+            (*params, value, _bucket_end(value))
+        ).fetchone()[0]
+
+    @staticmethod
+    def get_categories():
+        """
+        Nomi di categoria presenti nella classifica per categoria.
+        """
+        db = get_directory_db()
+        rows = db.execute("SELECT partition FROM leaderboard_sizes WHERE board = 'category' ORDER BY partition").fetchall()
+        return [row['partition'] for row in rows]
@@ -1,5 +1,26 @@
-from app.db import get_db
-from app.modelli import Session, create_session_from_row
+from flask import current_app
+
+from app.archive import ARCHIVE_SCHEMA, sessions_source
+from app.cache import cached
+from app.db import get_db, get_write_db, take_before_commit, user_data_path
+from app.events import notify_changes
+from app.group_commit import GroupCommitTimeout
+from app.modelli import Session, create_session_from_row, level_for_xp, normalize_session_date
+from app.purge import live_sessions
+from app.repositories.leaderboard_repository import LeaderboardRepository
+from app.repositories.skill_repository import SkillRepository
+from app.sharding import check_user_shard
+
+
+def _valid_date(value):
+    """
+    Data della sessione normalizzata (YYYY-MM-DD); le statistiche leggono
+    le date come testo a lunghezza fissa.
+    """
+    normalized = normalize_session_date(value)
+    if normalized is None:
+        raise ValueError(f'Data della sessione non valida: {value!r}')
+    return normalized
 
 
 class SessionRepository:
@@ -15,15 +36,128 @@ class SessionRepository:
         Returns:
             int: ID della nuova sessione
         """
-        db = get_db()
+        date = _valid_date(date)
+        db = get_write_db()
+        session_id = SessionRepository._insert(db, skill_id, user_id, date,
+                                               duration_minutes, xp_gained, notes)
+        db.commit()
+        return session_id
+
+    @staticmethod
+    def _insert(db, skill_id, user_id, date, duration_minutes, xp_gained, notes):
+        """
+        Inserisce una sessione sulla connessione data, senza commit.
+        """
         cursor = db.execute(
             '''INSERT INTO sessions (skill_id, user_id, date, duration_minutes, xp_gained, notes)
                VALUES (?, ?, ?, ?, ?, ?)''',
             (skill_id, user_id, date, duration_minutes, xp_gained, notes)
         )
-        db.commit()
+        SessionRepository._recompute_history(db, skill_id, date, cursor.lastrowid)
         return cursor.lastrowid
 
+    @staticmethod
+    def _recompute_history(db, skill_id, date, session_id):
+        """
+        Ricalcola cumulative_xp e level_after delle sessioni della skill a
+        partire dalla posizione (date, session_id), senza commit.
+
+        Solo il suffisso della storia viene riletto: il punto di partenza è
+        il cumulative_xp della sessione immediatamente precedente. Per una
+        sessione registrata oggi il suffisso è quasi sempre la sola sessione.
+        """
+        source = sessions_source(db, include_archived=True)
+        previous = db.execute(f'''
+            SELECT cumulative_xp FROM {source}
+            WHERE skill_id = ? AND (date < ? OR (date = ? AND id < ?))
+            ORDER BY date DESC, id DESC
+            LIMIT 1
+        ''', (skill_id, date, date, session_id)).fetchone()
+        running = previous['cumulative_xp'] if previous else 0
+
+        rows = db.execute(f'''
+            SELECT id, xp_gained, archived FROM {source}
+            WHERE skill_id = ? AND (date > ? OR (date = ? AND id >= ?))
+            ORDER BY date, id
+        ''', (skill_id, date, date, session_id)).fetchall()
+
+        updates = {0: [], 1: []}
+        for row in rows:
+            running += row['xp_gained']
+            updates[row['archived']].append((running, level_for_xp(running), row['id']))
+
+        db.executemany('UPDATE main.sessions SET cumulative_xp = ?, level_after = ? WHERE id = ?',
+                       updates[0])
+        if updates[1]:
+            db.executemany(f'UPDATE {ARCHIVE_SCHEMA}.sessions SET cumulative_xp = ?, level_after = ? WHERE id = ?',
+                           updates[1])
+
+    @staticmethod
+    def record(skill_id, user_id, date, duration_minutes, xp_gained, notes=None):
+        """
+        Registra una sessione e aggiunge i suoi XP alla skill in un'unica
+        transazione. Con GROUP_COMMIT_ENABLED la scrittura passa dal writer
+        di gruppo e la chiamata ritorna dopo il commit del batch.
+
+        Returns:
+            dict: Come SkillRepository.add_xp, più 'session_id'
+
+        Raises:
+            GroupCommitTimeout: se il batch non arriva al commit entro
+                GROUP_COMMIT_TIMEOUT; classifiche ed eventi vengono
+                aggiornati dal writer quando il batch termina
+        """
+        date = _valid_date(date)
+        writer = current_app.extensions.get('group_commit')
+        # Con il group commit la chiave di idempotenza della richiesta va
+        # registrata nella transazione del batch
+        path = user_data_path()
+        before_commit = take_before_commit(path) if writer is not None else None
+
+        def write(db):
+            # La connessione del writer di gruppo non ha l'hook after_begin
+            # delle richieste (vedi get_connection): stesso controllo sullo
+            # spostamento dell'utente, dentro il lock del batch
+            if writer is not None and current_app.config['DB_SHARDS']:
+                check_user_shard(user_id, path)
+            if before_commit is not None:
+                before_commit(db)
+            session_id = SessionRepository._insert(db, skill_id, user_id, date,
+                                                   duration_minutes, xp_gained, notes)
+            result = SkillRepository._apply_xp(db, skill_id, xp_gained)
+            result['session_id'] = session_id
+            return result
+
+        if writer is not None:
+            future = writer.submit(path, write)
+            try:
+                result = future.result(timeout=current_app.config['GROUP_COMMIT_TIMEOUT'])
+            except TimeoutError:
+                app = current_app._get_current_object()
+
+                def after_commit(future):
+                    if future.exception() is None:
+                        with app.app_context():
+                            SessionRepository._after_record(user_id, skill_id, date, xp_gained)
+
+                future.add_done_callback(after_commit)
+                raise GroupCommitTimeout(path, future)
+        else:
+            db = get_write_db()
+            result = write(db)
+            db.commit()
+
+        SessionRepository._after_record(user_id, skill_id, date, xp_gained)
+        return result
+
+    @staticmethod
+    def _after_record(user_id, skill_id, date, xp_gained):
+        """
+        Aggiornamenti successivi al commit di una sessione registrata.
+        """
+        LeaderboardRepository.apply_session(user_id, skill_id, date, xp_gained)
+        notify_changes()
+
     @staticmethod
     def get_by_id(session_id):
         """
@@ -36,7 +170,7 @@ class SessionRepository:
         row = db.execute('''
             SELECT se.*, sk.name as skill_name
             FROM sessions se
-            JOIN skills sk ON se.skill_id = sk.id
+            JOIN skills sk ON se.skill_id = sk.id AND sk.deleted_at IS NULL
             WHERE se.id = ?
         ''', (session_id,)).fetchone()
 
@@ -45,18 +179,19 @@ class SessionRepository:
         return create_session_from_row(row)
 
     @staticmethod
-    def get_all_by_user(user_id, limit=None):
+    def get_all_by_user(user_id, limit=None, include_archived=False):
         """
         Recupera tutte le sessioni di un utente.
+        Con include_archived=True vengono incluse anche quelle archiviate.
 
         Returns:
             list[Session]
         """
         db = get_db()
-        query = '''
+        query = f'''
             SELECT se.*, sk.name as skill_name
-            FROM sessions se
-            JOIN skills sk ON se.skill_id = sk.id
+            FROM {sessions_source(db, include_archived)} se
+            JOIN skills sk ON se.skill_id = sk.id AND sk.deleted_at IS NULL
             WHERE se.user_id = ?
             ORDER BY se.date DESC, se.created_at DESC
         '''
@@ -67,18 +202,19 @@ class SessionRepository:
         return [create_session_from_row(row) for row in rows]
 
     @staticmethod
-    def get_by_skill(skill_id):
+    def get_by_skill(skill_id, include_archived=False):
         """
         Recupera tutte le sessioni di una skill.
+        Con include_archived=True vengono incluse anche quelle archiviate.
 
         Returns:
             list[Session]
         """
         db = get_db()
-        rows = db.execute('''
+        rows = db.execute(f'''
             SELECT se.*, sk.name as skill_name
-            FROM sessions se
-            JOIN skills sk ON se.skill_id = sk.id
+            FROM {sessions_source(db, include_archived)} se
+            JOIN skills sk ON se.skill_id = sk.id AND sk.deleted_at IS NULL
             WHERE se.skill_id = ?
             ORDER BY se.date DESC
         ''', (skill_id,)).fetchall()
@@ -86,69 +222,177 @@ class SessionRepository:
         return [create_session_from_row(row) for row in rows]
 
     @staticmethod
-    def update(session_id, date=None, duration_minutes=None, xp_gained=None, notes=None):
+    def get_page(user_id, columns, limit, after=None, skill_id=None, include_archived=False):
         """
-        Aggiorna una sessione.
+        Una pagina delle sessioni dell'utente, dalla più recente, con
+        paginazione per chiave su (date, id): la pagina N costa quanto la
+        prima, perché la lettura parte dall'indice invece di scartare
+        N * limit righe come con OFFSET.
+
+        Args:
+            columns: Colonne da leggere (validate dal chiamante)
+            after: (date, id) dell'ultima sessione della pagina precedente
 
         Returns:
-            bool: True se aggiornata con successo
+            list[sqlite3.Row]: Le colonne richieste più date e id
+        """
+        db = get_db()
+        where, params = ['user_id = ?', live_sessions(db, user_id)], [user_id]
+        if skill_id is not None:
+            # Con il filtro per skill conviene l'indice (skill_id, date, id):
+            # il + impedisce al planner di usare quello per utente
+            where[0] = '+user_id = ?'
+            where.append('skill_id = ?')
+            params.append(skill_id)
+        if after is not None:
+            where.append('(date, id) < (?, ?)')
+            params.extend(after)
+
+        select = ', '.join(dict.fromkeys(('id', 'date', *columns)))
+        return db.execute(f'''
+            SELECT {select}
+            FROM {sessions_source(db, include_archived)}
+            WHERE {' AND '.join(where)}
+            ORDER BY date DESC, id DESC
+            LIMIT ?
+        ''', (*params, limit)).fetchall()
+
+    @staticmethod
+    def get_level_history(skill_id, max_points=60):
+        """
+        Andamento di XP e livello di una skill, un punto per giorno
+        (i valori dopo l'ultima sessione del giorno), archivio compreso.
+        I totali sono già salvati su ogni sessione, quindi non serve
+        ripercorrere lo storico; oltre `max_points` giorni i punti vengono
+        campionati a intervalli regolari (l'ultimo è sempre incluso).
+
+        Returns:
+            list[dict]: date, cumulative_xp, level
         """
         db = get_db()
-        session = SessionRepository.get_by_id(session_id)
+        rows = db.execute(f'''
+            SELECT date, cumulative_xp, level_after
+            FROM {sessions_source(db, include_archived=True)}
+            WHERE skill_id = ?
+            ORDER BY date, id
+        ''', (skill_id,)).fetchall()
+
+        by_day = {}
+        for row in rows:
+            by_day[str(row['date'])] = {'date': str(row['date']),
+                                        'cumulative_xp': row['cumulative_xp'],
+                                        'level': row['level_after']}
+        history = list(by_day.values())
+        if len(history) > max_points:
+            step = (len(history) - 1) / (max_points - 1)
+            history = [history[round(i * step)] for i in range(max_points)]
+        return history
+
+    @staticmethod
+    def update(session_id, date=None, duration_minutes=None, xp_gained=None, notes=None, skill_id=None):
+        """
+        Aggiorna una sessione e, nella stessa transazione, gli XP delle skills
+        coinvolte: la differenza di XP se la skill resta la stessa, oppure
+        gli XP tolti alla vecchia skill e aggiunti alla nuova se la sessione
+        viene spostata.
+
+        Returns:
+            bool: True se aggiornata con successo
+        """
+        if date is not None:
+            date = _valid_date(date)
+        db = get_write_db()
+        # I valori di partenza si leggono dalla connessione di scrittura,
+        # dentro la transazione che applica le differenze
+        db.execute('BEGIN IMMEDIATE')
+        session = db.execute('SELECT * FROM sessions WHERE id = ?', (session_id,)).fetchone()
         if session is None:
+            db.rollback()
             return False
 
-        new_date = date if date is not None else session.date
-        new_duration = duration_minutes if duration_minutes is not None else session.duration_minutes
-        new_xp = xp_gained if xp_gained is not None else session.xp_gained
-        new_notes = notes if notes is not None else session.notes
+        old_skill_id, old_xp, old_date = session['skill_id'], session['xp_gained'], str(session['date'])
+        new_skill_id = skill_id if skill_id is not None else old_skill_id
+        new_date = date if date is not None else old_date
+        new_duration = duration_minutes if duration_minutes is not None else session['duration_minutes']
+        new_xp = xp_gained if xp_gained is not None else old_xp
+        new_notes = notes if notes is not None else session['notes']
 
         db.execute('''
             UPDATE sessions
-            SET date = ?, duration_minutes = ?, xp_gained = ?, notes = ?
+            SET skill_id = ?, date = ?, duration_minutes = ?, xp_gained = ?, notes = ?
             WHERE id = ?
-        ''', (new_date, new_duration, new_xp, new_notes, session_id))
+        ''', (new_skill_id, new_date, new_duration, new_xp, new_notes, session_id))
+
+        if new_skill_id == old_skill_id:
+            if new_xp != old_xp:
+                SkillRepository._apply_xp(db, old_skill_id, new_xp - old_xp)
+            # La storia cambia dalla prima delle due posizioni (vecchia e nuova data)
+            SessionRepository._recompute_history(db, old_skill_id, min(old_date, str(new_date)), session_id)
+        else:
+            SkillRepository._apply_xp(db, old_skill_id, -old_xp)
+            SkillRepository._apply_xp(db, new_skill_id, new_xp)
+            SessionRepository._recompute_history(db, old_skill_id, old_date, session_id)
+            SessionRepository._recompute_history(db, new_skill_id, str(new_date), session_id)
         db.commit()
+        LeaderboardRepository.refresh_current_user()
+        notify_changes()
         return True
 
     @staticmethod
     def delete(session_id):
         """
-        Elimina una sessione.
+        Elimina una sessione togliendo i suoi XP dalla skill nella stessa
+        transazione.
 
         Returns:
             bool: True se eliminata con successo
         """
-        db = get_db()
+        db = get_write_db()
+        db.execute('BEGIN IMMEDIATE')
+        row = db.execute('SELECT skill_id, date, xp_gained FROM sessions WHERE id = ?', (session_id,)).fetchone()
         db.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+        if row is not None:
+            SkillRepository._apply_xp(db, row['skill_id'], -row['xp_gained'])
+            SessionRepository._recompute_history(db, row['skill_id'], str(row['date']), session_id)
         db.commit()
+        LeaderboardRepository.refresh_current_user()
+        notify_changes()
         return True
 
     @staticmethod
+    @cached()
     def get_stats_by_user(user_id):
         """
         Recupera statistiche aggregate delle sessioni per l'utente.
+        Include le sessioni archiviate tramite i rollup per utente.
 
         Returns:
             dict: Statistiche
         """
         db = get_db()
-        row = db.execute('''
+        row = db.execute(f'''
             SELECT
-                COUNT(*) as total_sessions,
-                COALESCE(SUM(duration_minutes), 0) as total_minutes,
-                COALESCE(SUM(xp_gained), 0) as total_xp_gained,
-                COALESCE(AVG(duration_minutes), 0) as avg_duration
-            FROM sessions
-            WHERE user_id = ?
-        ''', (user_id,)).fetchone()
+                live.total_sessions + COALESCE(r.sessions, 0) as total_sessions,
+                live.total_minutes + COALESCE(r.minutes, 0) as total_minutes,
+                live.total_xp_gained + COALESCE(r.xp, 0) as total_xp_gained
+            FROM (
+                SELECT
+                    COUNT(*) as total_sessions,
+                    COALESCE(SUM(duration_minutes), 0) as total_minutes,
+                    COALESCE(SUM(xp_gained), 0) as total_xp_gained
+                FROM sessions
+                WHERE user_id = ? AND {live_sessions(db, user_id)}
+            ) live
+            LEFT JOIN session_archive_rollups r ON r.user_id = ?
+        ''', (user_id, user_id)).fetchone()
 
+        total_sessions = row['total_sessions']
         return {
-            'total_sessions': row['total_sessions'],
+            'total_sessions': total_sessions,
             'total_minutes': row['total_minutes'],
             'total_hours': round(row['total_minutes'] / 60, 1),
             'total_xp_gained': row['total_xp_gained'],
-            'avg_duration': round(row['avg_duration'], 0)
+            'avg_duration': round(row['total_minutes'] / total_sessions, 0) if total_sessions else 0
         }
 
     @staticmethod
@@ -163,7 +407,7 @@ class SessionRepository:
         rows = db.execute('''
             SELECT se.*, sk.name as skill_name
             FROM sessions se
-            JOIN skills sk ON se.skill_id = sk.id
+            JOIN skills sk ON se.skill_id = sk.id AND sk.deleted_at IS NULL
             WHERE se.user_id = ? AND se.date >= date('now', ?)
             ORDER BY se.date DESC
         ''', (user_id, f'-{days} days')).fetchall()
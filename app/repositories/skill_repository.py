@@ -1,5 +1,11 @@
-from app.db import get_db
-from app.modelli import Skill, create_skill_from_row
+from flask import current_app
+
+from app.archive import delete_archived_for_skill
+from app.cache import cached
+from app.db import get_db, get_write_db
+from app.events import notify_changes
+from app.modelli import Skill, create_skill_from_row, level_for_xp
+from app.repositories.leaderboard_repository import LeaderboardRepository
 
 
 class SkillRepository:
@@ -15,13 +21,14 @@ class SkillRepository:
         Returns:
             int: ID della nuova skill
         """
-        db = get_db()
+        db = get_write_db()
         cursor = db.execute(
             '''INSERT INTO skills (name, description, target_level, category_id, user_id)
                VALUES (?, ?, ?, ?, ?)''',
             (name, description, target_level, category_id, user_id)
         )
         db.commit()
+        notify_changes()
         return cursor.lastrowid
 
     @staticmethod
@@ -37,7 +44,7 @@ class SkillRepository:
             SELECT s.*, c.name as category_name
             FROM skills s
             LEFT JOIN categories c ON s.category_id = c.id
-            WHERE s.id = ?
+            WHERE s.id = ? AND s.deleted_at IS NULL
         ''', (skill_id,)).fetchone()
 
         if row is None:
@@ -45,6 +52,7 @@ class SkillRepository:
         return create_skill_from_row(row)
 
     @staticmethod
+    @cached()
     def get_all_by_user(user_id):
         """
         Recupera tutte le skills di un utente.
@@ -57,13 +65,32 @@ class SkillRepository:
             SELECT s.*, c.name as category_name
             FROM skills s
             LEFT JOIN categories c ON s.category_id = c.id
-            WHERE s.user_id = ?
+            WHERE s.user_id = ? AND s.deleted_at IS NULL
             ORDER BY s.name
         ''', (user_id,)).fetchall()
 
         return [create_skill_from_row(row) for row in rows]
 
     @staticmethod
+    def get_page(user_id, columns, limit, after=None):
+        """
+        Una pagina delle skills dell'utente in ordine di ID, leggendo solo
+        le colonne richieste (paginazione per chiave: `after` = ultimo ID).
+
+        Returns:
+            list[sqlite3.Row]
+        """
+        db = get_db()
+        select = ', '.join(dict.fromkeys(('id', *columns)))
+        return db.execute(f'''
+            SELECT {select} FROM skills
+            WHERE user_id = ? AND deleted_at IS NULL AND id > ?
+            ORDER BY id
+            LIMIT ?
+        ''', (user_id, after or 0, limit)).fetchall()
+
+    @staticmethod
+    @cached()
     def get_by_category(category_id, user_id):
         """
         Recupera le skills di una specifica categoria.
@@ -76,7 +103,7 @@ class SkillRepository:
             SELECT s.*, c.name as category_name
             FROM skills s
             LEFT JOIN categories c ON s.category_id = c.id
-            WHERE s.category_id = ? AND s.user_id = ?
+            WHERE s.category_id = ? AND s.user_id = ? AND s.deleted_at IS NULL
             ORDER BY s.name
         ''', (category_id, user_id)).fetchall()
 
@@ -90,7 +117,7 @@ class SkillRepository:
         Returns:
             bool: True se aggiornata con successo
         """
-        db = get_db()
+        db = get_write_db()
         skill = SkillRepository.get_by_id(skill_id)
         if skill is None:
             return False
@@ -106,6 +133,8 @@ class SkillRepository:
             WHERE id = ?
         ''', (new_name, new_description, new_target_level, new_category_id, skill_id))
         db.commit()
+        LeaderboardRepository.refresh_current_user()
+        notify_changes()
         return True
 
     @staticmethod
@@ -116,29 +145,39 @@ class SkillRepository:
         Returns:
             dict: Informazioni sull'aggiornamento (level_up, new_level, etc.)
         """
-        db = get_db()
-        skill = SkillRepository.get_by_id(skill_id)
-        if skill is None:
+        db = get_write_db()
+        result = SkillRepository._apply_xp(db, skill_id, xp_amount)
+        db.commit()
+        LeaderboardRepository.refresh_current_user()
+        notify_changes()
+        return result
+
+    @staticmethod
+    def _apply_xp(db, skill_id, xp_amount):
+        """
+        Applica un incremento di XP sulla connessione data, senza commit.
+        Usato da add_xp e dalle scritture che aggiornano più tabelle
+        nella stessa transazione.
+
+        Returns:
+            dict o None se la skill non esiste
+        """
+        row = db.execute(
+            'SELECT total_xp, current_level FROM skills WHERE id = ?',
+            (skill_id,)
+        ).fetchone()
+        if row is None:
             return None
 
-        old_level = skill.current_level
-        new_total_xp = skill.total_xp + xp_amount
+        old_level = row['current_level']
+        new_total_xp = row['total_xp'] + xp_amount
 
         # Calcola il nuovo livello basandosi sugli XP totali
-        new_level = 1
-        xp_threshold = 0
-        while True:
-            xp_for_this_level = new_level * 100
-            if new_total_xp >= xp_threshold + xp_for_this_level:
-                xp_threshold += xp_for_this_level
-                new_level += 1
-            else:
-                break
+        new_level = level_for_xp(new_total_xp)
 
         db.execute('''
             UPDATE skills SET total_xp = ?, current_level = ? WHERE id = ?
         ''', (new_total_xp, new_level, skill_id))
-        db.commit()
 
         return {
             'old_level': old_level,
@@ -150,17 +189,31 @@ class SkillRepository:
     @staticmethod
     def delete(skill_id):
         """
-        Elimina una skill.
+        Elimina una skill e (ON DELETE CASCADE) le sue sessioni.
+        Con DEFERRED_DELETE_ENABLED la skill viene solo segnata come
+        eliminata: le sessioni sono rimosse a blocchi da app/purge.py.
 
         Returns:
             bool: True se eliminata con successo
         """
-        db = get_db()
+        db = get_write_db()
+        if current_app.config['DEFERRED_DELETE_ENABLED']:
+            db.execute('UPDATE skills SET deleted_at = CURRENT_TIMESTAMP WHERE id = ?', (skill_id,))
+            db.commit()
+            LeaderboardRepository.refresh_current_user()
+            notify_changes()
+            return True
+
+        if current_app.config['ARCHIVE_ENABLED']:
+            delete_archived_for_skill(db, skill_id)
         db.execute('DELETE FROM skills WHERE id = ?', (skill_id,))
         db.commit()
+        LeaderboardRepository.refresh_current_user()
+        notify_changes()
         return True
 
     @staticmethod
+    @cached()
     def get_stats_by_user(user_id):
         """
         Recupera statistiche aggregate per l'utente.
@@ -176,7 +229,7 @@ class SkillRepository:
                 COALESCE(AVG(current_level), 0) as avg_level,
                 COALESCE(MAX(current_level), 0) as max_level
             FROM skills
-            WHERE user_id = ?
+            WHERE user_id = ? AND deleted_at IS NULL
         ''', (user_id,)).fetchone()
 
         return {
@@ -1,11 +1,20 @@
-from app.db import get_db
+from flask import current_app
+
+from app.archive import delete_archived
+from app.db import get_directory_db, get_user_db
+from app.sharding import assign_user, delete_user_data
 from app.modelli import User, create_user_from_row
+from app.repositories.leaderboard_repository import LeaderboardRepository
+from app.sync import CHANGE_LOG_TABLES
 
 
 class UserRepository:
     """
     Repository per la gestione degli utenti nel database.
     Implementa il pattern Repository per separare la logica di accesso ai dati.
+
+    Gli utenti vivono sempre nel database principale (directory), anche
+    quando i dati delle skill sono distribuiti su più shard.
     """
 
     @staticmethod
@@ -16,12 +25,15 @@ class UserRepository:
         Returns:
             int: ID del nuovo utente
         """
-        db = get_db()
+        db = get_directory_db(write=True)
         cursor = db.execute(
             'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
             (username, email, password_hash)
         )
         db.commit()
+
+        if current_app.config['DB_SHARDS']:
+            assign_user(cursor.lastrowid)
         return cursor.lastrowid
 
     @staticmethod
@@ -32,9 +44,9 @@ class UserRepository:
         Returns:
             User o None
         """
-        db = get_db()
+        db = get_directory_db()
         row = db.execute(
-            'SELECT * FROM users WHERE id = ?',
+            'SELECT * FROM users WHERE id = ? AND deleted_at IS NULL',
             (user_id,)
         ).fetchone()
 
@@ -50,9 +62,9 @@ class UserRepository:
         Returns:
             User o None
         """
-        db = get_db()
+        db = get_directory_db()
         row = db.execute(
-            'SELECT * FROM users WHERE username = ?',
+            'SELECT * FROM users WHERE username = ? AND deleted_at IS NULL',
             (username,)
         ).fetchone()
 
@@ -68,9 +80,9 @@ class UserRepository:
         Returns:
             User o None
         """
-        db = get_db()
+        db = get_directory_db()
         row = db.execute(
-            'SELECT * FROM users WHERE email = ?',
+            'SELECT * FROM users WHERE email = ? AND deleted_at IS NULL',
             (email,)
         ).fetchone()
 
@@ -86,7 +98,7 @@ class UserRepository:
         Returns:
             bool: True se aggiornato con successo
         """
-        db = get_db()
+        db = get_directory_db(write=True)
         user = UserRepository.get_by_id(user_id)
         if user is None:
             return False
@@ -105,22 +117,40 @@ class UserRepository:
     @staticmethod
     def delete(user_id):
         """
-        Elimina un utente dal database.
+        Elimina un utente dal database con tutti i suoi dati (ON DELETE CASCADE).
+        Con DEFERRED_DELETE_ENABLED l'utente viene solo segnato come
+        eliminato (non può più accedere) e i dati sono rimossi a blocchi
+        da app/purge.py.
 
         Returns:
             bool: True se eliminato con successo
         """
-        db = get_db()
+        db = get_directory_db(write=True)
+        if current_app.config['DEFERRED_DELETE_ENABLED']:
+            LeaderboardRepository.leave(user_id)
+            db.execute('UPDATE users SET deleted_at = CURRENT_TIMESTAMP WHERE id = ?', (user_id,))
+            db.commit()
+            return True
+
+        if current_app.config['ARCHIVE_ENABLED']:
+            delete_archived(get_user_db(user_id, write=True), 'user_id', user_id)
+        if current_app.config['DB_SHARDS']:
+            delete_user_data(user_id)
+        LeaderboardRepository.leave(user_id)
         db.execute('DELETE FROM users WHERE id = ?', (user_id,))
+        # Il registro non ha chiavi esterne: le cascate vi scrivono ancora
+        for table in CHANGE_LOG_TABLES:
+            db.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
         db.commit()
         return True
 
     @staticmethod
     def exists_username(username):
         """
-        Verifica se esiste già un utente con questo username.
+        Verifica se esiste già un utente con questo username
+        (anche se in attesa di eliminazione: il vincolo UNIQUE vale ancora).
         """
-        db = get_db()
+        db = get_directory_db()
         row = db.execute(
             'SELECT 1 FROM users WHERE username = ?',
             (username,)
@@ -130,9 +160,10 @@ class UserRepository:
     @staticmethod
     def exists_email(email):
         """
-        Verifica se esiste già un utente con questa email.
+        Verifica se esiste già un utente con questa email
+        (anche se in attesa di eliminazione).
         """
-        db = get_db()
+        db = get_directory_db()
         row = db.execute(
             'SELECT 1 FROM users WHERE email = ?',
             (email,)
@@ -0,0 +1,172 @@
+"""
+Scheduler in-process per i job di manutenzione in background.
+
+I job vengono eseguiti da un thread daemon solo nei momenti di basso
+carico: nessuna richiesta in corso da almeno SCHEDULER_IDLE_SECONDS.
+Il thread parte alla prima richiesta del processo (quindi anche dopo il
+fork dei worker) e solo se almeno un job è registrato.
+
+Con più processi (worker di flask serve, più server sugli stessi file) i
+job sui database girano in un solo processo alla volta: ognuno prende un
+lock su file in SCHEDULER_LOCK_DIR, dove è salvato anche l'ultimo avvio,
+quindi un job viene eseguito una volta per intervallo in tutto il
+sistema, dal primo processo inattivo. I job `per_process` (scrittura su
+file delle metriche e dei profili del processo) girano in ogni processo.
+"""
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: nessun lock tra processi
+    fcntl = None
+
+
+class _ScheduledJob:
+    __slots__ = ('name', 'interval', 'fn', 'per_process', 'last_run')
+
+    def __init__(self, name, interval, fn, per_process):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.per_process = per_process
+        self.last_run = None
+
+
+class Scheduler:
+    """
+    Esegue funzioni a intervalli regolari quando il processo è inattivo.
+    """
+
+    def __init__(self, app, idle_seconds=5, poll_seconds=1.0, lock_dir=None):
+        self.app = app
+        self.idle_seconds = idle_seconds
+        self.poll_seconds = poll_seconds
+        self.lock_dir = lock_dir
+        self.jobs = []
+        self._in_flight = 0
+        self._last_request = time.monotonic()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def add_job(self, name, interval, fn, per_process=False):
+        """
+        Registra un job: `fn()` verrà eseguita dentro un app context
+        al massimo ogni `interval` secondi, in un solo processo alla volta
+        oppure, con `per_process`, in ogni processo.
+        """
+        self.jobs.append(_ScheduledJob(name, interval, fn, per_process))
+
+    # ------------------------------------------------------------------
+    # Rilevamento del carico
+    # ------------------------------------------------------------------
+
+    def request_started(self):
+        with self._lock:
+            self._in_flight += 1
+            self._last_request = time.monotonic()
+
+    def request_finished(self, exc=None):
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._last_request = time.monotonic()
+
+    def is_idle(self):
+        """
+        True se non ci sono richieste in corso da almeno idle_seconds.
+        """
+        with self._lock:
+            return (self._in_flight == 0
+                    and time.monotonic() - self._last_request >= self.idle_seconds)
+
+    # ------------------------------------------------------------------
+    # Esecuzione
+    # ------------------------------------------------------------------
+
+    def ensure_started(self):
+        if not self.jobs or (self._thread is not None and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run,
+                                                name='maintenance-scheduler',
+                                                daemon=True)
+                self._thread.start()
+
+    def run_due_jobs(self):
+        """
+        Esegue i job scaduti finché il processo resta inattivo.
+        """
+        for job in self.jobs:
+            if not self.is_idle():
+                return
+            if job.last_run is not None and time.monotonic() - job.last_run < job.interval:
+                continue
+            job.last_run = time.monotonic()
+            if job.per_process or self.lock_dir is None or fcntl is None:
+                self._execute(job)
+            else:
+                self._execute_shared(job)
+
+    def _execute(self, job):
+        with self.app.app_context():
+            try:
+                job.fn()
+            except Exception:
+                self.app.logger.exception('Job di manutenzione "%s" fallito', job.name)
+
+    def _execute_shared(self, job):
+        """
+        Esegue il job tenendo il suo lock su file, se nessun altro processo
+        lo sta eseguendo e se l'ultimo avvio registrato (da qualsiasi
+        processo) risale ad almeno `interval` secondi fa.
+        """
+        os.makedirs(self.lock_dir, exist_ok=True)
+        with open(os.path.join(self.lock_dir, f'{job.name}.lock'), 'a+') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            f.seek(0)
+            try:
+                last_run = float(f.read() or 0)
+            except ValueError:
+                last_run = 0
+            elapsed = time.time() - last_run
+            if elapsed < job.interval:
+                # Eseguito da un altro processo: prossimo controllo alla sua scadenza
+                job.last_run = time.monotonic() - elapsed
+                return
+            f.seek(0)
+            f.truncate()
+            f.write(str(time.time()))
+            f.flush()
+            self._execute(job)
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            self.run_due_jobs()
+
+
+def get_scheduler(app):
+    return app.extensions['scheduler']
+
+
+def init_app(app):
+    """
+    Crea lo scheduler e registra gli hook che misurano il carico.
+    """
+    scheduler = Scheduler(app, idle_seconds=app.config['SCHEDULER_IDLE_SECONDS'],
+                          lock_dir=app.config['SCHEDULER_LOCK_DIR'])
+    app.extensions['scheduler'] = scheduler
+
+    @app.before_request
+    def track_request_start():
+        scheduler.ensure_started()
+        scheduler.request_started()
+
+    app.teardown_request(scheduler.request_finished)
@@ -1,3 +1,22 @@
+-- Vacuum incrementale (effettivo solo su un database nuovo o dopo un VACUUM completo)
+PRAGMA auto_vacuum = INCREMENTAL;
+
+DROP TABLE IF EXISTS change_log_paused;
+DROP TABLE IF EXISTS change_log_state;
+DROP TABLE IF EXISTS change_log;
+DROP TABLE IF EXISTS idempotency_keys;
+DROP TABLE IF EXISTS api_tokens;
+DROP TABLE IF EXISTS user_shards;
+DROP TABLE IF EXISTS leaderboard_sizes;
+DROP TABLE IF EXISTS leaderboard_buckets;
+DROP TABLE IF EXISTS leaderboard_weekly;
+DROP TABLE IF EXISTS leaderboard_categories;
+DROP TABLE IF EXISTS leaderboard_totals;
+DROP TABLE IF EXISTS leaderboard_members;
+DROP TABLE IF EXISTS data_versions;
+DROP TABLE IF EXISTS skill_versions;
+DROP TABLE IF EXISTS cache_versions;
+DROP TABLE IF EXISTS session_archive_rollups;
 DROP TABLE IF EXISTS sessions;
 DROP TABLE IF EXISTS skills;
 DROP TABLE IF EXISTS categories;
@@ -8,9 +27,216 @@ CREATE TABLE users (
     username TEXT UNIQUE NOT NULL,
     email TEXT UNIQUE NOT NULL,
     password_hash TEXT NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Eliminazione differita (DEFERRED_DELETE_ENABLED): nascosto subito, rimosso da app/purge.py
+    deleted_at TIMESTAMP
+);
+
+-- Assegnazione utente -> shard (usata solo con DB_SHARDS > 0, nel database principale)
+CREATE TABLE user_shards (
+    user_id INTEGER PRIMARY KEY,
+    shard INTEGER NOT NULL,
+    -- 1 mentre flask shard-move copia i dati: le scritture rispondono 503
+    moving INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+
+-- Token dell'API JSON (/api/v1), salvati come impronta SHA-256
+CREATE TABLE api_tokens (
+    token_hash TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    name TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+
+-- Chiavi di idempotenza delle richieste di scrittura (app/idempotency.py),
+-- nel file dei dati dell'utente e inserite nella transazione delle sue
+-- scritture: status NULL = esito non ancora salvato, poi l'esito da
+-- restituire alle ripetizioni
+CREATE TABLE idempotency_keys (
+    user_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    request TEXT NOT NULL,          -- metodo e percorso
+    status INTEGER,
+    location TEXT,
+    content_type TEXT,
+    body BLOB,                      -- compresso con zlib
+    created_at INTEGER NOT NULL,    -- secondi Unix, per la scadenza
+    PRIMARY KEY (user_id, key),
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+-- Classifiche (LEADERBOARDS_ENABLED, nel database principale).
+-- Contengono solo gli utenti che hanno scelto di partecipare e sono
+-- aggiornate a ogni scrittura: i ranghi si leggono dagli indici.
+CREATE TABLE leaderboard_members (
+    user_id INTEGER PRIMARY KEY,
+    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+
+CREATE TABLE leaderboard_totals (
+    user_id INTEGER PRIMARY KEY,
+    total_xp INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
 );
 
+CREATE TABLE leaderboard_categories (
+    category TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    total_xp INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (category, user_id),
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+
+-- XP guadagnati per settimana (week = data del lunedì, YYYY-MM-DD)
+CREATE TABLE leaderboard_weekly (
+    week TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    xp INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (week, user_id),
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+
+-- Partecipanti per fascia di punteggio di ogni classifica (partition =
+-- '' per quella totale, la categoria o la settimana per le altre) e loro
+-- numero complessivo, mantenuti dai trigger. La posizione di un utente è
+-- la somma delle fasce sopra la sua più i punteggi maggiori nella sua
+-- fascia. Fascia: numero di cifre * 100 + prime due cifre del punteggio
+-- (0 se <= 0), quindi al più qualche centinaio di righe per classifica
+CREATE TABLE leaderboard_buckets (
+    board TEXT NOT NULL,
+    partition TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    participants INTEGER NOT NULL,
+    PRIMARY KEY (board, partition, bucket)
+) WITHOUT ROWID;
+
+CREATE TABLE leaderboard_sizes (
+    board TEXT NOT NULL,
+    partition TEXT NOT NULL,
+    participants INTEGER NOT NULL,
+    PRIMARY KEY (board, partition)
+) WITHOUT ROWID;
+
+CREATE TRIGGER leaderboard_totals_bucket_insert AFTER INSERT ON leaderboard_totals
+BEGIN
+    INSERT INTO leaderboard_buckets (board, partition, bucket, participants)
+    VALUES ('total', '',
+            CASE WHEN NEW.total_xp <= 0 THEN 0
+                 ELSE length(NEW.total_xp) * 100 + CAST(substr(NEW.total_xp || '0', 1, 2) AS INTEGER) END, 1)
+    ON CONFLICT(board, partition, bucket) DO UPDATE SET participants = participants + excluded.participants;
+    INSERT INTO leaderboard_sizes (board, partition, participants) VALUES ('total', '', 1)
+    ON CONFLICT(board, partition) DO UPDATE SET participants = participants + excluded.participants;
+END;
+
+CREATE TRIGGER leaderboard_totals_bucket_update AFTER UPDATE OF total_xp ON leaderboard_totals
+BEGIN
+    INSERT INTO leaderboard_buckets (board, partition, bucket, participants)
+    VALUES ('total', '',
+            CASE WHEN OLD.total_xp <= 0 THEN 0
+                 ELSE length(OLD.total_xp) * 100 + CAST(substr(OLD.total_xp || '0', 1, 2) AS INTEGER) END, -1)
+    ON CONFLICT(board, partition, bucket) DO UPDATE SET participants = participants + excluded.participants;
+    INSERT INTO leaderboard_buckets (board, partition, bucket, participants)
+    VALUES ('total', '',
+            CASE WHEN NEW.total_xp <= 0 THEN 0
+                 ELSE length(NEW.total_xp) * 100 + CAST(substr(NEW.total_xp || '0', 1, 2) AS INTEGER) END, 1)
+    ON CONFLICT(board, partition, bucket) DO UPDATE SET participants = participants + excluded.participants;
+    DELETE FROM leaderboard_buckets WHERE board = 'total' AND partition = '' AND participants = 0;
+END;
+
+CREATE TRIGGER leaderboard_totals_bucket_delete AFTER DELETE ON leaderboard_totals
+BEGIN
+    INSERT INTO leaderboard_buckets (board, partition, bucket, participants)
+    VALUES ('total', '',
+            CASE WHEN OLD.total_xp <= 0 THEN 0
+                 ELSE length(OLD.total_xp) * 100 + CAST(substr(OLD.total_xp || '0', 1, 2) AS INTEGER) END, -1)
+    ON CONFLICT(board, partition, bucket) DO UPDATE SET participants = participants + excluded.participants;
+    INSERT INTO leaderboard_sizes (board, partition, participants) VALUES ('total', '', -1)
+    ON CONFLICT(board, partition) DO UPDATE SET participants = participants + excluded.participants;
+    DELETE FROM leaderboard_buckets WHERE board = 'total' AND partition = '' AND participants = 0;
+    DELETE FROM leaderboard_sizes WHERE board = 'total' AND partition = '' AND participants = 0;
+END;
+
+CREATE TRIGGER leaderboard_categories_bucket_insert AFTER INSERT ON leaderboard_categories
+BEGIN
+    INSERT INTO leaderboard_buckets (board, partition, bucket, participants)
+    VALUES ('category', NEW.category,
+            CASE WHEN NEW.total_xp <= 0 THEN 0
+                 ELSE length(NEW.total_xp) * 100 + CAST(substr(NEW.total_xp || '0', 1, 2) AS INTEGER) END, 1)
+    ON CONFLICT(board, partition, bucket) DO UPDATE SET participants = participants + excluded.participants;
+    INSERT INTO leaderboard_sizes (board, partition, participants) VALUES ('category', NEW.category, 1)
+    ON CONFLICT(board, partition) DO UPDATE SET participants = participants + excluded.participants;
+END;
+
+CREATE TRIGGER leaderboard_categories_bucket_update AFTER UPDATE OF total_xp ON leaderboard_categories
+BEGIN
+    INSERT INTO leaderboard_buckets (board, partition, bucket, participants)
+    VALUES ('category', OLD.category,
+            CASE WHEN OLD.total_xp <= 0 THEN 0
+                 ELSE length(OLD.total_xp) * 100 + CAST(substr(OLD.total_xp || '0', 1, 2) AS INTEGER) END, -1)
+    ON CONFLICT(board, partition, bucket) DO UPDATE SET participants = participants + excluded.participants;
+    INSERT INTO leaderboard_buckets (board, partition, bucket, participants)
+    VALUES ('category', NEW.category,
+            CASE WHEN NEW.total_xp <= 0 THEN 0
+                 ELSE length(NEW.total_xp) * 100 + CAST(substr(NEW.total_xp || '0', 1, 2) AS INTEGER) END, 1)
+    ON CONFLICT(board, partition, bucket) DO UPDATE SET participants = participants + excluded.participants;
+    DELETE FROM leaderboard_buckets WHERE board = 'category' AND partition = OLD.category AND participants = 0;
+END;
+
+CREATE TRIGGER leaderboard_categories_bucket_delete AFTER DELETE ON leaderboard_categories
+BEGIN
+    INSERT INTO leaderboard_buckets (board, partition, bucket, participants)
+    VALUES ('category', OLD.category,
+            CASE WHEN OLD.total_xp <= 0 THEN 0
+                 ELSE length(OLD.total_xp) * 100 + CAST(substr(OLD.total_xp || '0', 1, 2) AS INTEGER) END, -1)
+    ON CONFLICT(board, partition, bucket) DO UPDATE SET participants = participants + excluded.participants;
+    INSERT INTO leaderboard_sizes (board, partition, participants) VALUES ('category', OLD.category, -1)
+    ON CONFLICT(board, partition) DO UPDATE SET participants = participants + excluded.participants;
+    DELETE FROM leaderboard_buckets WHERE board = 'category' AND partition = OLD.category AND participants = 0;
+    DELETE FROM leaderboard_sizes WHERE board = 'category' AND partition = OLD.category AND participants = 0;
+END;
+
+CREATE TRIGGER leaderboard_weekly_bucket_insert AFTER INSERT ON leaderboard_weekly
+BEGIN
+    INSERT INTO leaderboard_buckets (board, partition, bucket, participants)
+    VALUES ('week', NEW.week,
+            CASE WHEN NEW.xp <= 0 THEN 0
+                 ELSE length(NEW.xp) * 100 + CAST(substr(NEW.xp || '0', 1, 2) AS INTEGER) END, 1)
+    ON CONFLICT(board, partition, bucket) DO UPDATE SET participants = participants + excluded.participants;
+    INSERT INTO leaderboard_sizes (board, partition, participants) VALUES ('week', NEW.week, 1)
+    ON CONFLICT(board, partition) DO UPDATE SET participants = participants + excluded.participants;
+END;
+
+CREATE TRIGGER leaderboard_weekly_bucket_update AFTER UPDATE OF xp ON leaderboard_weekly
+BEGIN
+    INSERT INTO leaderboard_buckets (board, partition, bucket, participants)
+    VALUES ('week', OLD.week,
+            CASE WHEN OLD.xp <= 0 THEN 0
+                 ELSE length(OLD.xp) * 100 + CAST(substr(OLD.xp || '0', 1, 2) AS INTEGER) END, -1)
+    ON CONFLICT(board, partition, bucket) DO UPDATE SET participants = participants + excluded.participants;
+    INSERT INTO leaderboard_buckets (board, partition, bucket, participants)
+    VALUES ('week', NEW.week,
+            CASE WHEN NEW.xp <= 0 THEN 0
+                 ELSE length(NEW.xp) * 100 + CAST(substr(NEW.xp || '0', 1, 2) AS INTEGER) END, 1)
+    ON CONFLICT(board, partition, bucket) DO UPDATE SET participants = participants + excluded.participants;
+    DELETE FROM leaderboard_buckets WHERE board = 'week' AND partition = OLD.week AND participants = 0;
+END;
+
+CREATE TRIGGER leaderboard_weekly_bucket_delete AFTER DELETE ON leaderboard_weekly
+BEGIN
+    INSERT INTO leaderboard_buckets (board, partition, bucket, participants)
+    VALUES ('week', OLD.week,
+            CASE WHEN OLD.xp <= 0 THEN 0
+                 ELSE length(OLD.xp) * 100 + CAST(substr(OLD.xp || '0', 1, 2) AS INTEGER) END, -1)
+    ON CONFLICT(board, partition, bucket) DO UPDATE SET participants = participants + excluded.participants;
+    INSERT INTO leaderboard_sizes (board, partition, participants) VALUES ('week', OLD.week, -1)
+    ON CONFLICT(board, partition) DO UPDATE SET participants = participants + excluded.participants;
+    DELETE FROM leaderboard_buckets WHERE board = 'week' AND partition = OLD.week AND participants = 0;
+    DELETE FROM leaderboard_sizes WHERE board = 'week' AND partition = OLD.week AND participants = 0;
+END;
+
 CREATE TABLE categories (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     name TEXT NOT NULL,
@@ -29,6 +255,7 @@ CREATE TABLE skills (
     category_id INTEGER,
     user_id INTEGER NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    deleted_at TIMESTAMP,
     FOREIGN KEY (category_id) REFERENCES categories (id) ON DELETE SET NULL,
     FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
 );
@@ -42,11 +269,276 @@ CREATE TABLE sessions (
     notes TEXT,
     user_id INTEGER NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- XP totali e livello della skill dopo questa sessione (in ordine di data, id)
+    cumulative_xp INTEGER NOT NULL DEFAULT 0,
+    level_after INTEGER NOT NULL DEFAULT 1,
     FOREIGN KEY (skill_id) REFERENCES skills (id) ON DELETE CASCADE,
     FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
 );
 
+-- Totali delle sessioni spostate nell'archivio (ARCHIVE_ENABLED), per utente
+CREATE TABLE session_archive_rollups (
+    user_id INTEGER PRIMARY KEY,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    minutes INTEGER NOT NULL DEFAULT 0,
+    xp INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+
+-- Versione dei dati di sessione di ogni utente e di ogni skill, incrementata
+-- dai trigger (usata per invalidare statistiche e previsioni in cache)
+CREATE TABLE data_versions (
+    user_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE skill_versions (
+    skill_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+-- I trigger di modifica delle sessioni ignorano cumulative_xp e level_after:
+-- li riscrive SessionRepository._recompute_history dopo ogni scrittura,
+-- anche sulle sessioni successive della skill, che non sono cambiate
+CREATE TRIGGER sessions_version_insert AFTER INSERT ON sessions
+BEGIN
+    INSERT INTO data_versions (user_id, version) VALUES (NEW.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+    INSERT INTO skill_versions (skill_id, version) VALUES (NEW.skill_id, 1)
+    ON CONFLICT(skill_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER sessions_version_update AFTER UPDATE OF skill_id, date, duration_minutes, xp_gained, notes ON sessions
+BEGIN
+    INSERT INTO data_versions (user_id, version) VALUES (NEW.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+    INSERT INTO skill_versions (skill_id, version) VALUES (OLD.skill_id, 1)
+    ON CONFLICT(skill_id) DO UPDATE SET version = version + 1;
+    INSERT INTO skill_versions (skill_id, version)
+    SELECT NEW.skill_id, 1 WHERE NEW.skill_id != OLD.skill_id
+    ON CONFLICT(skill_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER sessions_version_delete AFTER DELETE ON sessions
+BEGIN
+    INSERT INTO data_versions (user_id, version) VALUES (OLD.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+    INSERT INTO skill_versions (skill_id, version) VALUES (OLD.skill_id, 1)
+    ON CONFLICT(skill_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER skills_version_update AFTER UPDATE ON skills
+BEGIN
+    INSERT INTO skill_versions (skill_id, version) VALUES (NEW.id, 1)
+    ON CONFLICT(skill_id) DO UPDATE SET version = version + 1;
+END;
+
+-- Una skill segnata come eliminata sparisce dalle statistiche dell'utente
+CREATE TRIGGER skills_deleted AFTER UPDATE OF deleted_at ON skills
+BEGIN
+    INSERT INTO data_versions (user_id, version) VALUES (NEW.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+END;
+
+-- Versione di tutti i dati di ogni utente (categorie, skills, sessioni),
+-- incrementata dai trigger: fa parte delle chiavi della cache dei
+-- repository (app/cache.py), quindi ogni scrittura la invalida
+CREATE TABLE cache_versions (
+    user_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER categories_cache_insert AFTER INSERT ON categories
+BEGIN
+    INSERT INTO cache_versions (user_id, version) VALUES (NEW.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER categories_cache_update AFTER UPDATE ON categories
+BEGIN
+    INSERT INTO cache_versions (user_id, version) VALUES (NEW.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER categories_cache_delete AFTER DELETE ON categories
+BEGIN
+    INSERT INTO cache_versions (user_id, version) VALUES (OLD.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER skills_cache_insert AFTER INSERT ON skills
+BEGIN
+    INSERT INTO cache_versions (user_id, version) VALUES (NEW.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER skills_cache_update AFTER UPDATE ON skills
+BEGIN
+    INSERT INTO cache_versions (user_id, version) VALUES (NEW.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER skills_cache_delete AFTER DELETE ON skills
+BEGIN
+    INSERT INTO cache_versions (user_id, version) VALUES (OLD.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER sessions_cache_insert AFTER INSERT ON sessions
+BEGIN
+    INSERT INTO cache_versions (user_id, version) VALUES (NEW.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER sessions_cache_update AFTER UPDATE OF skill_id, date, duration_minutes, xp_gained, notes ON sessions
+BEGIN
+    INSERT INTO cache_versions (user_id, version) VALUES (NEW.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER sessions_cache_delete AFTER DELETE ON sessions
+BEGIN
+    INSERT INTO cache_versions (user_id, version) VALUES (OLD.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+END;
+
+-- Registro delle modifiche per la sincronizzazione (/api/v1/sync), scritto
+-- dai trigger: una riga per inserimento/modifica/eliminazione di categorie,
+-- skills e sessioni, con una sequenza per utente. Compattato da app/sync.py.
+CREATE TABLE change_log (
+    user_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    entity TEXT NOT NULL,           -- 'category', 'skill', 'session'
+    entity_id INTEGER NOT NULL,
+    op TEXT NOT NULL,               -- 'upsert', 'delete'
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, seq)
+) WITHOUT ROWID;
+
+-- Ultima sequenza assegnata e orizzonte: le eliminazioni con seq <= horizon
+-- sono state compattate, chi sincronizza da prima deve riscaricare tutto
+CREATE TABLE change_log_state (
+    user_id INTEGER PRIMARY KEY,
+    seq INTEGER NOT NULL DEFAULT 0,
+    horizon INTEGER NOT NULL DEFAULT 0
+);
+
+-- Una riga qui (solo dentro una transazione) sospende il registro:
+-- archiviazione e spostamento tra shard non sono modifiche per i client
+CREATE TABLE change_log_paused (
+    paused INTEGER PRIMARY KEY
+);
+
+CREATE TRIGGER categories_changes_insert AFTER INSERT ON categories
+WHEN NOT EXISTS (SELECT 1 FROM change_log_paused)
+BEGIN
+    INSERT INTO change_log_state (user_id, seq) VALUES (NEW.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET seq = seq + 1;
+    INSERT INTO change_log (user_id, seq, entity, entity_id, op)
+    SELECT user_id, seq, 'category', NEW.id, 'upsert'
+    FROM change_log_state WHERE user_id = NEW.user_id;
+END;
+
+CREATE TRIGGER categories_changes_update AFTER UPDATE ON categories
+WHEN NOT EXISTS (SELECT 1 FROM change_log_paused)
+BEGIN
+    INSERT INTO change_log_state (user_id, seq) VALUES (NEW.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET seq = seq + 1;
+    INSERT INTO change_log (user_id, seq, entity, entity_id, op)
+    SELECT user_id, seq, 'category', NEW.id, 'upsert'
+    FROM change_log_state WHERE user_id = NEW.user_id;
+END;
+
+CREATE TRIGGER categories_changes_delete AFTER DELETE ON categories
+WHEN NOT EXISTS (SELECT 1 FROM change_log_paused)
+BEGIN
+    INSERT INTO change_log_state (user_id, seq) VALUES (OLD.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET seq = seq + 1;
+    INSERT INTO change_log (user_id, seq, entity, entity_id, op)
+    SELECT user_id, seq, 'category', OLD.id, 'delete'
+    FROM change_log_state WHERE user_id = OLD.user_id;
+END;
+
+CREATE TRIGGER skills_changes_insert AFTER INSERT ON skills
+WHEN NOT EXISTS (SELECT 1 FROM change_log_paused)
+BEGIN
+    INSERT INTO change_log_state (user_id, seq) VALUES (NEW.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET seq = seq + 1;
+    INSERT INTO change_log (user_id, seq, entity, entity_id, op)
+    SELECT user_id, seq, 'skill', NEW.id, 'upsert'
+    FROM change_log_state WHERE user_id = NEW.user_id;
+END;
+
+CREATE TRIGGER skills_changes_update AFTER UPDATE ON skills
+WHEN NOT EXISTS (SELECT 1 FROM change_log_paused)
+BEGIN
+    INSERT INTO change_log_state (user_id, seq) VALUES (NEW.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET seq = seq + 1;
+    INSERT INTO change_log (user_id, seq, entity, entity_id, op)
+    SELECT user_id, seq, 'skill', NEW.id, CASE WHEN NEW.deleted_at IS NULL THEN 'upsert' ELSE 'delete' END
+    FROM change_log_state WHERE user_id = NEW.user_id;
+END;
+
+CREATE TRIGGER skills_changes_delete AFTER DELETE ON skills
+WHEN NOT EXISTS (SELECT 1 FROM change_log_paused)
+BEGIN
+    INSERT INTO change_log_state (user_id, seq) VALUES (OLD.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET seq = seq + 1;
+    INSERT INTO change_log (user_id, seq, entity, entity_id, op)
+    SELECT user_id, seq, 'skill', OLD.id, 'delete'
+    FROM change_log_state WHERE user_id = OLD.user_id;
+END;
+
+CREATE TRIGGER sessions_changes_insert AFTER INSERT ON sessions
+WHEN NOT EXISTS (SELECT 1 FROM change_log_paused)
+BEGIN
+    INSERT INTO change_log_state (user_id, seq) VALUES (NEW.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET seq = seq + 1;
+    INSERT INTO change_log (user_id, seq, entity, entity_id, op)
+    SELECT user_id, seq, 'session', NEW.id, 'upsert'
+    FROM change_log_state WHERE user_id = NEW.user_id;
+END;
+
+CREATE TRIGGER sessions_changes_update AFTER UPDATE OF skill_id, date, duration_minutes, xp_gained, notes ON sessions
+WHEN NOT EXISTS (SELECT 1 FROM change_log_paused)
+BEGIN
+    INSERT INTO change_log_state (user_id, seq) VALUES (NEW.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET seq = seq + 1;
+    INSERT INTO change_log (user_id, seq, entity, entity_id, op)
+    SELECT user_id, seq, 'session', NEW.id, 'upsert'
+    FROM change_log_state WHERE user_id = NEW.user_id;
+END;
+
+CREATE TRIGGER sessions_changes_delete AFTER DELETE ON sessions
+WHEN NOT EXISTS (SELECT 1 FROM change_log_paused)
+BEGIN
+    INSERT INTO change_log_state (user_id, seq) VALUES (OLD.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET seq = seq + 1;
+    INSERT INTO change_log (user_id, seq, entity, entity_id, op)
+    SELECT user_id, seq, 'session', OLD.id, 'delete'
+    FROM change_log_state WHERE user_id = OLD.user_id;
+END;
+
 CREATE INDEX idx_skills_user ON skills(user_id);
+-- Le entità in attesa di eliminazione sono poche: indici parziali
+CREATE INDEX idx_skills_deleted ON skills(id) WHERE deleted_at IS NOT NULL;
+CREATE INDEX idx_users_deleted ON users(id) WHERE deleted_at IS NOT NULL;
+-- Necessario alle cascate delle chiavi esterne (eliminazione di un utente)
+CREATE INDEX idx_categories_user ON categories(user_id);
 CREATE INDEX idx_skills_category ON skills(category_id);
-CREATE INDEX idx_sessions_skill ON sessions(skill_id);
-CREATE INDEX idx_sessions_date ON sessions(date);
\ No newline at end of file
+CREATE INDEX idx_sessions_skill ON sessions(skill_id, date, id);
+CREATE INDEX idx_sessions_date ON sessions(date);
+-- Copre la query delle statistiche di pratica (app/analytics.py)
+CREATE INDEX idx_sessions_user_date ON sessions(user_id, date, skill_id, duration_minutes, xp_gained);
+CREATE INDEX idx_user_shards_shard ON user_shards(shard);
+CREATE INDEX idx_api_tokens_user ON api_tokens(user_id);
+CREATE INDEX idx_idempotency_keys_created ON idempotency_keys(created_at);
+-- Paginazione per chiave (date, id) delle sessioni di un utente (API)
+CREATE INDEX idx_sessions_user_keyset ON sessions(user_id, date, id);
+-- Compattazione del registro: ultima modifica di ogni entità
+CREATE INDEX idx_change_log_entity ON change_log(user_id, entity, entity_id, seq);
+CREATE INDEX idx_leaderboard_totals_rank ON leaderboard_totals(total_xp DESC, user_id);
+CREATE INDEX idx_leaderboard_categories_rank ON leaderboard_categories(category, total_xp DESC, user_id);
+CREATE INDEX idx_leaderboard_categories_user ON leaderboard_categories(user_id);
+CREATE INDEX idx_leaderboard_weekly_rank ON leaderboard_weekly(week, xp DESC, user_id);
+CREATE INDEX idx_leaderboard_weekly_user ON leaderboard_weekly(user_id);
@@ -0,0 +1,447 @@
+"""
+Server di produzione: processi worker preforkati, ognuno con un pool di thread.
+
+Il processo master apre il socket in ascolto e crea SERVE_WORKERS worker
+con fork; ogni worker crea la propria app, la scalda (template compilati,
+mappa degli URL, schema dei database letto) e solo dopo inizia ad accettare
+connessioni sul socket condiviso. Le connessioni accettate passano per una
+coda limitata (SERVE_QUEUE_SIZE) a SERVE_THREADS thread: a coda piena il
+worker risponde subito 503 invece di accumulare richieste che scadrebbero.
+Gli stream /events (EVENTS_ENABLED) restano aperti per tutta la durata
+della dashboard: vengono riconosciuti dalla riga della richiesta e
+serviti da thread dedicati, al massimo SERVE_STREAMS per worker, senza
+occupare i thread del pool.
+
+Ricaricamento senza interruzioni (SIGHUP al master): viene creata una
+nuova generazione di worker, che rilegge instance/config.py, e i vecchi
+worker vengono fermati solo quando i nuovi sono pronti; i vecchi smettono
+di accettare connessioni e completano quelle già ricevute. Il socket resta
+sempre aperto nel master, quindi nessuna connessione viene rifiutata.
+Il codice Python è quello caricato all'avvio del master: per aggiornarlo
+serve un riavvio completo.
+
+Solo sistemi POSIX (Linux, macOS). Uso:
+    python -m app.serve [--host 0.0.0.0] [--port 8000] [--workers 4]
+    flask serve
+"""
+import os
+import queue
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+
+import click
+from flask import current_app, url_for
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+# Risposta inviata quando la coda del worker è piena
+_BUSY_RESPONSE = (b'HTTP/1.1 503 Service Unavailable\r\n'
+                  b'Retry-After: 1\r\n'
+                  b'Content-Length: 0\r\n'
+                  b'Connection: close\r\n\r\n')
+
+
+class _RequestHandler(WSGIRequestHandler):
+    # Una richiesta per connessione: un keep-alive inattivo terrebbe
+    # occupato un thread del pool
+    protocol_version = 'HTTP/1.0'
+
+    def log_request(self, code='-', size='-'):
+        if self.server.access_log:
+            super().log_request(code, size)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    Server WSGI di Werkzeug su un socket già aperto, con un numero fisso di
+    thread e una coda limitata di connessioni accettate.
+    """
+
+    multithread = True
+
+    # Attesa massima della riga della richiesta per riconoscere uno stream
+    PEEK_TIMEOUT = 5
+
+    def __init__(self, app, fd, threads=8, queue_size=64, access_log=False,
+                 stream_paths=(), max_streams=0):
+        listener = socket.socket(fileno=os.dup(fd))
+        try:
+            host, port = listener.getsockname()[:2]
+        finally:
+            listener.close()
+        super().__init__(host, port, app, handler=_RequestHandler, fd=fd)
+        self.access_log = access_log
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stream_prefixes = tuple(f'GET {path}'.encode('ascii') for path in stream_paths)
+        self._stream_slots = threading.BoundedSemaphore(max_streams) if max_streams else None
+        self._streams = 0
+        self._streams_lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._work, name=f'serve-{i}', daemon=True)
+                         for i in range(threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def process_request(self, request, client_address):
+        try:
+            self._queue.put_nowait((request, client_address))
+        except queue.Full:
+            try:
+                request.sendall(_BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def stats(self):
+        """
+        Returns:
+            dict: threads (dimensione del pool) e queued (connessioni in coda)
+        """
+        return {'threads': len(self._threads), 'queued': self._queue.qsize(), 'streams': self._streams}
+
+    def _is_stream(self, request):
+        """
+        True se la richiesta è per uno stream (GET su uno dei percorsi
+        indicati): legge la riga della richiesta senza consumarla.
+        """
+        if not self._stream_prefixes:
+            return False
+        size = max(len(prefix) for prefix in self._stream_prefixes) + 1
+        try:
+            request.settimeout(self.PEEK_TIMEOUT)
+            head = request.recv(size, socket.MSG_PEEK | socket.MSG_WAITALL)
+        except OSError:
+            return False
+        finally:
+            request.settimeout(None)
+        return any(head.startswith(prefix) and head[len(prefix):len(prefix) + 1] in (b' ', b'?')
+                   for prefix in self._stream_prefixes)
+
+    def _start_stream(self, request, client_address):
+        """
+        Serve uno stream su un thread dedicato; oltre SERVE_STREAMS stream
+        aperti risponde 503.
+        """
+        if not self._stream_slots.acquire(blocking=False):
+            try:
+                request.sendall(_BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        with self._streams_lock:
+            self._streams += 1
+        threading.Thread(target=self._serve_stream, args=(request, client_address),
+                         name='serve-stream', daemon=True).start()
+
+    def _serve_stream(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._streams_lock:
+                self._streams -= 1
+            self._stream_slots.release()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address = item
+            if self._stream_slots is not None and self._is_stream(request):
+                self._start_stream(request, client_address)
+                continue
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def drain(self, timeout):
+        """
+        Completa le connessioni già accettate (da chiamare dopo che
+        serve_forever è terminato) aspettando al massimo `timeout` secondi.
+        Gli stream non vengono attesi: si chiudono con il processo e il
+        browser si ricollega a un altro worker.
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+
+def warm_up(app):
+    """
+    Prepara un worker prima che accetti traffico: compila tutti i template
+    (o li legge dalla cache del bytecode) e la mappa degli URL, importa i
+    sottosistemi lazy, legge lo schema dei database (file nella cache del
+    sistema operativo) ed esegue una richiesta interna.
+    """
+    from app.startup import precompile_templates, preload
+    precompile_templates(app)
+    preload()
+    app.url_map.update()
+
+    from app.db import connect
+    from app.maintenance import database_paths
+    with app.app_context():
+        for path in database_paths():
+            if os.path.exists(path):
+                db = connect(path, read_only=True)
+                db.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+                db.close()
+
+    app.test_client().get('/auth/login')
+
+
+def _worker(factory, listen_fd, ready_fd):
+    """
+    Corpo di un processo worker (dopo il fork): non ritorna.
+    """
+    # Ctrl+C arriva a tutto il gruppo di processi: lo gestisce il master
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    status = 0
+    try:
+        app = factory()
+        warm_up(app)
+        config = app.config
+        stream_paths = ()
+        if config['EVENTS_ENABLED']:
+            with app.test_request_context():
+                stream_paths = (url_for('main.events'),)
+        server = PooledWSGIServer(app, listen_fd, threads=config['SERVE_THREADS'],
+                                  queue_size=config['SERVE_QUEUE_SIZE'],
+                                  access_log=config['SERVE_ACCESS_LOG'],
+                                  stream_paths=stream_paths, max_streams=config['SERVE_STREAMS'])
+        # Per le metriche (app/metrics.py)
+        app.extensions['serve'] = server
+
+        def stop(signum, frame):
+            # shutdown() aspetta la fine di serve_forever: da un altro thread
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        os.write(ready_fd, b'1')
+        os.close(ready_fd)
+        server.serve_forever()
+        server.drain(config['SERVE_GRACEFUL_TIMEOUT'])
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        status = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+
+
+class Master:
+    """
+    Processo master: tiene aperto il socket, avvia i worker, li sostituisce
+    se terminano in modo inatteso e gestisce SIGHUP (ricaricamento) e
+    SIGTERM/SIGINT (arresto ordinato).
+    """
+
+    def __init__(self, factory, config, host, port, workers):
+        self.factory = factory
+        self.config = config
+        self.workers = workers
+        self.socket = socket.create_server((host, port), backlog=config['SERVE_BACKLOG'])
+        self.socket.set_inheritable(True)
+        self.generation = 0
+        self._children = {}  # pid -> generazione
+        self._signals = []
+
+    @property
+    def address(self):
+        return self.socket.getsockname()[:2]
+
+    def _spawn(self):
+        """
+        Avvia un worker della generazione corrente.
+
+        Returns:
+            tuple: (pid, descrittore da cui leggere il segnale "pronto")
+        """
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            _worker(self.factory, self.socket.fileno(), ready_write)
+        os.close(ready_write)
+        self._children[pid] = self.generation
+        return pid, ready_read
+
+    def _wait_ready(self, pending, timeout):
+        """
+        Aspetta il segnale "pronto" dei worker indicati.
+
+        Returns:
+            bool: True se tutti i worker sono pronti entro `timeout` secondi
+        """
+        pending = dict(pending)  # descrittore -> pid
+        deadline = time.monotonic() + timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select(list(pending), [], [], remaining)
+            for fd in readable:
+                data = os.read(fd, 1)
+                os.close(fd)
+                if not data:
+                    # Il worker è terminato durante l'avvio
+                    for other in pending:
+                        if other != fd:
+                            os.close(other)
+                    return False
+                del pending[fd]
+        for fd in pending:
+            os.close(fd)
+        return not pending
+
+    def _start_generation(self):
+        self.generation += 1
+        started = [self._spawn() for _ in range(self.workers)]
+        ready = self._wait_ready({fd: pid for pid, fd in started},
+                                 self.config['SERVE_GRACEFUL_TIMEOUT'])
+        if not ready:
+            self._stop([pid for pid, _ in started])
+        return ready
+
+    def _stop(self, pids, timeout=None):
+        """
+        Ferma i worker indicati: SIGTERM, poi SIGKILL dopo `timeout` secondi.
+        """
+        timeout = self.config['SERVE_GRACEFUL_TIMEOUT'] if timeout is None else timeout
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + timeout
+        remaining = set(pids)
+        while remaining and time.monotonic() < deadline:
+            self._reap(respawn=False)
+            remaining &= set(self._children)
+            time.sleep(0.05)
+        for pid in remaining:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            os.waitpid(pid, 0)
+            self._children.pop(pid, None)
+
+    def _reap(self, respawn=True):
+        """
+        Raccoglie i worker terminati e sostituisce quelli della generazione
+        corrente (crash o uscita inattesa).
+        """
+        while self._children:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            generation = self._children.pop(pid, None)
+            if respawn and generation == self.generation:
+                click.echo(f'Worker {pid} terminato, ne avvio un altro.', err=True)
+                _, ready_fd = self._spawn()
+                self._wait_ready({ready_fd: None}, self.config['SERVE_GRACEFUL_TIMEOUT'])
+
+    def reload(self):
+        """
+        Sostituisce tutti i worker senza chiudere il socket: i vecchi vengono
+        fermati solo quando i nuovi sono pronti.
+        """
+        old = [pid for pid, generation in self._children.items() if generation == self.generation]
+        if self._start_generation():
+            self._stop(old)
+            click.echo(f'Worker ricaricati (generazione {self.generation}).', err=True)
+        else:
+            self.generation -= 1
+            click.echo('Ricaricamento fallito: i worker precedenti restano attivi.', err=True)
+
+    def run(self):
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda signum, frame: self._signals.append(signum))
+
+        if self.config['METRICS_ENABLED']:
+            # I file dei processi di un avvio precedente non vanno sommati
+            from app.metrics import clear_metrics
+            clear_metrics(self.config['METRICS_DIR'])
+        if self.config['REPOSITORY_CACHE_BACKEND'] == 'sqlite':
+            # Le voci salvate dal codice caricato in precedenza
+            from app.cache import create_backend
+            create_backend(self.config).clear()
+
+        if not self._start_generation():
+            raise click.ClickException('I worker non sono partiti: vedere gli errori sopra.')
+        host, port = self.address
+        click.echo(f'In ascolto su http://{host}:{port} ({self.workers} worker, '
+                   f'{self.config["SERVE_THREADS"]} thread ciascuno, pid {os.getpid()}).', err=True)
+        try:
+            while True:
+                while self._signals:
+                    signum = self._signals.pop(0)
+                    if signum == signal.SIGHUP:
+                        self.reload()
+                    else:
+                        return
+                self._reap()
+                time.sleep(0.2)
+        finally:
+            self._stop(list(self._children))
+            self.socket.close()
+
+
+def serve(factory, config, host=None, port=None, workers=None):
+    """
+    Avvia il master e i worker; ritorna all'arresto (SIGTERM o Ctrl+C).
+    `factory()` crea l'app in ogni worker.
+    """
+    if not hasattr(os, 'fork'):
+        raise click.ClickException('flask serve richiede un sistema POSIX (Linux, macOS).')
+    master = Master(factory, config,
+                    host or config['SERVE_HOST'],
+                    config['SERVE_PORT'] if port is None else port,
+                    workers or config['SERVE_WORKERS'])
+    master.run()
+
+
+@click.command('serve')
+@click.option('--host', default=None, help='Indirizzo di ascolto (default SERVE_HOST).')
+@click.option('--port', type=int, default=None, help='Porta (default SERVE_PORT).')
+@click.option('--workers', type=int, default=None, help='Processi worker (default SERVE_WORKERS).')
+def serve_command(host, port, workers):
+    """
+    Avvia il server di produzione con worker preforkati.
+    Uso: flask serve [--host 0.0.0.0] [--port 8000] [--workers 4]
+    """
+    from app import create_app
+    serve(create_app, current_app.config, host, port, workers)
+
+
+def init_app(app):
+    """
+    Registra il comando CLI `flask serve`.
+    """
+    app.cli.add_command(serve_command)
+
+
+if __name__ == '__main__':
+    from app import create_app
+    with create_app().app_context():
+        serve_command.main(prog_name='python -m app.serve')
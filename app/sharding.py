@@ -0,0 +1,477 @@
+"""
+Sharding opzionale dei dati utente su più file SQLite.
+
+Con DB_SHARDS = N (> 0) categorie, skills e sessioni di ogni utente vivono
+in uno di N file shard (SHARD_DIR/skilltracker-<n>.db). Il database
+principale (DATABASE) fa da directory: contiene la tabella users e la
+tabella user_shards con l'assegnazione utente -> shard.
+
+Ogni shard contiene anche una copia minima della riga dell'utente, così i
+vincoli di chiave esterna verso users restano validi dentro lo shard.
+"""
+import os
+import zlib
+
+import click
+from flask import current_app, g
+from werkzeug.exceptions import ServiceUnavailable
+
+from app.db import connect, get_connection, get_directory_db
+from app.sync import CHANGE_LOG_TABLES, pause_change_log, reset_user_log, resume_change_log
+
+# Tabelle con dati utente, in ordine di eliminazione (figli prima dei padri)
+USER_DATA_TABLES = ('sessions', 'skills', 'categories')
+
+
+class UserMoving(ServiceUnavailable):
+    """
+    I dati dell'utente sono in fase di spostamento su un altro shard, o lo
+    sono appena stati: la scrittura non viene eseguita e la richiesta
+    risponde 503 con Retry-After. Ripetuta, legge la nuova assegnazione.
+    """
+
+    description = 'I tuoi dati vengono spostati in questo momento, riprova tra qualche secondo.'
+
+    def __init__(self, retry_after=1):
+        ServiceUnavailable.__init__(self, retry_after=retry_after)
+
+
+def stable_shard(user_id, shard_count):
+    """
+    Shard "naturale" di un utente: hash stabile (CRC32) dell'ID.
+    Non dipende da PYTHONHASHSEED, quindi è uguale in ogni processo.
+    """
+    return zlib.crc32(str(user_id).encode('ascii')) % shard_count
+
+
+def shard_path(index):
+    """
+    Percorso del file dello shard con indice dato.
+    """
+    return os.path.join(current_app.config['SHARD_DIR'], f'skilltracker-{index}.db')
+
+
+def get_shard_db(index, write=False):
+    """
+    Connessione allo shard per la richiesta corrente (una per shard e modalità).
+    """
+    return get_connection(shard_path(index), write)
+
+
+def get_user_shard(user_id):
+    """
+    Restituisce lo shard assegnato all'utente, assegnandolo se necessario.
+    Il risultato viene memorizzato in g per la durata della richiesta.
+    """
+    cache = g.setdefault('user_shards', {})
+    if user_id not in cache:
+        row = get_directory_db().execute(
+            'SELECT shard FROM user_shards WHERE user_id = ?',
+            (user_id,)
+        ).fetchone()
+        cache[user_id] = row['shard'] if row else assign_user(user_id)
+    return cache[user_id]
+
+
+def check_user_shard(user_id, path):
+    """
+    Verifica che l'utente sia ancora assegnato al file `path` e non in fase
+    di spostamento. Va chiamata con il lock di scrittura di `path` già
+    preso: da lì move_user non può più copiare i dati dell'utente finché la
+    transazione non termina.
+
+    Raises:
+        UserMoving: Se lo spostamento è in corso o già avvenuto
+    """
+    row = get_directory_db().execute(
+        'SELECT shard, moving FROM user_shards WHERE user_id = ?',
+        (user_id,)
+    ).fetchone()
+    if row is not None and (row['moving'] or shard_path(row['shard']) != path):
+        g.get('user_shards', {}).pop(user_id, None)
+        raise UserMoving()
+
+
+def check_shard_users(path, db):
+    """
+    Hook after_begin delle connessioni di scrittura agli shard (vedi
+    get_connection): controlla gli utenti di cui la richiesta ha letto lo
+    shard (g.user_shards) e che risultano assegnati al file `path`.
+    """
+    for user_id, shard in list(g.get('user_shards', {}).items()):
+        if shard_path(shard) == path:
+            check_user_shard(user_id, path)
+
+
+def _mirror_user(db, user_row):
+    """
+    Crea (o aggiorna) la copia della riga utente dentro uno shard.
+    La password non viene copiata: l'autenticazione usa solo la directory.
+    """
+    db.execute('''
+        INSERT INTO users (id, username, email, password_hash, created_at)
+        VALUES (?, ?, ?, '', ?)
+        ON CONFLICT(id) DO UPDATE SET username = excluded.username, email = excluded.email
+    ''', (user_row['id'], user_row['username'], user_row['email'], user_row['created_at']))
+
+
+def assign_user(user_id, shard=None):
+    """
+    Registra l'utente su uno shard (di default quello dato dall'hash stabile).
+
+    Returns:
+        int: Indice dello shard effettivamente assegnato
+    """
+    directory = get_directory_db(write=True)
+    if shard is None:
+        shard = stable_shard(user_id, current_app.config['DB_SHARDS'])
+
+    user_row = directory.execute(
+        'SELECT id, username, email, created_at FROM users WHERE id = ?',
+        (user_id,)
+    ).fetchone()
+    if user_row is None:
+        raise ValueError(f'Utente {user_id} inesistente.')
+
+    shard_db = get_shard_db(shard, write=True)
+    _mirror_user(shard_db, user_row)
+    shard_db.commit()
+
+    directory.execute(
+        'INSERT INTO user_shards (user_id, shard) VALUES (?, ?) ON CONFLICT(user_id) DO NOTHING',
+        (user_id, shard)
+    )
+    directory.commit()
+
+    # Un'altra richiesta potrebbe averlo assegnato per prima
+    return directory.execute(
+        'SELECT shard FROM user_shards WHERE user_id = ?',
+        (user_id,)
+    ).fetchone()['shard']
+
+
+def delete_user_data(user_id):
+    """
+    Elimina dallo shard dell'utente tutti i suoi dati e la copia della riga.
+    """
+    row = get_directory_db().execute(
+        'SELECT shard FROM user_shards WHERE user_id = ?',
+        (user_id,)
+    ).fetchone()
+    if row is None:
+        return
+
+    shard_db = get_shard_db(row['shard'], write=True)
+    for table in USER_DATA_TABLES + CHANGE_LOG_TABLES:
+        shard_db.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
+    shard_db.execute('DELETE FROM users WHERE id = ?', (user_id,))
+    shard_db.commit()
+
+
+def _copy_rows(src, dst, table, user_id, remap, source=None):
+    """
+    Copia le righe di un utente da uno shard all'altro.
+
+    Gli ID vengono riassegnati dallo shard di destinazione; `remap` indica
+    come tradurre le colonne di chiave esterna ({colonna: {vecchio: nuovo}}).
+    `source` è la sorgente SQL da leggere al posto di `table` (per le
+    sessioni, l'unione con l'archivio); la sua colonna `archived` non
+    viene copiata.
+
+    Returns:
+        dict: Mappa vecchio ID -> nuovo ID
+    """
+    rows = src.execute(
+        f'SELECT * FROM {source or table} WHERE user_id = ? ORDER BY id',
+        (user_id,)
+    ).fetchall()
+
+    new_ids = {}
+    for row in rows:
+        values = {key: row[key] for key in row.keys() if key not in ('id', 'archived')}
+        for column, mapping in remap.items():
+            if values[column] is not None:
+                values[column] = mapping.get(values[column])
+        columns = ', '.join(values)
+        placeholders = ', '.join('?' * len(values))
+        cursor = dst.execute(
+            f'INSERT INTO {table} ({columns}) VALUES ({placeholders})',
+            tuple(values.values())
+        )
+        new_ids[row['id']] = cursor.lastrowid
+    return new_ids
+
+
+def _move_archive(src, dst, user_id, session_ids):
+    """
+    Riporta in archivio, nello shard di destinazione, le sessioni che erano
+    archiviate nello shard sorgente (copiate da _copy_rows tra le sessioni
+    live, con i nuovi ID) e sposta la riga di session_archive_rollups.
+    """
+    from app.archive import ARCHIVE_SCHEMA, session_columns
+
+    archived = [session_ids[row[0]] for row in src.execute(
+        f'SELECT id FROM {ARCHIVE_SCHEMA}.sessions WHERE user_id = ?', (user_id,)
+    )]
+    if archived:
+        columns = ', '.join(session_columns(dst))
+        id_list = ', '.join(str(session_id) for session_id in archived)
+        dst.execute(f'INSERT INTO {ARCHIVE_SCHEMA}.sessions ({columns}) '
+                    f'SELECT {columns} FROM main.sessions WHERE id IN ({id_list})')
+        dst.execute(f'DELETE FROM main.sessions WHERE id IN ({id_list})')
+
+    rollup = src.execute(
+        'SELECT sessions, minutes, xp FROM session_archive_rollups WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    if rollup is not None:
+        dst.execute('''
+            INSERT OR REPLACE INTO session_archive_rollups (user_id, sessions, minutes, xp)
+            VALUES (?, ?, ?, ?)
+        ''', (user_id, *rollup))
+
+
+def _copy_idempotency_keys(src, dst, user_id):
+    """
+    Copia le chiavi di idempotenza dell'utente: una ripetizione dopo lo
+    spostamento non deve rieseguire una scrittura già fatta. Nello shard
+    sorgente vengono eliminate in cascata con la riga dell'utente.
+    """
+    rows = src.execute('SELECT * FROM idempotency_keys WHERE user_id = ?', (user_id,)).fetchall()
+    if rows:
+        columns = rows[0].keys()
+        dst.executemany(
+            f'INSERT OR REPLACE INTO idempotency_keys ({", ".join(columns)}) '
+            f'VALUES ({", ".join("?" * len(columns))})',
+            [tuple(row) for row in rows]
+        )
+
+
+def move_user(user_id, target):
+    """
+    Sposta tutti i dati di un utente su un altro shard.
+
+    Prima della copia l'utente viene segnato in user_shards (moving = 1),
+    poi lo shard sorgente viene bloccato in scrittura (BEGIN IMMEDIATE)
+    fino all'eliminazione delle sue righe: le scritture già iniziate
+    terminano prima della copia, quelle successive trovano il segno (o la
+    nuova assegnazione) appena prendono il lock e rispondono 503 con
+    UserMoving, senza scrivere nulla; ripetute, vanno sul nuovo shard.
+    Le letture continuano a funzionare. Gli ID delle righe copiate vengono
+    riassegnati dallo shard di destinazione. Con ARCHIVE_ENABLED anche le
+    sessioni archiviate e i loro totali passano all'archivio dello shard di
+    destinazione, nella stessa transazione.
+
+    Returns:
+        int: Numero di righe spostate
+    """
+    source = get_user_shard(user_id)
+    if source == target:
+        return 0
+
+    directory = get_directory_db(write=True)
+    directory.execute('UPDATE user_shards SET moving = 1 WHERE user_id = ?', (user_id,))
+    directory.commit()
+
+    wal = current_app.config['DB_WAL']
+    src = connect(shard_path(source), wal=wal)
+    dst = connect(shard_path(target), wal=wal)
+    archive = current_app.config['ARCHIVE_ENABLED']
+    from app.archive import ARCHIVE_SCHEMA, attach_archive, sessions_source
+    try:
+        if archive:
+            attach_archive(src, shard_path(source))
+            attach_archive(dst, shard_path(target))
+        src.execute('BEGIN IMMEDIATE')
+        dst.execute('BEGIN IMMEDIATE')
+
+        user_row = directory.execute(
+            'SELECT id, username, email, created_at FROM users WHERE id = ?',
+            (user_id,)
+        ).fetchone()
+        _mirror_user(dst, user_row)
+
+        # Gli ID cambiano: il registro delle modifiche riparte oltre la
+        # sequenza attuale e i client dell'utente riscaricano i dati
+        pause_change_log(dst)
+        category_ids = _copy_rows(src, dst, 'categories', user_id, {})
+        skill_ids = _copy_rows(src, dst, 'skills', user_id, {'category_id': category_ids})
+        # Sessioni live e archiviate insieme, nell'ordine degli ID originali:
+        # i nuovi ID mantengono l'ordine delle sessioni nella stessa data
+        session_ids = _copy_rows(src, dst, 'sessions', user_id, {'skill_id': skill_ids},
+                                 source=sessions_source(src, include_archived=True))
+        if archive:
+            _move_archive(src, dst, user_id, session_ids)
+        resume_change_log(dst)
+        state = src.execute('SELECT seq FROM change_log_state WHERE user_id = ?', (user_id,)).fetchone()
+        reset_user_log(dst, user_id, (state[0] if state else 0) + 1)
+        _copy_idempotency_keys(src, dst, user_id)
+        dst.commit()
+
+        directory.execute(
+            'UPDATE user_shards SET shard = ?, moving = 0 WHERE user_id = ?',
+            (target, user_id)
+        )
+        directory.commit()
+
+        pause_change_log(src)
+        for table in USER_DATA_TABLES + CHANGE_LOG_TABLES:
+            src.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
+        if archive:
+            src.execute(f'DELETE FROM {ARCHIVE_SCHEMA}.sessions WHERE user_id = ?', (user_id,))
+            src.execute('DELETE FROM session_archive_rollups WHERE user_id = ?', (user_id,))
+        src.execute('DELETE FROM users WHERE id = ?', (user_id,))
+        resume_change_log(src)
+        src.commit()
+    except Exception:
+        src.rollback()
+        dst.rollback()
+        if directory.in_transaction:
+            directory.rollback()
+        directory.execute('UPDATE user_shards SET moving = 0 WHERE user_id = ?', (user_id,))
+        directory.commit()
+        raise
+    finally:
+        src.close()
+        dst.close()
+
+    g.setdefault('user_shards', {})[user_id] = target
+    return len(category_ids) + len(skill_ids) + len(session_ids)
+
+
+def init_shards(reset=False):
+    """
+    Crea i file shard eseguendo lo schema SQL.
+    Con reset=False gli shard già esistenti non vengono toccati.
+    """
+    os.makedirs(current_app.config['SHARD_DIR'], exist_ok=True)
+
+    with current_app.open_resource('schema.sql') as f:
+        schema = f.read().decode('utf8')
+
+    created = []
+    for index in range(current_app.config['DB_SHARDS']):
+        path = shard_path(index)
+        if reset or not os.path.exists(path):
+            db = get_shard_db(index, write=True)
+            db.executescript(schema)
+            if current_app.config['ARCHIVE_ENABLED']:
+                from app.archive import reset_archive
+                reset_archive(db)
+            created.append(index)
+    return created
+
+
+def get_shard_stats():
+    """
+    Aggregati amministrativi calcolati su tutti gli shard.
+    Senza sharding restituisce una sola riga per il database principale.
+
+    Returns:
+        list[dict]: Una riga per shard (utenti, skills, sessioni, XP, minuti, dimensione)
+    """
+    directory = get_directory_db()
+    shard_count = current_app.config['DB_SHARDS']
+
+    if shard_count:
+        assigned = dict(directory.execute(
+            'SELECT shard, COUNT(*) FROM user_shards GROUP BY shard'
+        ).fetchall())
+        targets = [(index, get_shard_db(index), shard_path(index)) for index in range(shard_count)]
+    else:
+        assigned = {}
+        targets = [(None, directory, current_app.config['DATABASE'])]
+
+    stats = []
+    for index, db, path in targets:
+        row = db.execute('''
+            SELECT
+                (SELECT COUNT(*) FROM users) as users,
+                (SELECT COUNT(*) FROM skills) as skills,
+                (SELECT COALESCE(SUM(total_xp), 0) FROM skills) as total_xp,
+                (SELECT COUNT(*) FROM sessions) as sessions,
+                (SELECT COALESCE(SUM(duration_minutes), 0) FROM sessions) as total_minutes
+        ''').fetchone()
+        stats.append({
+            'shard': index,
+            'assigned_users': assigned.get(index, row['users']),
+            'users': row['users'],
+            'skills': row['skills'],
+            'total_xp': row['total_xp'],
+            'sessions': row['sessions'],
+            'total_hours': round(row['total_minutes'] / 60, 1),
+            'size_bytes': os.path.getsize(path) if os.path.exists(path) else 0
+        })
+    return stats
+
+
+# ============================================================================
+# COMANDI CLI
+# ============================================================================
+
+@click.command('init-shards')
+def init_shards_command():
+    """
+    Crea i file shard mancanti (es. dopo aver aumentato DB_SHARDS).
+    Uso: flask init-shards
+    """
+    created = init_shards()
+    click.echo(f'Shard creati: {created or "nessuno"}')
+
+
+@click.command('shard-stats')
+def shard_stats_command():
+    """
+    Mostra gli aggregati per shard.
+    Uso: flask shard-stats
+    """
+    for row in get_shard_stats():
+        name = 'principale' if row['shard'] is None else f'shard {row["shard"]}'
+        click.echo(f'{name}: {row["assigned_users"]} utenti, {row["skills"]} skills, '
+                   f'{row["sessions"]} sessioni, {row["total_xp"]} XP, '
+                   f'{row["size_bytes"] / 1024:.0f} KiB')
+
+
+@click.command('shard-move')
+@click.argument('user_id', type=int)
+@click.argument('shard', type=int)
+def shard_move_command(user_id, shard):
+    """
+    Sposta un utente su uno shard specifico.
+    Uso: flask shard-move USER_ID SHARD
+    """
+    if not 0 <= shard < current_app.config['DB_SHARDS']:
+        raise click.BadParameter(f'Lo shard deve essere tra 0 e {current_app.config["DB_SHARDS"] - 1}.')
+    moved = move_user(user_id, shard)
+    click.echo(f'Utente {user_id} spostato sullo shard {shard} ({moved} righe).')
+
+
+@click.command('shard-rebalance')
+def shard_rebalance_command():
+    """
+    Riporta ogni utente sullo shard dato dall'hash stabile
+    (da eseguire dopo aver cambiato DB_SHARDS).
+    Uso: flask shard-rebalance
+    """
+    shard_count = current_app.config['DB_SHARDS']
+    rows = get_directory_db().execute('SELECT user_id, shard FROM user_shards').fetchall()
+
+    moved_users = 0
+    for row in rows:
+        target = stable_shard(row['user_id'], shard_count)
+        if row['shard'] != target:
+            move_user(row['user_id'], target)
+            moved_users += 1
+    click.echo(f'Ribilanciamento completato: {moved_users} utenti spostati.')
+
+
+def init_app(app):
+    """
+    Registra i comandi CLI dello sharding.
+    """
+    if app.config['DB_SHARDS']:
+        os.makedirs(app.config['SHARD_DIR'], exist_ok=True)
+
+    app.cli.add_command(init_shards_command)
+    app.cli.add_command(shard_stats_command)
+    app.cli.add_command(shard_move_command)
+    app.cli.add_command(shard_rebalance_command)
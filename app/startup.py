@@ -0,0 +1,134 @@
+"""
+Avvio a freddo: cache del bytecode dei template e tempi di avvio.
+
+Jinja compila ogni template al primo uso in ogni processo; con
+JINJA_BYTECODE_CACHE_DIR il risultato viene salvato su file (nella
+cartella instance/) e i processi successivi, worker compresi, caricano
+il bytecode invece di ricompilare. `flask precompile-templates` riempie
+la cache subito dopo un deploy.
+
+Ogni processo registra i propri tempi di avvio: import di Flask e del
+package, create_app (compresi gli import dei sottosistemi) e durata
+della prima richiesta; `flask startup-report` li misura in un processo
+nuovo.
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+import click
+from flask import current_app, request
+from jinja2 import FileSystemBytecodeCache
+
+
+def precompile_templates(app):
+    """
+    Compila tutti i template HTML dell'app (scrivendo la cache del
+    bytecode, se attiva).
+
+    Returns:
+        int: Template compilati
+    """
+    names = [name for name in app.jinja_env.list_templates() if name.endswith('.html')]
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def preload():
+    """
+    Importa i sottosistemi caricati in modo lazy (NumPy per statistiche e
+    previsioni), per i processi che devono essere pronti prima del traffico.
+    """
+    import numpy  # noqa: F401
+
+
+def get_startup_timings(app):
+    """
+    Returns:
+        dict: import_ms, factory_ms, first_request_ms (None finché la
+              prima richiesta non è terminata) e bytecode_cache
+    """
+    return app.extensions['startup']
+
+
+def _measure_cold_start(path):
+    """
+    Codice eseguito in un interprete nuovo da `flask startup-report`.
+    """
+    return f'''
+import json
+from app import create_app
+app = create_app()
+app.test_client().get({path!r})
+print(json.dumps(app.extensions['startup']))
+'''
+
+
+@click.command('precompile-templates')
+def precompile_templates_command():
+    """
+    Compila tutti i template nella cache del bytecode (dopo un deploy).
+    Uso: flask precompile-templates
+    """
+    if current_app.jinja_env.bytecode_cache is None:
+        click.echo('JINJA_BYTECODE_CACHE_DIR non impostata: i template vengono solo verificati.')
+    started = time.perf_counter()
+    count = precompile_templates(current_app)
+    click.echo(f'{count} template compilati in {(time.perf_counter() - started) * 1000:.0f} ms.')
+
+
+@click.command('startup-report')
+@click.option('--path', default='/auth/login', help='Richiesta da misurare come prima richiesta.')
+@click.option('--runs', type=int, default=3, help='Avvii da misurare.')
+def startup_report_command(path, runs):
+    """
+    Misura l'avvio a freddo in processi nuovi: import, create_app e
+    prima richiesta.
+    Uso: flask startup-report [--path /auth/login] [--runs 3]
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    click.echo(f'{"import":>10} {"create_app":>12} {"1a richiesta":>14}')
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', _measure_cold_start(path)], cwd=root,
+                                capture_output=True, text=True, check=True).stdout
+        timings = json.loads(output.strip().splitlines()[-1])
+        click.echo(f'{timings["import_ms"]:>8.0f}ms {timings["factory_ms"]:>10.0f}ms '
+                   f'{timings["first_request_ms"]:>12.0f}ms')
+
+
+def init_app(app, started, import_ms):
+    """
+    Attiva la cache del bytecode dei template, registra i comandi CLI e
+    i tempi di avvio del processo (`started`: inizio di create_app).
+    """
+    cache_dir = app.config['JINJA_BYTECODE_CACHE_DIR']
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+    app.cli.add_command(precompile_templates_command)
+    app.cli.add_command(startup_report_command)
+
+    timings = app.extensions['startup'] = {
+        'import_ms': import_ms,
+        'factory_ms': (time.perf_counter() - started) * 1000,
+        'first_request_ms': None,
+        'bytecode_cache': bool(cache_dir),
+    }
+    first_request = {}
+
+    @app.before_request
+    def time_first_request():
+        if timings['first_request_ms'] is None and not first_request:
+            first_request['started'] = time.perf_counter()
+
+    @app.teardown_request
+    def record_first_request(exc=None):
+        if timings['first_request_ms'] is None and first_request:
+            timings['first_request_ms'] = (time.perf_counter() - first_request['started']) * 1000
+            app.logger.info('Avvio: import %.0f ms, create_app %.0f ms, prima richiesta %s %.0f ms',
+                            timings['import_ms'], timings['factory_ms'], request.path,
+                            timings['first_request_ms'])
@@ -0,0 +1,144 @@
+"""
+Registro delle modifiche per la sincronizzazione incrementale dei client.
+
+I trigger dello schema scrivono in `change_log` una riga per ogni
+inserimento, modifica o eliminazione di categorie, skills e sessioni, con
+una sequenza per utente: /api/v1/sync?since=<seq> restituisce solo quello
+che è cambiato dopo `seq`, quindi il traffico dipende dalle modifiche e
+non dalla storia dell'utente.
+
+La compattazione periodica tiene solo l'ultima riga di ogni entità e
+rimuove le eliminazioni più vecchie di SYNC_TOMBSTONE_DAYS giorni,
+spostando in avanti l'orizzonte dell'utente: un client fermo a una
+sequenza precedente riceve `reset` e riscarica tutto.
+"""
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask import current_app
+
+from app.db import get_connection
+from app.maintenance import data_paths
+
+# Tabelle del registro per utente (da ripulire quando l'utente lascia un file)
+CHANGE_LOG_TABLES = ('change_log', 'change_log_state')
+
+
+def pause_change_log(db):
+    """
+    Sospende il registro fino alla fine della transazione corrente (da
+    chiamare dopo BEGIN): le righe copiate o spostate non sono modifiche.
+    """
+    db.execute('INSERT OR IGNORE INTO change_log_paused (paused) VALUES (1)')
+
+
+def resume_change_log(db):
+    """
+    Riattiva il registro prima del commit.
+    """
+    db.execute('DELETE FROM change_log_paused')
+
+
+def reset_user_log(db, user_id, seq):
+    """
+    Ricomincia il registro di un utente da `seq` (senza commit): tutti i
+    client con una sequenza precedente dovranno riscaricare i dati.
+    Usato quando gli ID dell'utente cambiano (spostamento tra shard).
+    """
+    db.execute('DELETE FROM change_log WHERE user_id = ?', (user_id,))
+    db.execute('''
+        INSERT INTO change_log_state (user_id, seq, horizon) VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET seq = excluded.seq, horizon = excluded.horizon
+    ''', (user_id, seq, seq))
+
+
+def compact_user(db, user_id, tombstone_cutoff):
+    """
+    Compatta il registro di un utente in una transazione breve.
+
+    Returns:
+        int: Righe rimosse
+    """
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        # Solo l'ultima modifica di ogni entità serve ai client
+        removed = db.execute('''
+            DELETE FROM change_log
+            WHERE user_id = ? AND seq < (
+                SELECT MAX(newer.seq) FROM change_log newer
+                WHERE newer.user_id = change_log.user_id
+                  AND newer.entity = change_log.entity
+                  AND newer.entity_id = change_log.entity_id
+            )
+        ''', (user_id,)).rowcount
+
+        horizon = db.execute('''
+            SELECT MAX(seq) FROM change_log
+            WHERE user_id = ? AND op = 'delete' AND changed_at < ?
+        ''', (user_id, tombstone_cutoff)).fetchone()[0]
+        if horizon is not None:
+            removed += db.execute(
+                "DELETE FROM change_log WHERE user_id = ? AND op = 'delete' AND seq <= ?",
+                (user_id, horizon)
+            ).rowcount
+            db.execute(
+                'UPDATE change_log_state SET horizon = MAX(horizon, ?) WHERE user_id = ?',
+                (horizon, user_id)
+            )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return removed
+
+
+def compact_change_log(keep_going=None):
+    """
+    Compatta il registro di tutti gli utenti, un utente per transazione.
+    Se `keep_going()` restituisce False il lavoro riprende al giro successivo.
+
+    Returns:
+        dict: utenti compattati e righe rimosse
+    """
+    cutoff = (datetime.now(timezone.utc)
+              - timedelta(days=current_app.config['SYNC_TOMBSTONE_DAYS'])).strftime('%Y-%m-%d %H:%M:%S')
+    report = {'users': 0, 'rows': 0}
+
+    for path in data_paths():
+        db = get_connection(path, write=True)
+        user_ids = [row[0] for row in db.execute('SELECT user_id FROM change_log_state')]
+        for user_id in user_ids:
+            if keep_going is not None and not keep_going():
+                return report
+            report['rows'] += compact_user(db, user_id, cutoff)
+            report['users'] += 1
+    return report
+
+
+def _scheduled_compaction():
+    from app.scheduler import get_scheduler
+    report = compact_change_log(keep_going=get_scheduler(current_app).is_idle)
+    if report['rows']:
+        current_app.logger.info('Registro modifiche compattato: %(users)d utenti, %(rows)d righe', report)
+
+
+@click.command('sync-compact')
+def sync_compact_command():
+    """
+    Compatta subito il registro delle modifiche (adatto a cron).
+    Uso: flask sync-compact
+    """
+    report = compact_change_log()
+    click.echo(f'{report["rows"]} righe rimosse dal registro di {report["users"]} utenti.')
+
+
+def init_app(app):
+    """
+    Registra il comando CLI e, se SYNC_COMPACT_INTERVAL > 0, il job
+    periodico di compattazione.
+    """
+    app.cli.add_command(sync_compact_command)
+
+    if app.config['SYNC_COMPACT_INTERVAL']:
+        from app.scheduler import get_scheduler
+        get_scheduler(app).add_job('sync-compact', app.config['SYNC_COMPACT_INTERVAL'], _scheduled_compaction)
@@ -0,0 +1,179 @@
+"""
+Aggiornamento dello schema di un database esistente senza perdere i dati.
+
+`flask init-db` ricrea tutte le tabelle da zero. `flask db-upgrade`
+confronta invece ogni file (principale e shard) con schema.sql, caricato
+in un database in memoria, e aggiunge solo quello che manca: tabelle,
+colonne (ALTER TABLE ... ADD COLUMN), indici e trigger, ricreando gli
+indici e i trigger la cui definizione è cambiata. Le tabelle nuove che
+riassumono dati già presenti vengono riempite nella stessa transazione;
+alla fine i totali progressivi delle sessioni (cumulative_xp,
+level_after) vengono ricalcolati come con `flask reconcile-xp`.
+Su un database già aggiornato non cambia niente.
+"""
+import sqlite3
+
+import click
+from flask import current_app
+
+from app.archive import ARCHIVE_SCHEMA
+from app.db import connect
+from app.maintenance import archive_paths, data_paths, database_paths
+from app.reconcile import reconcile_path
+from app.sync import reset_user_log
+
+# Oggetti dello schema confrontati con il database, nell'ordine di creazione
+OBJECT_TYPES = ('table', 'index', 'trigger')
+
+
+def load_schema():
+    """
+    Schema di riferimento: schema.sql eseguito su un database in memoria.
+    """
+    with current_app.open_resource('schema.sql') as f:
+        schema = f.read().decode('utf8')
+    reference = sqlite3.connect(':memory:')
+    reference.row_factory = sqlite3.Row
+    reference.executescript(schema)
+    return reference
+
+
+def _objects(db, object_type):
+    """
+    Returns:
+        dict: {nome: SQL di creazione} degli oggetti di un tipo
+    """
+    return {row['name']: row['sql'] for row in db.execute(
+        "SELECT name, sql FROM main.sqlite_master "
+        "WHERE type = ? AND sql IS NOT NULL AND name NOT LIKE 'sqlite_%' ORDER BY rowid",
+        (object_type,)
+    )}
+
+
+def _same_sql(a, b):
+    return ' '.join(a.split()) == ' '.join(b.split())
+
+
+def _column_definition(column):
+    definition = f'{column["name"]} {column["type"]}'
+    if column['notnull']:
+        definition += ' NOT NULL'
+    if column['dflt_value'] is not None:
+        definition += f' DEFAULT {column["dflt_value"]}'
+    return definition
+
+
+def _fill_change_log_state(db):
+    # Gli utenti con dati precedenti al registro partono da un orizzonte
+    # oltre la sequenza 0: il primo /api/v1/sync risponde reset
+    for row in db.execute('''
+        SELECT user_id FROM categories UNION SELECT user_id FROM skills
+        UNION SELECT user_id FROM sessions
+    ''').fetchall():
+        reset_user_log(db, row['user_id'], 1)
+
+
+def _fill_leaderboard_buckets(db):
+    from app.repositories import LeaderboardRepository
+    LeaderboardRepository.rebuild_buckets(db)
+
+
+def _fill_archive_rollups(db):
+    if ARCHIVE_SCHEMA not in {row['name'] for row in db.execute('PRAGMA database_list')}:
+        return
+    db.execute(f'''
+        INSERT INTO session_archive_rollups (user_id, sessions, minutes, xp)
+        SELECT user_id, COUNT(*), SUM(duration_minutes), SUM(xp_gained)
+        FROM {ARCHIVE_SCHEMA}.sessions
+        GROUP BY user_id
+    ''')
+
+
+# Tabelle nuove da riempire con i dati esistenti quando vengono create
+BACKFILLS = {
+    'change_log_state': _fill_change_log_state,
+    'leaderboard_buckets': _fill_leaderboard_buckets,
+    'session_archive_rollups': _fill_archive_rollups,
+}
+
+
+def upgrade_database(db, reference):
+    """
+    Porta il database di una connessione allo schema di riferimento in
+    un'unica transazione. Le tabelle esistenti ricevono solo le colonne
+    mancanti: vincoli e tipi delle colonne già presenti non vengono toccati.
+
+    Returns:
+        list[str]: Modifiche applicate (vuota se il database era aggiornato)
+    """
+    changes = []
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        created = []
+        existing = _objects(db, 'table')
+        for name, sql in _objects(reference, 'table').items():
+            if name not in existing:
+                db.execute(sql)
+                created.append(name)
+                changes.append(f'tabella {name}')
+                continue
+            columns = {row['name'] for row in db.execute(f'PRAGMA main.table_info({name})')}
+            for column in reference.execute(f'PRAGMA table_info({name})'):
+                if column['name'] not in columns:
+                    db.execute(f'ALTER TABLE main.{name} ADD COLUMN {_column_definition(column)}')
+                    changes.append(f'colonna {name}.{column["name"]}')
+
+        for object_type in OBJECT_TYPES[1:]:
+            existing = _objects(db, object_type)
+            for name, sql in _objects(reference, object_type).items():
+                if name in existing:
+                    if _same_sql(existing[name], sql):
+                        continue
+                    db.execute(f'DROP {object_type.upper()} main.{name}')
+                db.execute(sql)
+                changes.append(f'{"indice" if object_type == "index" else "trigger"} {name}')
+
+        for name in created:
+            if name in BACKFILLS:
+                BACKFILLS[name](db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return changes
+
+
+@click.command('db-upgrade')
+def db_upgrade_command():
+    """
+    Aggiorna lo schema dei database esistenti mantenendo i dati.
+    Uso: flask db-upgrade
+    """
+    reference = load_schema()
+    archives = archive_paths()
+    try:
+        for path in database_paths():
+            db = connect(path, wal=current_app.config['DB_WAL'])
+            try:
+                if path in archives:
+                    db.execute(f'ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}', (archives[path],))
+                changes = upgrade_database(db, reference)
+            finally:
+                db.close()
+            click.echo(f'{path}: {len(changes)} modifiche allo schema.')
+            for change in changes:
+                click.echo(f'  {change}')
+    finally:
+        reference.close()
+
+    for path in data_paths():
+        result = reconcile_path(path)
+        click.echo(f'{path}: {len(result["skills"])} skills e '
+                   f'{result["sessions"]} sessioni riallineate.')
+
+
+def init_app(app):
+    """
+    Registra il comando CLI di aggiornamento dello schema.
+    """
+    app.cli.add_command(db_upgrade_command)
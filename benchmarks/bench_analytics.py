@@ -0,0 +1,130 @@
+"""
+Benchmark: statistiche di pratica (streak, medie mobili, costanza,
+giorni della settimana) per un utente con molte sessioni.
+
+Confronta:
+- "Python puro": una passata per sessione con dizionari e set, per ogni skill;
+- "NumPy": app/analytics.py (una query, calcolo vettoriale);
+- "cache": seconda chiamata con la stessa versione dei dati.
+
+Verifica anche che le due implementazioni diano gli stessi risultati.
+
+Uso (dalla radice del progetto):
+    python benchmarks/bench_analytics.py [--sessions 100000] [--skills 20] [--years 5]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from app.analytics import (WINDOW_DAYS, compute_analytics, get_user_analytics,  # noqa: E402
+                           load_sessions)
+from app.db import get_db, init_db  # noqa: E402
+
+
+def build_database(app, sessions, skills, years):
+    with app.app_context():
+        init_db()
+    db = sqlite3.connect(app.config['DATABASE'])
+    db.execute("INSERT INTO users (id, username, email, password_hash) VALUES (1, 'bench', 'b@example.com', 'x')")
+    skill_ids = [db.execute('INSERT INTO skills (name, user_id) VALUES (?, 1)', (f'Skill {i}',)).lastrowid
+                 for i in range(skills)]
+    rng = random.Random(42)
+    today = date.today()
+    span = 365 * years
+    db.executemany(
+        'INSERT INTO sessions (skill_id, user_id, date, duration_minutes, xp_gained) VALUES (?, 1, ?, ?, ?)',
+        [(rng.choice(skill_ids), (today - timedelta(days=min(rng.randint(0, span), rng.randint(0, span)))).isoformat(),
+          rng.randint(10, 120), rng.randint(10, 240)) for _ in range(sessions)]
+    )
+    db.commit()
+    db.close()
+
+
+def python_analytics(rows, today):
+    """
+    Implementazione di riferimento senza NumPy (solo le metriche principali).
+    """
+    by_skill = defaultdict(list)
+    for row in rows:
+        by_skill[row['skill_id']].append(row)
+        by_skill[None].append(row)
+
+    results = {}
+    for skill_id, skill_rows in by_skill.items():
+        days = sorted({date.fromisoformat(str(row['date'])) for row in skill_rows if row['date'] <= today})
+        longest = run = 0
+        previous = None
+        for day in days:
+            run = run + 1 if previous is not None and (day - previous).days == 1 else 1
+            longest = max(longest, run)
+            previous = day
+        current = run if days and (today - days[-1]).days <= 1 else 0
+
+        minutes_7 = sum(row['duration_minutes'] for row in skill_rows
+                        if 0 <= (today - row['date']).days < 7)
+        active_30 = len({row['date'] for row in skill_rows if 0 <= (today - row['date']).days < WINDOW_DAYS})
+        results[skill_id] = {
+            'current_streak': current,
+            'longest_streak': longest,
+            'avg_minutes_7d': round(minutes_7 / 7, 1),
+            'active_days_30d': active_30
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sessions', type=int, default=100000)
+    parser.add_argument('--skills', type=int, default=20)
+    parser.add_argument('--years', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({'TESTING': True, 'DATABASE': os.path.join(tmp, 'bench.db')})
+        build_database(app, args.sessions, args.skills, args.years)
+        today = date.today()
+
+        with app.app_context():
+            db = get_db()
+            started = time.perf_counter()
+            rows = db.execute('SELECT skill_id, date, duration_minutes, xp_gained FROM sessions WHERE user_id = 1').fetchall()
+            reference = python_analytics(rows, today)
+            python_ms = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            sessions = load_sessions(db, 1)
+            load_ms = (time.perf_counter() - started) * 1000
+            started = time.perf_counter()
+            compute_analytics(sessions, today)
+            compute_ms = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            result = get_user_analytics(1)
+            first_ms = (time.perf_counter() - started) * 1000
+            started = time.perf_counter()
+            get_user_analytics(1)
+            cached_ms = (time.perf_counter() - started) * 1000
+
+        for skill_id, expected in reference.items():
+            actual = result['overall'] if skill_id is None else result['skills'][skill_id]
+            for key, value in expected.items():
+                assert actual[key] == value, (skill_id, key, actual[key], value)
+
+    print(f'{args.sessions} sessioni, {args.skills} skills, {args.years} anni')
+    print(f'  Python puro:  {python_ms:8.1f} ms')
+    print(f'  NumPy:        {first_ms:8.1f} ms  (query {load_ms:.1f} ms + calcolo {compute_ms:.1f} ms)')
+    print(f'  cache:        {cached_ms:8.3f} ms')
+    print('  risultati identici')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark: schermata iniziale di un client dell'API JSON.
+
+Confronta le quattro chiamate necessarie (statistiche, skills, sessioni
+recenti, categorie):
+- "separate": quattro richieste HTTP, ognuna con autenticazione e
+  connessioni proprie;
+- "batch": una sola richiesta a /api/v1/batch.
+
+Il tempo è quello lato server (test client di Flask, senza rete): con una
+rete reale ogni richiesta in meno risparmia anche un round trip.
+
+Uso (dalla radice del progetto):
+    python benchmarks/bench_api_batch.py [--sessions 10000] [--repeat 50]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from app.db import init_db  # noqa: E402
+from app.repositories.api_token_repository import hash_token  # noqa: E402
+
+TOKEN = 'bench-token'
+HOME_SCREEN = [
+    {'id': 'stats', 'path': '/api/v1/stats'},
+    {'id': 'skills', 'path': '/api/v1/skills?limit=5&fields=name,current_level,total_xp'},
+    {'id': 'recent', 'path': '/api/v1/sessions?limit=10&fields=skill_id,date,xp_gained'},
+    {'id': 'categories', 'path': '/api/v1/categories'},
+]
+
+
+def build_database(app, sessions):
+    with app.app_context():
+        init_db()
+    db = sqlite3.connect(app.config['DATABASE'])
+    db.execute("INSERT INTO users (id, username, email, password_hash) VALUES (1, 'bench', 'b@example.com', 'x')")
+    db.execute('INSERT INTO api_tokens (token_hash, user_id) VALUES (?, 1)', (hash_token(TOKEN),))
+    category_ids = [db.execute("INSERT INTO categories (name, icon, user_id) VALUES (?, '*', 1)",
+                               (f'Categoria {i}',)).lastrowid for i in range(5)]
+    skill_ids = [db.execute('INSERT INTO skills (name, user_id, category_id) VALUES (?, 1, ?)',
+                            (f'Skill {i}', category_ids[i % 5])).lastrowid for i in range(20)]
+    rng = random.Random(42)
+    today = date.today()
+    db.executemany(
+        'INSERT INTO sessions (skill_id, user_id, date, duration_minutes, xp_gained) VALUES (?, 1, ?, ?, ?)',
+        ((rng.choice(skill_ids), (today - timedelta(days=rng.randint(0, 1000))).isoformat(),
+          rng.randint(10, 120), rng.randint(10, 240)) for _ in range(sessions))
+    )
+    db.commit()
+    db.close()
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sessions', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({'TESTING': True, 'DATABASE': os.path.join(tmp, 'bench.db')})
+        build_database(app, args.sessions)
+        client = app.test_client()
+        headers = {'Authorization': f'Bearer {TOKEN}'}
+
+        def separate():
+            for item in HOME_SCREEN:
+                assert client.get(item['path'], headers=headers).status_code == 200
+
+        def batch():
+            response = client.post('/api/v1/batch', headers=headers, json={'requests': HOME_SCREEN})
+            assert all(item['status'] == 200 for item in response.json['responses'])
+
+        print(f'{args.sessions} sessioni, {len(HOME_SCREEN)} chiamate (migliore su {args.repeat} run)')
+        print(f'  separate: {best_of(separate, args.repeat):8.2f}ms')
+        print(f'  batch:    {best_of(batch, args.repeat):8.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark: paginazione delle sessioni nell'API JSON (/api/v1/sessions)
+per un utente con molte sessioni.
+
+Confronta, a diverse profondità della lista:
+- "OFFSET": la stessa pagina letta con LIMIT/OFFSET (scarta tutte le
+  righe precedenti);
+- "cursore": la richiesta all'API con il cursore (date, id), che parte
+  direttamente dall'indice.
+
+Uso (dalla radice del progetto):
+    python benchmarks/bench_api_pagination.py [--sessions 1000000] [--limit 50]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from app.blueprints.api.routes import encode_cursor  # noqa: E402
+from app.db import init_db  # noqa: E402
+from app.repositories.api_token_repository import hash_token  # noqa: E402
+
+TOKEN = 'bench-token'
+
+
+def build_database(app, sessions):
+    with app.app_context():
+        init_db()
+    db = sqlite3.connect(app.config['DATABASE'])
+    db.execute("INSERT INTO users (id, username, email, password_hash) VALUES (1, 'bench', 'b@example.com', 'x')")
+    db.execute('INSERT INTO api_tokens (token_hash, user_id) VALUES (?, 1)', (hash_token(TOKEN),))
+    skill_ids = [db.execute('INSERT INTO skills (name, user_id) VALUES (?, 1)', (f'Skill {i}',)).lastrowid
+                 for i in range(20)]
+    rng = random.Random(42)
+    today = date.today()
+    db.executemany(
+        'INSERT INTO sessions (skill_id, user_id, date, duration_minutes, xp_gained) VALUES (?, 1, ?, ?, ?)',
+        ((rng.choice(skill_ids), (today - timedelta(days=rng.randint(0, 3650))).isoformat(),
+          rng.randint(10, 120), rng.randint(10, 240)) for _ in range(sessions))
+    )
+    db.execute('ANALYZE')
+    db.commit()
+    return db
+
+
+def best_of(fn, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sessions', type=int, default=1000000)
+    parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({'TESTING': True, 'DATABASE': os.path.join(tmp, 'bench.db')})
+        db = build_database(app, args.sessions)
+        client = app.test_client()
+        headers = {'Authorization': f'Bearer {TOKEN}'}
+
+        print(f'{args.sessions} sessioni, pagine da {args.limit} (migliore su 5 run)')
+        print(f'  {"offset":>10}  {"OFFSET":>10}  {"cursore":>10}')
+        for fraction in (0, 0.1, 0.5, 0.99):
+            offset = int(args.sessions * fraction)
+
+            def offset_page():
+                db.execute('''
+                    SELECT id, date, skill_id, duration_minutes, xp_gained FROM sessions
+                    WHERE user_id = 1 ORDER BY date DESC, id DESC LIMIT ? OFFSET ?
+                ''', (args.limit, offset)).fetchall()
+
+            url = f'/api/v1/sessions?limit={args.limit}&fields=date,skill_id,duration_minutes,xp_gained'
+            if offset:
+                # Cursore dell'ultima riga della pagina precedente
+                last = db.execute('''
+                    SELECT date, id FROM sessions WHERE user_id = 1
+                    ORDER BY date DESC, id DESC LIMIT 1 OFFSET ?
+                ''', (offset - 1,)).fetchone()
+                url += f'&cursor={encode_cursor(list(last))}'
+
+            def cursor_page():
+                response = client.get(url, headers=headers)
+                assert response.status_code == 200 and len(response.json['data']) == args.limit
+
+            print(f'  {offset:>10}  {best_of(offset_page):>8.2f}ms  {best_of(cursor_page):>8.2f}ms')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
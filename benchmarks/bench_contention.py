@@ -0,0 +1,130 @@
+"""
+Benchmark: scritture concorrenti da più processi sullo stesso database.
+
+Ogni processo worker esegue --transactions transazioni di fila, ognuna in
+un request context POST: legge la skill (SkillRepository.get_by_id) e
+registra una sessione (SessionRepository.record, INSERT + UPDATE + commit).
+Per 1, 2, 4 e 8 worker (--workers) confronta:
+- "DEFERRED": BEGIN esplicito prima della lettura e nessun tentativo
+  ripetuto (come un BEGIN implicito dopo una lettura): la transazione
+  che ha già letto non può attendere il lock e fallisce subito con
+  SQLITE_BUSY se un altro processo ha scritto nel frattempo;
+- "IMMEDIATE": BEGIN IMMEDIATE implicito alla prima scrittura, nessun
+  tentativo ripetuto (DB_BUSY_RETRIES = 0);
+- "IMMEDIATE + retry": come sopra con DB_BUSY_RETRIES e backoff.
+Riporta transazioni riuscite al secondo, percentuale di errori e latenza
+(mediana, p99, massimo) delle transazioni riuscite. Con un
+--busy-timeout-ms basso le attese del lock superano il timeout e si vede
+l'effetto dei tentativi ripetuti.
+
+Uso (dalla radice del progetto):
+    python benchmarks/bench_contention.py [--workers 1 2 4 8] [--transactions 300] [--busy-timeout-ms 1000]
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import g  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.db import get_write_db, init_db  # noqa: E402
+from app.modelli import User  # noqa: E402
+from app.repositories import SessionRepository, SkillRepository  # noqa: E402
+
+SKILLS = 8
+
+MODES = (
+    ('DEFERRED', True, 0),
+    ('IMMEDIATE', False, 0),
+    ('IMMEDIATE + retry', False, None),
+)
+
+
+def build_database(path):
+    app = create_app({'DATABASE': path})
+    with app.app_context():
+        init_db()
+    db = sqlite3.connect(path)
+    db.execute("INSERT INTO users (id, username, email, password_hash) VALUES (1, 'bench', 'b@example.com', 'x')")
+    db.executemany('INSERT INTO skills (id, name, user_id) VALUES (?, ?, 1)',
+                   ((i, f'Skill {i}') for i in range(1, SKILLS + 1)))
+    db.commit()
+    db.close()
+
+
+def worker(config, deferred, skill_id, transactions, start_at):
+    """
+    Returns:
+        tuple: (latenze delle transazioni riuscite in secondi, errori)
+    """
+    app = create_app(config)
+    user = User(1, 'bench', 'b@example.com', '', None)
+    timings, errors = [], 0
+    time.sleep(max(0.0, start_at - time.time()))
+    for _ in range(transactions):
+        with app.test_request_context('/sessions/new', method='POST'):
+            g.user = user
+            started = time.perf_counter()
+            db = get_write_db()
+            try:
+                if deferred:
+                    db.execute('BEGIN')
+                SkillRepository.get_by_id(skill_id)
+                SessionRepository.record(skill_id, 1, '2026-10-19', 30, 60)
+            except sqlite3.OperationalError:
+                db.rollback()
+                errors += 1
+                continue
+            timings.append(time.perf_counter() - started)
+    return timings, errors
+
+
+def run(config, deferred, workers, transactions):
+    start_at = time.time() + 1.0
+    with multiprocessing.Pool(workers) as pool:
+        results = pool.starmap(worker, [(config, deferred, 1 + i % SKILLS, transactions, start_at)
+                                        for i in range(workers)])
+        elapsed = time.time() - start_at
+    timings = sorted(t for result in results for t in result[0])
+    errors = sum(result[1] for result in results)
+    return timings, errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--transactions', type=int, default=300)
+    parser.add_argument('--busy-timeout-ms', type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f'{args.transactions} transazioni per worker, busy timeout {args.busy_timeout_ms}ms')
+    print(f'  {"modalità":18s} {"worker":>6s} {"tx/s":>8s} {"errori":>8s} '
+          f'{"mediana":>10s} {"p99":>10s} {"massimo":>10s}')
+    for workers in args.workers:
+        for label, deferred, retries in MODES:
+            with tempfile.TemporaryDirectory() as tmp:
+                database = os.path.join(tmp, 'bench.db')
+                build_database(database)
+                config = {'DATABASE': database, 'DB_BUSY_TIMEOUT_MS': args.busy_timeout_ms}
+                if retries is not None:
+                    config['DB_BUSY_RETRIES'] = retries
+                timings, errors, elapsed = run(config, deferred, workers, args.transactions)
+            total = workers * args.transactions
+            if timings:
+                latency = (f'{timings[len(timings) // 2] * 1000:8.1f}ms '
+                           f'{timings[int(len(timings) * 0.99)] * 1000:8.1f}ms '
+                           f'{timings[-1] * 1000:8.1f}ms')
+            else:
+                latency = ''
+            print(f'  {label:18s} {workers:6d} {len(timings) / elapsed:8.0f} '
+                  f'{errors * 100 / total:7.1f}% {latency}')
+
+
+if __name__ == '__main__':
+    main()
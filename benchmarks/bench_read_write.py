@@ -0,0 +1,150 @@
+"""
+Benchmark: throughput delle letture concorrenti sotto un carico di scrittura costante.
+
+Confronta due configurazioni sullo stesso dataset:
+- "rollback journal": journal_mode=DELETE, tutte le connessioni scrivibili
+  (comportamento precedente);
+- "WAL + sola lettura": journal_mode=WAL, lettori con URI mode=ro e
+  query_only, un writer dedicato (comportamento con DB_READ_ONLY_GET).
+
+Un thread writer inserisce sessioni a ritmo costante (un commit ciascuna)
+mentre N thread lettori eseguono le query della dashboard.
+
+Uso (dalla radice del progetto):
+    python benchmarks/bench_read_write.py [--readers 4] [--seconds 5] [--writes-per-sec 200]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db import connect  # noqa: E402
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           'app', 'schema.sql')
+
+USERS = 50
+SKILLS_PER_USER = 20
+SESSIONS_PER_USER = 400
+
+DASHBOARD_QUERIES = [
+    '''SELECT s.*, c.name as category_name FROM skills s
+       LEFT JOIN categories c ON s.category_id = c.id
+       WHERE s.user_id = ? ORDER BY s.name''',
+    '''SELECT COUNT(*), COALESCE(SUM(total_xp), 0), COALESCE(AVG(current_level), 0)
+       FROM skills WHERE user_id = ?''',
+    '''SELECT COUNT(*), COALESCE(SUM(duration_minutes), 0), COALESCE(SUM(xp_gained), 0)
+       FROM sessions WHERE user_id = ?''',
+    '''SELECT se.*, sk.name as skill_name FROM sessions se
+       JOIN skills sk ON se.skill_id = sk.id
+       WHERE se.user_id = ? ORDER BY se.date DESC LIMIT 50''',
+]
+
+
+def build_database(path, journal_mode):
+    db = sqlite3.connect(path)
+    with open(SCHEMA_PATH, encoding='utf8') as f:
+        db.executescript(f.read())
+    db.execute(f'PRAGMA journal_mode = {journal_mode}')
+
+    rng = random.Random(42)
+    for user_id in range(1, USERS + 1):
+        db.execute('INSERT INTO users (id, username, email, password_hash) VALUES (?, ?, ?, ?)',
+                   (user_id, f'user{user_id}', f'user{user_id}@example.com', 'x'))
+        skill_ids = []
+        for i in range(SKILLS_PER_USER):
+            cursor = db.execute('INSERT INTO skills (name, user_id, total_xp) VALUES (?, ?, ?)',
+                                (f'Skill {i}', user_id, rng.randint(0, 5000)))
+            skill_ids.append(cursor.lastrowid)
+        db.executemany(
+            'INSERT INTO sessions (skill_id, user_id, date, duration_minutes, xp_gained) VALUES (?, ?, ?, ?, ?)',
+            [(rng.choice(skill_ids), user_id, f'2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+              rng.randint(10, 120), rng.randint(10, 240)) for _ in range(SESSIONS_PER_USER)]
+        )
+    db.commit()
+    db.close()
+
+
+def run(path, wal, readers, seconds, writes_per_sec):
+    stop = threading.Event()
+    counters = {'reads': 0, 'read_errors': 0, 'writes': 0, 'write_errors': 0}
+    lock = threading.Lock()
+
+    def writer():
+        db = connect(path, wal=wal)
+        interval = 1.0 / writes_per_sec
+        rng = random.Random(1)
+        next_at = time.perf_counter()
+        while not stop.is_set():
+            user_id = rng.randint(1, USERS)
+            try:
+                db.execute(
+                    '''INSERT INTO sessions (skill_id, user_id, date, duration_minutes, xp_gained)
+                       VALUES ((SELECT id FROM skills WHERE user_id = ? LIMIT 1), ?, '2026-10-19', 30, 60)''',
+                    (user_id, user_id)
+                )
+                db.commit()
+                with lock:
+                    counters['writes'] += 1
+            except sqlite3.OperationalError:
+                db.rollback()
+                with lock:
+                    counters['write_errors'] += 1
+            next_at += interval
+            time.sleep(max(0.0, next_at - time.perf_counter()))
+        db.close()
+
+    def reader(seed):
+        db = connect(path, read_only=wal)
+        rng = random.Random(seed)
+        while not stop.is_set():
+            user_id = rng.randint(1, USERS)
+            try:
+                for query in DASHBOARD_QUERIES:
+                    db.execute(query, (user_id,)).fetchall()
+                with lock:
+                    counters['reads'] += 1
+            except sqlite3.OperationalError:
+                with lock:
+                    counters['read_errors'] += 1
+        db.close()
+
+    threads = [threading.Thread(target=writer)]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--writes-per-sec', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f'{args.readers} lettori, writer a {args.writes_per_sec} commit/s, {args.seconds:.0f}s per modalità')
+    for label, journal_mode, wal in (('rollback journal', 'DELETE', False),
+                                     ('WAL + sola lettura', 'WAL', True)):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.db')
+            build_database(path, journal_mode)
+            result = run(path, wal, args.readers, args.seconds, args.writes_per_sec)
+        print(f'  {label:20s} letture dashboard/s: {result["reads"] / args.seconds:8.0f}  '
+              f'errori lettura: {result["read_errors"]:5d}  '
+              f'scritture/s: {result["writes"] / args.seconds:6.0f}  '
+              f'errori scrittura: {result["write_errors"]}')
+
+
+if __name__ == '__main__':
+    main()
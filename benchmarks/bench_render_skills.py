@@ -0,0 +1,86 @@
+"""
+Micro-benchmark: rendering della lista skills con 5.000 skill.
+
+Confronta il template main/skills/list.html renderizzato con:
+- "prima": campi derivati ricalcolati a ogni accesso (comportamento storico,
+  con la somma in ciclo per gli XP del livello attuale);
+- "dopo": campi derivati memorizzati per istanza con cached_property.
+
+Uso (dalla radice del progetto):
+    python benchmarks/bench_render_skills.py [--skills 5000] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import g, render_template  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.forecast import project  # noqa: E402
+from app.modelli import Skill, User  # noqa: E402
+
+
+class LegacySkill(Skill):
+    """
+    Skill con i campi derivati ricalcolati a ogni accesso, come prima
+    dell'introduzione di cached_property.
+    """
+
+    progress_percentage = property(Skill.progress_percentage.func)
+    xp_for_next_level = property(Skill.xp_for_next_level.func)
+    xp_needed_for_next_level = property(Skill.xp_needed_for_next_level.func)
+
+    @property
+    def current_level_xp(self):
+        return self.total_xp - sum(i * 100 for i in range(1, self.current_level))
+
+
+def build_skills(cls, count):
+    return [
+        cls(id=i, name=f'Skill {i}', description='Descrizione di prova',
+            current_level=1 + i % 40, target_level=50, total_xp=(i % 40) * 900,
+            category_id=None, user_id=1, created_at=None, category_name='Bench')
+        for i in range(1, count + 1)
+    ]
+
+
+def measure(app, cls, count, repeat):
+    timings = []
+    for _ in range(repeat):
+        skills = build_skills(cls, count)
+        # Previsioni precalcolate (fuori dalla misura): qui conta il rendering
+        forecasts = {skill.id: project(skill, 25.0, date.today(), 3650) for skill in skills}
+        with app.test_request_context('/skills'):
+            g.user = User(1, 'bench', 'bench@example.com', '', None)
+            start = time.perf_counter()
+            render_template('main/skills/list.html', skills=skills, forecasts=forecasts)
+            timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--skills', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app({'TESTING': True})
+
+    # Primo render a vuoto per escludere la compilazione del template
+    measure(app, Skill, 10, 1)
+
+    before = measure(app, LegacySkill, args.skills, args.repeat)
+    after = measure(app, Skill, args.skills, args.repeat)
+
+    print(f'Render di {args.skills} skill (migliore su {args.repeat} run)')
+    print(f'  prima (ricalcolo):    {before * 1000:8.1f} ms')
+    print(f'  dopo (memorizzato):   {after * 1000:8.1f} ms')
+    print(f'  speedup:              {before / after:8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
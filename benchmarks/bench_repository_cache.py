@@ -0,0 +1,94 @@
+"""
+Benchmark: letture dei repository della dashboard con e senza cache.
+
+Ogni "richiesta" è un nuovo request context GET che esegue le letture
+della dashboard passate dai repository (skills, statistiche di skills e
+sessioni, categorie con conteggio) per un utente con --skills skill e
+--sessions sessioni, con REPOSITORY_CACHE_BACKEND:
+- None: ogni lettura è una query;
+- 'memory': LRU del processo;
+- 'sqlite': file condiviso dai worker (lettura + unpickle).
+
+Uso (dalla radice del progetto):
+    python benchmarks/bench_repository_cache.py [--skills 50] [--sessions 50000] [--requests 500]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import g  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.db import init_db  # noqa: E402
+from app.modelli import User  # noqa: E402
+from app.repositories import CategoryRepository, SessionRepository, SkillRepository  # noqa: E402
+
+
+def build_database(path, skills, sessions):
+    app = create_app({'DATABASE': path})
+    with app.app_context():
+        init_db()
+    db = sqlite3.connect(path)
+    db.execute("INSERT INTO users (id, username, email, password_hash) VALUES (1, 'bench', 'b@example.com', 'x')")
+    category_ids = [db.execute("INSERT INTO categories (name, user_id) VALUES (?, 1)", (f'Categoria {i}',)).lastrowid
+                    for i in range(10)]
+    skill_ids = [db.execute('INSERT INTO skills (name, user_id, category_id, total_xp) VALUES (?, 1, ?, ?)',
+                            (f'Skill {i}', category_ids[i % 10], i * 100)).lastrowid
+                 for i in range(skills)]
+    db.executemany(
+        'INSERT INTO sessions (skill_id, user_id, date, duration_minutes, xp_gained) VALUES (?, 1, ?, 30, 60)',
+        ((skill_ids[i % skills], f'2025-{1 + i % 12:02d}-{1 + i % 28:02d}') for i in range(sessions))
+    )
+    db.commit()
+    db.close()
+
+
+def dashboard_reads():
+    SkillRepository.get_all_by_user(1)
+    SkillRepository.get_stats_by_user(1)
+    SessionRepository.get_stats_by_user(1)
+    CategoryRepository.get_with_skill_count(1)
+
+
+def measure(app, requests):
+    user = User(1, 'bench', 'b@example.com', '', None)
+    timings = []
+    for _ in range(requests):
+        with app.test_request_context('/'):
+            g.user = user
+            started = time.perf_counter()
+            dashboard_reads()
+            timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--skills', type=int, default=50)
+    parser.add_argument('--sessions', type=int, default=50000)
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        build_database(database, args.skills, args.sessions)
+
+        print(f'Letture della dashboard, {args.skills} skill e {args.sessions} sessioni '
+              f'({args.requests} richieste)')
+        print(f'  {"backend":8s} {"mediana":>10s} {"p99":>10s}')
+        for backend in (None, 'memory', 'sqlite'):
+            app = create_app({'DATABASE': database, 'REPOSITORY_CACHE_BACKEND': backend,
+                              'REPOSITORY_CACHE_PATH': os.path.join(tmp, 'cache.db')})
+            measure(app, 5)  # riempie la cache
+            median, p99 = measure(app, args.requests)
+            print(f'  {str(backend):8s} {median * 1000:8.2f}ms {p99 * 1000:8.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Benchmark: richieste al secondo del server HTTP.
+
+Confronta, con lo stesso carico (più processi client che chiamano
+/api/v1/stats in sequenza, una connessione per richiesta):
+- "werkzeug": il server di sviluppo di Werkzeug multithread (come
+  `flask run` / `python run.py`), un solo processo;
+- "serve": il server di produzione di app/serve.py con --workers processi
+  worker da --threads thread ciascuno.
+
+Con un solo processo tutte le richieste condividono il GIL; con i worker
+preforkati il throughput cresce con i core disponibili.
+
+Uso (dalla radice del progetto, solo Linux/macOS):
+    python benchmarks/bench_serve.py [--workers 4] [--threads 8] [--clients 8] [--seconds 5]
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from app.db import init_db  # noqa: E402
+from app.repositories.api_token_repository import hash_token  # noqa: E402
+
+TOKEN = 'bench-token'
+PATH = '/api/v1/stats'
+
+
+def build_database(app, sessions):
+    with app.app_context():
+        init_db()
+    db = sqlite3.connect(app.config['DATABASE'])
+    db.execute("INSERT INTO users (id, username, email, password_hash) VALUES (1, 'bench', 'b@example.com', 'x')")
+    db.execute('INSERT INTO api_tokens (token_hash, user_id) VALUES (?, 1)', (hash_token(TOKEN),))
+    skill_ids = [db.execute('INSERT INTO skills (name, user_id) VALUES (?, 1)', (f'Skill {i}',)).lastrowid
+                 for i in range(20)]
+    db.executemany(
+        "INSERT INTO sessions (skill_id, user_id, date, duration_minutes, xp_gained) VALUES (?, 1, '2026-01-01', 30, 60)",
+        ((skill_ids[i % 20],) for i in range(sessions))
+    )
+    db.commit()
+    db.close()
+
+
+def client(port, seconds, results):
+    headers = {'Authorization': f'Bearer {TOKEN}'}
+    done = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        try:
+            connection.request('GET', PATH, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status == 200:
+                done += 1
+            else:
+                errors += 1
+        except OSError:
+            errors += 1
+        finally:
+            connection.close()
+    results.put((done, errors))
+
+
+def measure(port, clients, seconds):
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=client, args=(port, seconds, results))
+                 for _ in range(clients)]
+    for process in processes:
+        process.start()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return sum(done for done, _ in totals) / seconds, sum(errors for _, errors in totals)
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'porta {port} non raggiungibile')
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def run_werkzeug(config, port):
+    import logging
+    from werkzeug.serving import make_server
+    # Come SERVE_ACCESS_LOG = False: nessuna riga di log per richiesta
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', port, create_app(config), threaded=True)
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    server.serve_forever()
+
+
+def run_serve(config, port, workers):
+    from app.serve import serve
+    serve(lambda: create_app(config), create_app(config).config, port=port, workers=workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--sessions', type=int, default=10000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = {'DATABASE': os.path.join(tmp, 'bench.db'), 'SERVE_THREADS': args.threads,
+                  'SCHEDULER_IDLE_SECONDS': 3600}
+        build_database(create_app(config), args.sessions)
+
+        print(f'{args.clients} client per {args.seconds:g}s su {PATH} '
+              f'({args.workers} worker x {args.threads} thread)')
+        for name, target, extra in (('werkzeug', run_werkzeug, ()),
+                                    ('serve', run_serve, (args.workers,))):
+            port = free_port()
+            server = multiprocessing.Process(target=target, args=(config, port) + extra)
+            server.start()
+            try:
+                wait_for_port(port)
+                rate, errors = measure(port, args.clients, args.seconds)
+            finally:
+                os.kill(server.pid, signal.SIGTERM)
+                server.join(30)
+            print(f'  {name:9s} {rate:8.0f} richieste/s  ({errors} errori)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Benchmark: avvio a freddo di un processo (come un worker appena creato).
+
+Ogni run è un interprete Python nuovo che importa l'app, esegue
+create_app e serve la prima richiesta (pagina di login, con base.html):
+- "senza cache": ogni processo compila i template;
+- "bytecode": cache del bytecode Jinja già riempita
+  (flask precompile-templates), il processo la legge da file.
+
+I tempi sono quelli registrati dall'app (app.extensions['startup']).
+
+Uso (dalla radice del progetto):
+    python benchmarks/bench_startup.py [--runs 10]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COLD_START = '''
+import json, sys
+from app import create_app
+app = create_app({'DATABASE': sys.argv[1], 'JINJA_BYTECODE_CACHE_DIR': sys.argv[2] or None})
+app.test_client().get('/auth/login')
+print(json.dumps(app.extensions['startup']))
+'''
+
+
+def cold_start(database, cache_dir):
+    output = subprocess.run([sys.executable, '-c', COLD_START, database, cache_dir or ''],
+                            cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        cache_dir = os.path.join(tmp, 'jinja_cache')
+        # Riempie la cache (come flask precompile-templates)
+        cold_start(database, cache_dir)
+
+        print(f'Mediana su {args.runs} processi nuovi')
+        print(f'  {"":12s} {"import":>8s} {"create_app":>11s} {"1a richiesta":>13s}')
+        for name, directory in (('senza cache', None), ('bytecode', cache_dir)):
+            runs = [cold_start(database, directory) for _ in range(args.runs)]
+            median = {key: sorted(run[key] for run in runs)[len(runs) // 2]
+                      for key in ('import_ms', 'factory_ms', 'first_request_ms')}
+            print(f'  {name:12s} {median["import_ms"]:6.1f}ms {median["factory_ms"]:9.1f}ms '
+                  f'{median["first_request_ms"]:11.1f}ms')
+
+
+if __name__ == '__main__':
+    main()